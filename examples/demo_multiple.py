@@ -11,7 +11,9 @@ agent = LAgent(name="multiple",
                http_endpoint="http://agent.mydomain.xyz/multiply",
                description="demo agent for multiple",
                private_key=os.environ['MULTIPLY_AGENT_PRIVATE_KEY'],
-               agent_id=os.environ['MULTIPLY_AGENT_AGENT_ID'])
+               agent_id=os.environ['MULTIPLY_AGENT_AGENT_ID'],
+               # resolved and connected to at startup, so the first request doesn't pay for it
+               depends_on=[os.environ['PLUS_AGENT_AGENT_ID']])
 
 
 class Param(Model):
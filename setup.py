@@ -24,6 +24,11 @@ setup(
         "python-dotenv>=1.0.1",
         "pydantic>=2.6.4"
     ],
-    extras_require={},
+    extras_require={
+        # compact agent-to-agent bodies, see utils/codec.py
+        "binary": ["msgpack>=1.0.0", "cbor2>=5.4.0", "zstandard>=0.22.0"],
+        # serving async handlers on an event loop, see LAgent.run(asgi=True)
+        "asgi": ["uvicorn>=0.23.0"],
+    },
     license="AGPL-3.0",
 )
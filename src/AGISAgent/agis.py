@@ -1,3 +1,4 @@
+import logging
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -6,12 +7,23 @@ from prompt_factory.prompt_assembler import PromptAssembler
 from prompt_factory.core_prompt import CorePrompt
 from pyagentlayer import LAgent, Model, Context, run_agent
 import tools.openai_api as openai_api
+from tools.finding_clusters import cluster_findings
+from tools.audit_store import FindingsStore, focus_instruction, split_units, unit_keys
 # 1. create agent
 agent = LAgent(name="AgeisAgent",
                description="This is a code audit agent",
                http_endpoint=f"http://agent.mydomain.xyz/hello_world222",
                private_key=os.environ['HELLO_WORLD_PRIVATE_KEY'],
                agent_id=os.environ['HELLO_WORLD_AGENT_ID'])
+# findings of earlier submissions per contract / function, see AUDIT_STORE_PATH in tools/audit_store.py
+findings_store = FindingsStore()
+
+
+def audit_version():
+    # stored findings are only reused by audits with the same prompts and models
+    prompts=[PromptAssembler.assemble_prompt(""),PromptAssembler.assemble_vul_check_prompt("",""),CorePrompt.assumation_prompt()]
+    models=[str(openai_api.stage_model(stage)) for stage in (None,"detect","vul_check","assumption")]
+    return "\n".join(prompts+models)
 
 
 # 2. define agent's protocol , including request and response schema 
@@ -21,26 +33,50 @@ class Param(Model):
 
 class Response(Model):
     code: int
-    data: str
+    data: list[str]
+    # units (`<contract>`, `<contract>.<function>`, `<file>`) audited again, the findings of the others were reused
+    recomputed: list[str] = []
 
 
 @agent.on_message("hello", Param, Response)
 def hello(ctx: Context, param: Param):
     code=param.msg
+    # resubmissions only have their changed units and the units depending on them audited again
+    keys=unit_keys(split_units(code),audit_version())
+    reused,recomputed=findings_store.lookup(keys)
+    if not recomputed:
+        return Response(code=0, data=reused, recomputed=[])
     prompt=PromptAssembler.assemble_prompt(code)
+    if len(recomputed)<len(keys):
+        prompt+=focus_instruction(recomputed)
+    # the filter stages (vul_check, assumption) may use a cheaper model, see OPENAI_MODEL_ID_<STAGE> in tools/openai_api.py.
+    # only vul_check escalates to the strong model, the assumption prompt answers need / dont need without a confidence
+    stats=openai_api.StageStats()
+    vul_results=[openai_api.ask_openai_common(prompt,stage="detect",stats=stats) for i in range(10)]
+    # ask_openai_common answers '' when the call failed, an audit with a failed call is not stored
+    complete=all(vul_result.strip() for vul_result in vul_results)
     res=[]
-    for i in range(10):
-        vul_res=openai_api.ask_openai_common(prompt)
+    # samples often describe the same bug, verify one finding per group of near-duplicates and apply the verdict to the group
+    for cluster in cluster_findings(vul_results,code):
+        vul_res=vul_results[cluster[0]]
+        if not vul_res.strip():
+            continue
         vul_check_prompt=PromptAssembler.assemble_vul_check_prompt(code,vul_res)
-        vul_check_res=openai_api.ask_openai_common(vul_check_prompt)
+        vul_check_res=openai_api.ask_with_escalation(vul_check_prompt,"vul_check",stats=stats)
+        complete=complete and bool(vul_check_res.strip())
         if '"result":"yes' in vul_check_res or '"result": "yes"' in vul_check_res:
             assumption_prompt=code+"\n\n"+vul_res+"\n\n"+CorePrompt.assumation_prompt()
-            assumption_res=openai_api.ask_openai_common(assumption_prompt)
+            assumption_res=openai_api.ask_openai_common(assumption_prompt,stage="assumption",stats=stats)
+            complete=complete and bool(assumption_res.strip())
             if "dont need In-project other contract" in assumption_res:
-                res.append(vul_res)
-
+                res.extend(vul_results[i] for i in cluster)
 
-    return Response(code=0, data=res)
+    if complete:
+        findings_store.record(keys,recomputed,res)
+    else:
+        logging.warning(f"audit stage calls failed, findings of units {recomputed} not stored")
+    logging.info(f"audit stages (calls, latency in s, tokens per stage): {stats.summary()}, recomputed units: {recomputed}")
+    return Response(code=0, data=reused+res, recomputed=recomputed)
 
 
 # 3. run agent
@@ -1,3 +1,5 @@
 from .agent import LAgent
+from .agent_host import AgentHost
 from .models import Model, Context, SubscriptionPeriodEnum, SubscriptionPlan
 from .utils.command import run_agent
+from .registry_client import AbstractRegistryClient, OnChainAgentRegistryClient, InMemoryRegistryClient, SQLiteRegistryClient
@@ -0,0 +1,252 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+import weakref
+from typing import Callable
+
+from .metrics import REGISTRY
+from .utils.exceptions import OverloadedException
+
+# default queue weights per caller tier, a paying caller waits behind 1/4 of the free callers
+DEFAULT_TIER_WEIGHTS = {
+    "free": 1,
+    "weekly": 2,
+    "monthly": 3,
+    "yearly": 4,
+}
+
+_controllers = weakref.WeakSet()
+rejected_requests = REGISTRY.counter("agent_admission_rejected_total", "Requests rejected by admission control per reason.", ["reason"])
+REGISTRY.gauge("agent_admission_queue_depth", "Requests waiting for a worker slot.", lambda: sum(c.queue_depth for c in list(_controllers)))
+REGISTRY.gauge("agent_admission_active", "Requests holding a worker slot.", lambda: sum(c.active for c in list(_controllers)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # take one token, return 0 on success or the seconds until the next token is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    def __init__(self, caller: str, notify: Callable[[], None] | None = None):
+        self.caller = caller
+        self.event = threading.Event()
+        # called with the controller lock held once the waiter is admitted, wakes up async waiters
+        self.notify = notify
+        self.admitted = False
+
+    def wake(self):
+        self.admitted = True
+        self.event.set()
+        if self.notify is not None:
+            self.notify()
+
+
+class AdmissionSlot:
+    """
+    a worker slot held by one request, released once whatever the number of `release` calls.
+    """
+
+    def __init__(self, controller: "AdmissionController", caller: str):
+        self.controller = controller
+        self.caller = caller
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class AdmissionController:
+    """
+    per-caller admission control in front of the request handlers.
+
+    at most `max_concurrency` requests run at once, the others wait in a weighted fair queue: each caller's requests get
+    virtual finish tags spaced by 1/weight, and a freed slot goes to the smallest tag, so a caller with weight 4 is
+    served four times as often as a caller with weight 1 while both have requests waiting, and a single caller
+    can't starve the others whatever it sends.
+
+    a caller is limited to `caller_concurrency` requests running or queued and, when `caller_rate` is set, to
+    `caller_rate` requests per second (bursts of `caller_burst`). requests over a limit, over `max_queue` waiting
+    requests or waiting longer than `queue_timeout` seconds are rejected with OverloadedException.
+    """
+
+    def __init__(self, max_concurrency=16, max_queue=64, queue_timeout=10.0, caller_concurrency=4,
+                 caller_rate: float | None = None, caller_burst: float | None = None, tier_weights: dict | None = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.caller_concurrency = caller_concurrency
+        self.caller_rate = caller_rate
+        self.caller_burst = caller_burst or caller_rate
+        # weights by tier name (see DEFAULT_TIER_WEIGHTS), None weighs every caller the same
+        self.tier_weights = tier_weights
+
+        self.active = 0
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._inflight = {}
+        self._buckets = {}
+        self._queue = []
+        self._seq = itertools.count()
+        # EWMA of the time a request holds its slot, to estimate Retry-After
+        self._service_time = 0.1
+        self._lock = threading.Lock()
+        _controllers.add(self)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def weight_of(self, tier: str | None) -> float:
+        if not self.tier_weights:
+            return 1.0
+        return float(self.tier_weights.get(tier or "free", 1))
+
+    def acquire(self, caller: str, weight: float = 1.0) -> AdmissionSlot:
+        """
+        wait for a worker slot for `caller`, raise OverloadedException when the request is rejected.
+        """
+        waiter = _Waiter(caller)
+        slot = self._enqueue(waiter, weight)
+        if slot is not None:
+            return slot
+        waiter.event.wait(self.queue_timeout)
+        return self._admitted(waiter)
+
+    async def acquire_async(self, caller: str, weight: float = 1.0) -> AdmissionSlot:
+        """
+        `acquire` for an event loop, waiting in the queue doesn't hold a thread.
+        """
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+            except RuntimeError:
+                # loop closed, the waiter is given up below
+                pass
+
+        waiter = _Waiter(caller, notify)
+        slot = self._enqueue(waiter, weight)
+        if slot is not None:
+            return slot
+        try:
+            await asyncio.wait({admitted}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        return self._admitted(waiter)
+
+    def _enqueue(self, waiter: _Waiter, weight: float) -> AdmissionSlot | None:
+        # a slot when one is free, else queue the waiter (None), raise OverloadedException over a limit
+        caller = waiter.caller
+        with self._lock:
+            if self.caller_rate:
+                bucket = self._buckets.get(caller)
+                if bucket is None:
+                    bucket = self._buckets[caller] = TokenBucket(self.caller_rate, self.caller_burst)
+                wait = bucket.take()
+                if wait:
+                    self._reject("caller_rate", wait)
+            if self._inflight.get(caller, 0) >= self.caller_concurrency:
+                self._reject("caller_concurrency", self._retry_after())
+            if self.active < self.max_concurrency and not self._queue:
+                self.active += 1
+                self._inflight[caller] = self._inflight.get(caller, 0) + 1
+                return AdmissionSlot(self, caller)
+            if len(self._queue) >= self.max_queue:
+                self._reject("queue_full", self._retry_after())
+
+            start = max(self._virtual_time, self._last_finish.get(caller, 0.0))
+            finish = start + 1.0 / max(weight, 1e-6)
+            self._last_finish[caller] = finish
+            heapq.heappush(self._queue, (finish, next(self._seq), start, waiter))
+            self._inflight[caller] = self._inflight.get(caller, 0) + 1
+            return None
+
+    def _admitted(self, waiter: _Waiter) -> AdmissionSlot:
+        with self._lock:
+            if waiter.admitted:
+                return AdmissionSlot(self, waiter.caller)
+            # timed out, leave the queue
+            self._leave(waiter)
+            self._reject("queue_timeout", self._retry_after())
+
+    def _abandon(self, waiter: _Waiter):
+        # the waiting request went away (e.g. client disconnected), give back its place or the slot it was handed
+        with self._lock:
+            if not waiter.admitted:
+                self._leave(waiter)
+                return
+        AdmissionSlot(self, waiter.caller).release()
+
+    def _leave(self, waiter: _Waiter):
+        self._queue = [item for item in self._queue if item[3] is not waiter]
+        heapq.heapify(self._queue)
+        self._done(waiter.caller)
+
+    def _release(self, slot: AdmissionSlot):
+        with self._lock:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - slot.started_at)
+            self._done(slot.caller)
+            if self._queue:
+                # hand the slot over to the smallest finish tag
+                _, _, start, waiter = heapq.heappop(self._queue)
+                self._virtual_time = max(self._virtual_time, start)
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    def _done(self, caller: str):
+        remaining = self._inflight.get(caller, 1) - 1
+        if remaining > 0:
+            self._inflight[caller] = remaining
+        else:
+            self._inflight.pop(caller, None)
+            self._last_finish.pop(caller, None)
+            bucket = self._buckets.get(caller)
+            if bucket is not None and bucket.tokens >= bucket.burst:
+                # a full bucket holds no state worth keeping
+                self._buckets.pop(caller, None)
+
+    def _retry_after(self) -> float:
+        return (len(self._queue) + 1) * self._service_time / self.max_concurrency
+
+    def _reject(self, reason: str, retry_after: float):
+        rejected_requests.inc(reason)
+        raise OverloadedException(reason, retry_after=max(1, math.ceil(retry_after)), queue_depth=len(self._queue))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "queue_depth": len(self._queue),
+                "callers": len(self._inflight),
+                "service_time_ms": round(self._service_time * 1000, 2),
+            }
@@ -1,14 +1,18 @@
 # -*- coding:utf-8 -*-
+import asyncio
+import contextvars
 import functools
 import hashlib
+import inspect
 import json
 import logging
 import math
 import os
 import sys
-import threading
+import time
 import types
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Type, Optional, Union, Set, List
 from urllib.parse import urlparse
@@ -18,17 +22,37 @@ from eth_account import Account
 from eth_account.messages import encode_defunct
 from flask import Flask, request as flask_request
 from flask import Response as FlaskResponse
+from pydantic import BaseModel
 from web3 import Web3
+from werkzeug.exceptions import RequestEntityTooLarge
 
+# asgi server, optional, install it with `pip install PyAgentlayer[asgi]`
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+from .admission import AdmissionController
+from .asgi import AgentASGIApp
+from .agent_index import AgentIndex, AgentIndexCrawler
 from .agent_executor import new_smart_wallet_factory, \
     new_smart_wallet, new_agent_token_contract, new_subscription_contract, SmartWallet, Subscription, AgentToken
-from .agent_link import AgentLink
-from .agent_logger import monitor_new_onchain_log, OnChainLog, record_log, record_log_sync
+from .agent_link import AgentLink, METADATA_REF_HEADER, ACCEPT_POST_HEADER, ACCEPT_ENCODING_HEADER
+from .agent_logger import OnChainLog, record_log, record_log_sync, start_log_shipper
+from . import deadline, metrics, tracing
 from .models import AgentMetadata, SubscriptionPlan, SubscriptionPeriodEnum
+from .process_pool import ProcessPool
 from .models import Context
 from .models import ErrorMessage, Model
-from .registry_client import OnChainAgentRegistryClient
-from .utils.exceptions import AuthorizationException
+from .registry_client import AbstractRegistryClient, LocalRegistryClient, OnChainAgentRegistryClient
+from .session import SessionTokens, SESSION_HEADER, SESSION_ROUTE, SESSION_ROUTE_HEADER
+from .signature_cache import SignatureCache
+from .utils import aio, codec
+from .utils.exceptions import AuthorizationException, OverloadedException
+from .utils.sse import stream_events, SSE_MIMETYPE, SSE_HEADERS, HEARTBEAT_INTERVAL
+
+# task id of the request being handled, per request rather than per agent as requests overlap (threads, asgi tasks)
+_task_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("task_id", default=None)
 
 
 class LAgent:
@@ -43,7 +67,7 @@ class LAgent:
     # component for on-chain operation
     w3: Web3
     agent_token: AgentToken
-    agent_client: OnChainAgentRegistryClient
+    agent_client: AbstractRegistryClient
     agent_link: AgentLink
     subscription: Subscription
 
@@ -62,16 +86,34 @@ class LAgent:
     # agent icon image
     image: str | None
 
-    _api_list: dict | None
+    # (info, document, serialized document, etag) of the api description served on GET /
+    _api_document: tuple | None
 
     def __init__(self, name: str, private_key: str = None, message_hash: str = None, signature: str = None,
                  http_endpoint: str = None, agent_id: int | None = None, description: str | None = None, version: str = "1.0.0",
-                 image: str | None = None, payable: bool = False, subscription_plan: List[SubscriptionPlan] | None = None):
+                 image: str | None = None, payable: bool = False, subscription_plan: List[SubscriptionPlan] | None = None,
+                 registry_client: AbstractRegistryClient | None = None, agent_index: AgentIndex | None = None,
+                 depends_on: list[int] | None = None, open_dependency_sessions: bool = False):
         try:
             self.agent_id = int(agent_id)
         except:
             self.agent_id = None
 
+        # on-chain registry unless another backend is given, e.g. InMemoryRegistryClient for local fleets
+        self._registry_client = registry_client
+        # local searchable index of registered agents, see search_agents
+        self.agent_index = agent_index
+        self._agent_index_crawler = None
+        # verified caller signatures, replaced by a shared cache when mounted on an AgentHost
+        self.signature_cache = SignatureCache()
+        # session tokens handed to verified subscribers, see open_session
+        self.session_tokens = SessionTokens()
+        # caller wallet -> (subscription tier, expires at), weighs admitted requests
+        self._caller_tiers = {}
+        # agents called by the handlers, warmed up by initialize, see prefetch_dependencies
+        self.depends_on = [int(agent_id) for agent_id in depends_on or []]
+        self.open_dependency_sessions = open_dependency_sessions
+
         # prepare executors
         if private_key:
             self._init_with_private_key(private_key=private_key)
@@ -84,15 +126,15 @@ class LAgent:
         if payable and not self.subscription_plan:
             raise ValueError("subscription_plan must be provide when payable is true")
 
-        self.task_id = None
-
         self.metadata = AgentMetadata(key=str(uuid.uuid4()), name=name, description=description, version=version,
                                       endpoint=http_endpoint, register_time=int(datetime.now().timestamp()))
         self.message_hash = message_hash
         self.signature = signature
         self.message_route = {}
         self.image = image
-        self._api_list = None
+        self._api_document = None
+        # cid of the registered metadata, sent instead of the full metadata to agents that can resolve it
+        self.metadata_cid = None
 
     def _init_with_private_key(self, private_key: str):
         #  convert private key to wallet
@@ -100,7 +142,7 @@ class LAgent:
         self.wallet_address = self.wallet.address
         self.agent_token = new_agent_token_contract(account=self.wallet)
         self.w3 = self.agent_token.w3
-        self.agent_client = OnChainAgentRegistryClient(wallet=self.wallet)
+        self.agent_client = self._agent_registry() or OnChainAgentRegistryClient(wallet=self.wallet)
         self.agent_link = AgentLink(self.agent_client)
 
     def _init_with_signature(self, message_hash: str, signature: str):
@@ -109,9 +151,15 @@ class LAgent:
         self.wallet_address = recovered_address
         self.agent_token = new_agent_token_contract(account_address=self.wallet_address)
         self.w3 = self.agent_token.w3
-        self.agent_client = OnChainAgentRegistryClient(wallet_address=self.wallet_address)
+        self.agent_client = self._agent_registry() or OnChainAgentRegistryClient(wallet_address=self.wallet_address)
         self.agent_link = AgentLink(self.agent_client)
 
+    def _agent_registry(self) -> AbstractRegistryClient | None:
+        # a local registry may be shared by several agents, each one acts through a view bound to its own wallet
+        if isinstance(self._registry_client, LocalRegistryClient):
+            return self._registry_client.for_wallet(self.wallet_address)
+        return self._registry_client
+
     # check aa_wallet and subscription info before initialize/register/subscribe/wrap_agent
     def _check_aa_wallet_and_subscription(self):
         # init aa wallet
@@ -136,6 +184,8 @@ class LAgent:
             raise ValueError(f"owner of agent_id {self.agent_id} mismatch with account {self.wallet.address}")
 
         self.metadata = self.agent_client.get_agent_meta(self.agent_id)
+        self.metadata_cid = self._registered_metadata_cid()
+        self.prefetch_dependencies()
         logging.info(f"init agent success.\n\n" + self.info())
 
     def register(self):
@@ -145,7 +195,7 @@ class LAgent:
         self.metadata.wallet = self.wallet.address
         self.metadata.contract_wallet = self.aa_wallet_address
         # upload agent icon to ipfs
-        if self.image:
+        if self.image and getattr(self.agent_client, "ipfs_client", None):
             if os.path.exists(self.image) or urlparse(self.image).scheme in ['http', 'https']:
                 image_cid = self.agent_client.ipfs_client.upload_file(self.image)
                 self.metadata.image = image_cid
@@ -153,9 +203,20 @@ class LAgent:
                 logging.warning(f"image file not found at {self.image}, skip uploading to ipfs")
 
         self.agent_id = self.agent_client.register(self.metadata)
+        self.metadata_cid = self._registered_metadata_cid()
         logging.info(f"register agent success.\n\n{self.info()}")
         return self.agent_id
 
+    def _registered_metadata_cid(self) -> str | None:
+        agent_nft = getattr(self.agent_client, "agent_nft", None)
+        if agent_nft is None or self.agent_id is None:
+            return None
+        try:
+            return agent_nft.token_uri(self.agent_id)
+        except Exception as e:
+            logging.warning(f"read metadata cid of agent {self.agent_id} failed with error message {e}")
+            return None
+
     def subscribe(self, target_agent_id, period: SubscriptionPeriodEnum, auto_renewal=False):
         self._check_aa_wallet_and_subscription()
         target_agent_meta = self.agent_client.get_agent_meta(target_agent_id)
@@ -204,18 +265,42 @@ class LAgent:
             raise ValueError(f"subscribe to agent {target_agent_id} failed.")
         logging.info("subscribe success")
 
-    def _register_message(self, key, func, parameters, response):
+    def _register_message(self, key, func, parameters, response, pool: ProcessPool | None = None, depends_on: list[int] | None = None):
         self.message_route[key] = {
             "method": func,
             "parameter": parameters,
-            "response": response
+            "response": response,
+            # swagger path and definitions of the route, built once here instead of on every GET /
+            "api": self._route_api(parameters, response),
+            "pool": pool,
+            "depends_on": [int(agent_id) for agent_id in depends_on or []]
         }
-
-    def on_message(self, name: str = None, request_type: Type[Model] = None, response_type: Optional[Union[Type[Model], Set[Type[Model]], Type[FlaskResponse]]] = None):
+        self._api_document = None
+
+    def on_message(self, name: str = None, request_type: Type[Model] = None, response_type: Optional[Union[Type[Model], Set[Type[Model]], Type[FlaskResponse]]] = None,
+                   executor: str | None = None, max_workers: int | None = None, depends_on: list[int] | None = None,
+                   shared_buffers: bool = False):
+        """
+        register a handler. `executor="process"` runs it in a pool of `max_workers` processes (default one per cpu),
+        for cpu bound handlers, which must then be module level functions returning a Model or a dict. with
+        `shared_buffers` their large bytes fields are read-only memoryviews over shared memory, valid until they return.
+        `depends_on` lists the agents the handler calls, see `prefetch_dependencies`.
+        """
+        if executor not in (None, "thread", "process"):
+            raise ValueError(f"unknown executor {executor}, should be thread or process")
 
         def decorator(func):
             _name = func.__name__ if name is None else name
-            self._register_message(_name, func, request_type, response_type)
+            pool = None
+            if executor == "process":
+                if inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func):
+                    raise ValueError(f"streaming handler {_name} can't run in a process pool")
+                pool = ProcessPool(_name, max_workers, shared_buffers=shared_buffers)
+            self._register_message(_name, func, request_type, response_type, pool, depends_on)
+
+            if pool is not None or inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func):
+                # async handlers stay awaitable when called directly, pooled ones picklable
+                return func
 
             @functools.wraps(func)
             def handler(*args, **kwargs):
@@ -225,7 +310,7 @@ class LAgent:
 
         return decorator
 
-    def send(self, agent_id, method, parameters, sync=True):
+    def _sign_calls(self):
         if not self.message_hash or not self.signature:
             if not self.wallet:
                 raise ValueError("message hash and signature are required when not provide private key.")
@@ -234,59 +319,272 @@ class LAgent:
             self.message_hash = signed_message.messageHash.hex()
             self.signature = signed_message.signature.hex()
 
-        logging.debug(f"call agent {agent_id}: {method} {parameters}")
-        return self.agent_link.call(agent_id, self.task_id, method, parameters, self.metadata, message_hash=self.message_hash, signature=self.signature, sync=sync)
+    def _metadata_ref(self) -> str | None:
+        return f"{self.agent_id}:{self.metadata_cid}" if self.metadata_cid and self.agent_id is not None else None
 
-    def _authorized(self, caller_metadata: AgentMetadata | None, caller_message_hash: str = None, caller_signature: str = None) -> bool:
+    def send(self, agent_id, method, parameters, sync=True, response_type: Type[Model] | None = None, timeout: float | None = None, hedge=False):
+        self._sign_calls()
+        # ids often come from the environment as strings, the link caches by int
+        agent_id = int(agent_id)
+        logging.debug(f"call agent {agent_id}: {method} {parameters}")
+        return self.agent_link.call(agent_id, _task_id.get(), method, parameters, self.metadata, message_hash=self.message_hash, signature=self.signature, sync=sync,
+                                   response_type=response_type, timeout=timeout, hedge=hedge, metadata_ref=self._metadata_ref())
+
+    def dependencies(self) -> list[int]:
+        # agents given to the constructor and to on_message, in order
+        agent_ids = list(self.depends_on)
+        for route in self.message_route.values():
+            agent_ids.extend(route["depends_on"])
+        return list(dict.fromkeys(agent_ids))
+
+    def prefetch_dependencies(self, open_sessions: bool | None = None, timeout: float | None = None) -> dict:
+        """
+        resolve the metadata of the agents this one calls, open pooled connections to them and, with `open_sessions`
+        (default `open_dependency_sessions`), get a session token from each, all concurrently. a failure is only
+        logged, the first call to that agent then pays for it. returns the error per agent id, None when warmed up.
+        """
+        agent_ids = self.dependencies()
+        if not agent_ids:
+            return {}
+        open_sessions = self.open_dependency_sessions if open_sessions is None else open_sessions
+        if open_sessions:
+            self._sign_calls()
+
+        def warm_up(agent_id):
+            self.agent_link.warm_up(agent_id, timeout=timeout)
+            if open_sessions:
+                self.agent_link.session_token(agent_id, self.metadata, self.message_hash, self.signature, self._metadata_ref(),
+                                              timeout=timeout, force=True)
+
+        start = time.perf_counter()
+        errors = {}
+        with ThreadPoolExecutor(max_workers=min(16, len(agent_ids)), thread_name_prefix="prefetch") as pool:
+            futures = {agent_id: pool.submit(warm_up, agent_id) for agent_id in agent_ids}
+            for agent_id, future in futures.items():
+                errors[agent_id] = future.exception()
+                if errors[agent_id] is not None:
+                    logging.warning(f"prefetch agent {agent_id} failed with error message {errors[agent_id]}")
+        logging.info(f"prefetched {sum(1 for e in errors.values() if e is None)}/{len(agent_ids)} dependencies in {time.perf_counter() - start:.3f}s")
+        return errors
+
+    def sync_agent_index(self) -> int:
+        if self.agent_index is None:
+            raise ValueError("agent_index must be provided to sync registered agents")
+        if self._agent_index_crawler is None:
+            self._agent_index_crawler = AgentIndexCrawler(self.agent_index,
+                                                          agent_nft=getattr(self.agent_client, "agent_nft", None),
+                                                          ipfs_client=getattr(self.agent_client, "ipfs_client", None))
+        return self._agent_index_crawler.sync()
+
+    def search_agents(self, query: str, limit: int = 20) -> list[tuple[int, AgentMetadata]]:
+        if self.agent_index is None:
+            raise ValueError("agent_index must be provided to search registered agents")
+        return self.agent_index.search(query, limit=limit)
+
+    def _authorized(self, caller_metadata: AgentMetadata | None, caller_message_hash: str = None, caller_signature: str = None,
+                    caller_session: str = None) -> bool:
         if not self.subscription_plan:
             return True
 
         if caller_metadata:
+            if self._valid_session(caller_metadata, caller_session):
+                return True
             if not caller_message_hash or not caller_signature:
                 logging.warning("client message hash and signature are required when call_metadata is not Noe")
                 return False
 
             if (self.subscription.is_subscribed(caller_metadata.contract_wallet, self.aa_wallet_address) or
                     self.subscription.is_subscribed(caller_metadata.wallet, self.aa_wallet_address)):
-                return self.aa_wallet_contract.is_valid_signature(caller_metadata.wallet, message=caller_message_hash, signature=caller_signature)
+                return self.signature_cache.verify(caller_metadata.wallet, caller_message_hash, caller_signature,
+                                                   self.aa_wallet_contract.is_valid_signature)
 
         return False
 
-    def call_function(self, func, parameter: Model,
-                      caller_metadata: AgentMetadata | None = None,
-                      caller_message_hash: str = None,
-                      caller_signature: str = None,
-                      parent_task_id=None, log_onchain=True, with_log_queue=False) -> (bool, int, str):
-        if not self._authorized(caller_metadata, caller_message_hash, caller_signature):
+    def _valid_session(self, caller_metadata: AgentMetadata | None, caller_session: str | None) -> bool:
+        # the token must have been issued by this agent to the wallet the caller claims
+        if not caller_session or caller_metadata is None or not caller_metadata.wallet:
+            return False
+        return self.session_tokens.verify(self._session_audience(), caller_session) == caller_metadata.wallet.lower()
+
+    def _caller_key(self, remote_addr: str | None, caller_session: str = None) -> str:
+        """
+        admission control key, from what can be checked before a request is admitted: the wallet of a valid session
+        token (one hmac), else the client address.
+        the signed message of an unauthorized caller is the same for every request, anyone replaying it could use up
+        that wallet's share, so a signature alone never picks the key.
+        """
+        wallet = self.session_tokens.verify(self._session_audience(), caller_session)
+        if wallet:
+            return wallet
+        return f"ip:{remote_addr}"
+
+    def _cached_tier(self, caller_key: str) -> str | None:
+        # subscription tier of a caller, as learned when it opened its session, admission doesn't read the chain
+        tier, expires_at = self._caller_tiers.get(caller_key, (None, 0))
+        return tier if expires_at > time.time() else None
+
+    def _remember_tier(self, wallet: str, left_time: int | None, expires_at: int, max_size: int = 10000):
+        if left_time is None:
+            return
+        if len(self._caller_tiers) >= max_size:
+            self._caller_tiers.pop(next(iter(self._caller_tiers)), None)
+        self._caller_tiers[wallet.lower()] = (self._subscription_tier(left_time), expires_at)
+
+    @staticmethod
+    def _subscription_tier(left_time: int) -> str:
+        """
+        subscription tier of a caller with `left_time` seconds left in its subscription.
+        the contract doesn't expose the subscribed period, so the tier is the longest period the remaining time implies.
+        """
+        if left_time > 30 * 24 * 3600:
+            return SubscriptionPeriodEnum.YEARLY.name.lower()
+        if left_time > 7 * 24 * 3600:
+            return SubscriptionPeriodEnum.MONTHLY.name.lower()
+        return SubscriptionPeriodEnum.WEEKLY.name.lower()
+
+    def _subscription_left_time(self, caller_metadata: AgentMetadata | None) -> int | None:
+        # seconds left in the caller's subscription, None when it is not subscribed (or the agent is free)
+        if not self.subscription_plan or caller_metadata is None:
+            return None
+        for wallet in (caller_metadata.contract_wallet, caller_metadata.wallet):
+            if wallet and self.subscription.is_subscribed(wallet, self.aa_wallet_address):
+                return self.subscription.get_subscription_left_time(wallet, self.aa_wallet_address)
+        return None
+
+    def open_session(self, caller_metadata: AgentMetadata | None, caller_message_hash: str = None, caller_signature: str = None) -> (str | None, int | None):
+        """
+        fully authorize a caller once and hand it a session token bound to its wallet and subscription expiry,
+        (None, None) for free agents. later calls carrying the token in X-Agent-Session skip the chain reads and
+        the signature recovery.
+        """
+        if not self.subscription_plan:
+            return None, None
+        if (caller_metadata is None or not caller_metadata.wallet
+                or not self._authorized(caller_metadata, caller_message_hash, caller_signature)):
+            raise AuthorizationException("current agent is payable,you have to subscribe before calling it")
+        left_time = self._subscription_left_time(caller_metadata)
+        token, expires_at = self.session_tokens.issue(self._session_audience(), caller_metadata.wallet,
+                                                      None if left_time is None else int(time.time()) + left_time)
+        self._remember_tier(caller_metadata.wallet, left_time, expires_at)
+        return token, expires_at
+
+    def _session_audience(self) -> str:
+        # session tokens are bound to the smart wallet of the agent issuing them
+        return getattr(self, "aa_wallet_address", None) or ""
+
+    def _authorize(self, caller_metadata: AgentMetadata | None, caller_message_hash: str, caller_signature: str, route_name: str,
+                   caller_session: str = None):
+        with tracing.start_span("agent.authorize", route=route_name) as span, metrics.authorization_latency.time(str(self.agent_id), route_name):
+            authorized = self._authorized(caller_metadata, caller_message_hash, caller_signature, caller_session)
+            span.set_attribute("authorized", authorized)
+        if not authorized:
             raise AuthorizationException("current agent is payable,you have to subscribe before calling it")
 
-        self.task_id = str(uuid.uuid4())
-        ctx = Context(
+    @property
+    def task_id(self) -> str | None:
+        # id of the request handled in the current context, requests served concurrently each see their own
+        return _task_id.get()
+
+    def _handler_context(self, caller_metadata: AgentMetadata | None) -> Context:
+        task_id = str(uuid.uuid4())
+        # kept for the rest of the request, streamed results are produced after the handler returned
+        _task_id.set(task_id)
+        return Context(
             wallet_eoa=self.wallet,
             wallet_aa=self.aa_wallet_address,
             agent_metadata=self.metadata,
-            caller_metadata=caller_metadata
+            caller_metadata=caller_metadata,
+            task_id=task_id
         )
 
+    def _record_call(self, func, caller_metadata: AgentMetadata | None, task_id: str, parent_task_id, start_time: datetime,
+                     with_log_queue: bool):
+        # record executor log
+        time_takes = int((datetime.now().timestamp() - start_time.timestamp()) * 1000)
+        logging.info(f"process request <{func.__name__}> from agent {f'{caller_metadata.name}({caller_metadata.key})' if caller_metadata else 'unknown'}, time taken: {time_takes} ms")
+        _log = OnChainLog(agent_id=self.agent_id, task_id=task_id, parent_task_id=parent_task_id, operation=func.__name__, time_takes=time_takes)
+        if with_log_queue:
+            record_log(_log, self)
+        else:
+            try:
+                record_log_sync(self, _log)
+            except Exception as e:
+                logging.warning(f"record log on-chain failed with error message {e}")
+
+    def call_function(self, func, parameter: Model,
+                      caller_metadata: AgentMetadata | None = None,
+                      caller_message_hash: str = None,
+                      caller_signature: str = None,
+                      parent_task_id=None, log_onchain=True, with_log_queue=False, route_name=None, caller_session: str = None) -> (bool, int, str):
+        route_name = func.__name__ if route_name is None else route_name
+        self._authorize(caller_metadata, caller_message_hash, caller_signature, route_name, caller_session)
+        ctx = self._handler_context(caller_metadata)
+
         start_time = datetime.now()
 
-        res = func(ctx, parameter)
+        pool = self.message_route.get(route_name, {}).get("pool")
+        handler_start = time.perf_counter()
+        with tracing.start_span("agent.handler", route=route_name, task_id=ctx.task_id):
+            if pool is not None:
+                res = pool.call(func, ctx, parameter, timeout=deadline.remaining())
+            elif inspect.iscoroutinefunction(func):
+                # async handlers served by the wsgi app run on a background event loop
+                res = aio.run_coroutine(func(ctx, parameter))
+            elif inspect.isasyncgenfunction(func):
+                res = aio.iterate(func(ctx, parameter))
+            else:
+                res = func(ctx, parameter)
+        res = self._time_handler(res, handler_start, route_name)
 
         if log_onchain:
-            # record executor log
-            time_takes = int((datetime.now().timestamp() - start_time.timestamp()) * 1000)
-            logging.info(f"process request <{func.__name__}> from agent {f'{caller_metadata.name}({caller_metadata.key})' if caller_metadata else 'unknown'}, time taken: {time_takes} ms")
-            _log = OnChainLog(agent_id=self.agent_id, task_id=self.task_id, parent_task_id=parent_task_id, operation=func.__name__, time_takes=time_takes)
-            if with_log_queue:
-                record_log(_log)
+            self._record_call(func, caller_metadata, ctx.task_id, parent_task_id, start_time, with_log_queue)
+
+        return res
+
+    async def call_function_async(self, func, parameter: Model,
+                                  caller_metadata: AgentMetadata | None = None,
+                                  caller_message_hash: str = None,
+                                  caller_signature: str = None,
+                                  parent_task_id=None, log_onchain=True, route_name=None, executor=None, caller_session: str = None):
+        """
+        call_function for the asgi app: async handlers run on the serving event loop, blocking steps (authorization
+        of payable agents, sync handlers) in `executor` threads, and logs are always queued.
+        """
+        route_name = func.__name__ if route_name is None else route_name
+        if self.subscription_plan and not self._valid_session(caller_metadata, caller_session):
+            # subscription checks read the chain
+            await aio.run_in_executor(executor, self._authorize, caller_metadata, caller_message_hash, caller_signature, route_name)
+        else:
+            self._authorize(caller_metadata, caller_message_hash, caller_signature, route_name, caller_session)
+        ctx = self._handler_context(caller_metadata)
+
+        start_time = datetime.now()
+
+        pool = self.message_route.get(route_name, {}).get("pool")
+        handler_start = time.perf_counter()
+        with tracing.start_span("agent.handler", route=route_name, task_id=ctx.task_id):
+            if pool is not None:
+                res = await pool.call_async(func, ctx, parameter, timeout=deadline.remaining())
+            elif inspect.iscoroutinefunction(func):
+                res = await func(ctx, parameter)
+            elif inspect.isasyncgenfunction(func):
+                res = func(ctx, parameter)
             else:
-                try:
-                    record_log_sync(self, _log)
-                except Exception as e:
-                    logging.warning(f"record log on-chain failed with error message {e}")
+                res = await aio.run_in_executor(executor, func, ctx, parameter)
+        res = self._time_handler(res, handler_start, route_name)
+
+        if log_onchain:
+            self._record_call(func, caller_metadata, ctx.task_id, parent_task_id, start_time, with_log_queue=True)
 
         return res
 
+    def _time_handler(self, res, start: float, route_name: str):
+        # streamed results are timed until the stream ends, the handler runs while it is iterated
+        if hasattr(res, "__anext__") or hasattr(res, "__next__"):
+            return metrics.handler_latency.time_stream(res, start, str(self.agent_id), route_name)
+        metrics.handler_latency.observe(time.perf_counter() - start, str(self.agent_id), route_name)
+        return res
+
     def _pretty_payment(self):
         if not self.subscription_plan:
             return "Free"
@@ -336,80 +634,280 @@ class LAgent:
                f"Endpoint: {self.metadata.endpoint}\n" \
                f"Register Time: {self.metadata.register_time}\n\n"
 
-    def api_list(self):
-        if self._api_list:
-            return self._api_list
+    @classmethod
+    def _route_api(cls, parameter_type, response_type) -> (dict, dict):
         definitions = {}
-        paths = {}
-        for k, v in self.message_route.items():
-            name = k
-            parameter_json_schema = v.get("parameter").schema()
-            response_json_schema = v.get("response").schema()
-
-            parameters_schema, definition = self._parse_models(parameter_json_schema)
-            definitions.update(definition)
-
-            response_schema, definition = self._parse_models(response_json_schema)
-            definitions.update(definition)
-
-            path = {
-                "consumes": [
-                    "application/json",
-                ],
-                "produces": [
-                    "application/json",
-                ],
-                "parameters": [parameters_schema],
-                "responses": {"200": response_schema}
-            }
-            paths[f"/{name}"] = {"post": self._sha256(path)}
+        schemas = []
+        digests = {}
+        for kind, model_type in (("request", parameter_type), ("response", response_type)):
+            if isinstance(model_type, type) and issubclass(model_type, BaseModel):
+                schema, definition = cls._parse_models(model_type.schema())
+                definitions.update(definition)
+                digests[kind] = Model.build_schema_digest(model_type)
+            else:
+                # flask responses and unions of models have no single schema
+                schema = {"name": "body", "description": "", "type": "object", "in": "body", "required": True}
+            schemas.append(schema)
+
+        path = {
+            "consumes": [
+                "application/json",
+            ],
+            "produces": [
+                "application/json",
+            ],
+            "parameters": [schemas[0]],
+            "responses": {"200": schemas[1]}
+        }
+        path = cls._sha256(path)
+        # callers may cache request/response schemas by digest
+        path["x-schema-digests"] = digests
+        return {"post": path}, definitions
+
+    def _api_info(self) -> dict:
+        endpoint = (self.metadata.endpoint or "").replace("http://", "").replace("https://", "")
+        return {
+            "version": self.metadata.version,
+            "name": self.metadata.name,
+            "id": self.agent_id,
+            "wallet-address": self.wallet_address,
+            "contract-wallet-address": getattr(self, "aa_wallet_address", None),
+            "payment": self._pretty_payment(),
+            "title": self.metadata.description,
+            "endpoint": endpoint,
+            "register-time": self.metadata.register_time
+        }
 
-        self.metadata.endpoint = self.metadata.endpoint.replace("http://", "").replace("https://", "")
-        self._api_list = {
+    def api_document(self) -> (dict, bytes, str):
+        """
+        the api description, its serialized form and etag. rebuilt only when a route is registered or the agent info
+        changes (e.g. after initialize), GET / serves the bytes as they are.
+        """
+        info = self._api_info()
+        if self._api_document is not None and self._api_document[0] == info:
+            return self._api_document[1:]
+
+        definitions = {}
+        paths = {}
+        for name, route in self.message_route.items():
+            path, route_definitions = route["api"]
+            paths[f"/{name}"] = path
+            definitions.update(route_definitions)
+        document = {
             "swagger": "2.0",
-            "info": {
-                "version": self.metadata.version,
-                "name": self.metadata.name,
-                "id": self.agent_id,
-                "wallet-address": self.wallet_address,
-                "contract-wallet-address": self.aa_wallet_address,
-                "payment": self._pretty_payment(),
-                "title": self.metadata.description,
-                "endpoint": self.metadata.endpoint,
-                "register-time": self.metadata.register_time
-            },
-            "host": self.metadata.endpoint,
+            "info": info,
+            "host": info["endpoint"],
             "paths": paths,
             "definitions": definitions
         }
-        return self._api_list
+        body = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        etag = hashlib.sha256(body).hexdigest()
+        self._api_document = (info, document, body, etag)
+        return document, body, etag
+
+    def api_list(self):
+        return self.api_document()[0]
+
+    def run(self, host="0.0.0.0", port=8000, log_onchain=True, heartbeat_interval=HEARTBEAT_INTERVAL, enable_metrics=True,
+            admission_control: AdmissionController | None = None, asgi=False):
+        if asgi:
+            # one event loop for all requests, async handlers don't hold a thread while they wait
+            if uvicorn is None:
+                raise ImportError("uvicorn is required to serve with asgi=True, install it with `pip install PyAgentlayer[asgi]`")
+            http_server = self.create_asgi_app(log_onchain=log_onchain, heartbeat_interval=heartbeat_interval, enable_metrics=enable_metrics,
+                                               admission_control=admission_control)
+            logging.info(f"Listening: http://{host}:{port}")
+            uvicorn.run(http_server, host=host, port=port, log_level="warning")
+            return
+        http_server = self.create_app(log_onchain=log_onchain, heartbeat_interval=heartbeat_interval, enable_metrics=enable_metrics,
+                                      admission_control=admission_control)
+        logging.info(f"Listening: http://{host}:{port}")
+        http_server.run(host=host, port=port)
+
+    def create_asgi_app(self, log_onchain=True, heartbeat_interval=HEARTBEAT_INTERVAL, enable_metrics=True,
+                        admission_control: AdmissionController | None = None, sync_workers=32) -> AgentASGIApp:
+        return AgentASGIApp(self, log_onchain=log_onchain, heartbeat_interval=heartbeat_interval, enable_metrics=enable_metrics,
+                            admission_control=admission_control, sync_workers=sync_workers)
 
-    def run(self, host="0.0.0.0", port=8000, log_onchain=True):
+    def start_process_pools(self):
+        # forked before the server and log threads start
+        for route in self.message_route.values():
+            if route.get("pool") is not None:
+                route["pool"].start()
+
+    def process_pool_stats(self) -> dict:
+        return {name: route["pool"].stats() for name, route in self.message_route.items() if route.get("pool") is not None}
+
+    def create_app(self, log_onchain=True, heartbeat_interval=HEARTBEAT_INTERVAL, enable_metrics=True,
+                   admission_control: AdmissionController | None = None) -> Flask:
+        self.start_process_pools()
         http_server = Flask(__name__)
+        # bodies are read before the caller is authorized, larger ones are refused with 413 before being read
+        http_server.config["MAX_CONTENT_LENGTH"] = codec.MAX_BODY_SIZE
         log = logging.getLogger('werkzeug')
         log.setLevel(logging.ERROR)
 
+        if enable_metrics:
+            @http_server.before_request
+            def _start_timer():
+                flask.g.start_time = time.perf_counter()
+
+            @http_server.after_request
+            def _record_request_metrics(response):
+                method_name = (flask_request.view_args or {}).get("method_name")
+                if method_name is None or flask_request.method != "POST":
+                    return response
+                # unknown methods share one label, so callers can't blow up the number of series
+                route = method_name if method_name in self.message_route else "unknown"
+                agent = str(self.agent_id)
+                metrics.request_count.inc(agent, route)
+                metrics.request_latency.observe(time.perf_counter() - flask.g.start_time, agent, route)
+                if response.status_code >= 400:
+                    metrics.request_errors.inc(agent, route, str(response.status_code))
+                return response
+
+            @http_server.route("/metrics", methods=["GET"])
+            def _metrics():
+                return flask.Response(metrics.REGISTRY.render(), content_type=metrics.PROMETHEUS_MIMETYPE)
+
         if log_onchain:
             # start a thread for record onchain log
             logging.debug("starting a thread for put agent log on-chain.")
-            threading.Thread(target=monitor_new_onchain_log, args=[self]).start()
+            start_log_shipper(self)
 
         @http_server.route("/<method_name>", methods=["POST"])
         def _accept_request(method_name):
-            if method_name not in self.message_route:
-                msg = f"method {method_name} not found/registered for current agent"
-                return ErrorMessage(error=msg).dict()
-
-            parameters = flask_request.json
+            # joins the caller's trace when it sent a traceparent header
+            with tracing.start_span("agent.request", traceparent=flask_request.headers.get(tracing.TRACEPARENT_HEADER),
+                                    route=method_name, agent_id=self.agent_id,
+                                    parent_task_id=flask_request.headers.get("X-Agent-Task-Id")) as span:
+                # the caller's remaining budget bounds the calls this request makes to other agents
+                timeout = deadline.parse_header(flask_request.headers.get(deadline.DEADLINE_HEADER))
+                if timeout is not None and timeout <= 0:
+                    response = flask.Response(status=504,
+                                              response=json.dumps({
+                                                  "success": False,
+                                                  "message": "deadline exceeded"
+                                              }),
+                                              mimetype='application/json; charset=utf-8')
+                else:
+                    with deadline.scope(timeout):
+                        if admission_control is not None and method_name in self.message_route:
+                            response = _admit_and_handle(method_name)
+                        else:
+                            response = flask.make_response(_handle_request(method_name))
+                _negotiate_encoding(response)
+                span.set_attribute("status_code", response.status_code)
+                if response.status_code >= 400:
+                    span.status = "error"
+                return response
+
+        def _announce_capabilities(response):
+            # the body formats and compressions accepted, callers switch to them for the next requests
+            response.headers[ACCEPT_POST_HEADER] = ", ".join(codec.content_types())
+            response.headers[ACCEPT_ENCODING_HEADER] = ", ".join(codec.encodings())
+            if self.subscription_plan:
+                # subscribers may trade their proof for a session token there
+                response.headers[SESSION_ROUTE_HEADER] = SESSION_ROUTE
+
+        def _negotiate_encoding(response):
+            _announce_capabilities(response)
+            response.vary.update(["Accept", "Accept-Encoding"])
+            if response.is_streamed or response.status_code != 200 or "Content-Encoding" in response.headers:
+                return
+            encoding = codec.negotiate(flask_request.headers.get("Accept-Encoding"), codec.encodings())
+            if encoding and (response.content_length or 0) >= codec.COMPRESS_MIN_SIZE:
+                response.set_data(codec.compress(response.get_data(), encoding))
+                response.headers["Content-Encoding"] = encoding
+
+        def _caller_from_headers():
+            # parsed once per request
+            if "caller" in flask.g:
+                return flask.g.caller
             caller_metadata = flask_request.headers.get("X-Agent-Meta")
+            caller_metadata_ref = flask_request.headers.get(METADATA_REF_HEADER)
             caller_message_hash = flask_request.headers.get("X-Agent-Message-Hash")
             caller_signature = flask_request.headers.get("X-Agent-Signature")
             if caller_metadata:
                 caller_metadata = AgentMetadata.from_json(json.loads(caller_metadata))
-                parent_task_id = flask_request.headers.get("X-Agent-Task-Id")
+            elif caller_metadata_ref:
+                caller_metadata = self.agent_link.resolve_metadata_ref(caller_metadata_ref)
             else:
                 caller_metadata = None
-                parent_task_id = ""
+            flask.g.caller = caller_metadata, caller_message_hash, caller_signature
+            return flask.g.caller
+
+        def _read_parameters():
+            content_type = flask_request.mimetype or codec.JSON
+            content_encoding = flask_request.headers.get("Content-Encoding")
+            if not codec.is_supported(content_type, content_encoding):
+                return None, flask.Response(status=415,
+                                            response=json.dumps({
+                                                "success": False,
+                                                "message": f"unsupported body {content_type} {content_encoding or ''}".strip()
+                                            }),
+                                            mimetype='application/json; charset=utf-8',
+                                            headers={ACCEPT_POST_HEADER: ", ".join(codec.content_types())})
+            try:
+                return codec.decode(codec.decompress(flask_request.get_data(), content_encoding), content_type), None
+            except (RequestEntityTooLarge, codec.BodyTooLargeError):
+                return None, flask.Response(status=413,
+                                            response=json.dumps({
+                                                "success": False,
+                                                "message": f"request body larger than {codec.MAX_BODY_SIZE} bytes"
+                                            }),
+                                            mimetype='application/json; charset=utf-8')
+            except Exception as e:
+                logging.warning(f"invalid request body: {e}")
+                return None, flask.Response(status=400,
+                                            response=json.dumps({
+                                                "success": False,
+                                                "message": "invalid request body"
+                                            }),
+                                            mimetype='application/json; charset=utf-8')
+
+        def _render(model: Model):
+            # binary formats only for callers asking for them, everyone else keeps json
+            content_type = codec.negotiate(flask_request.headers.get("Accept"), codec.content_types(), codec.JSON)
+            if content_type == codec.JSON:
+                return model.dict()
+            return flask.Response(codec.encode(model.model_dump(mode="json"), content_type), content_type=content_type)
+
+        def _admit_and_handle(method_name):
+            # only cheap checks before admission, the caller metadata is read once the request is admitted
+            caller = self._caller_key(flask_request.remote_addr, flask_request.headers.get(SESSION_HEADER))
+            weight = admission_control.weight_of(self._cached_tier(caller)) if admission_control.tier_weights else 1.0
+            try:
+                slot = admission_control.acquire(caller, weight)
+            except OverloadedException as e:
+                logging.info(f"reject request <{method_name}> from {caller}: {e.reason}")
+                return flask.Response(status=429,
+                                      response=json.dumps({
+                                          "success": False,
+                                          "message": "too many requests, please retry later",
+                                          "queue_depth": e.queue_depth
+                                      }),
+                                      mimetype='application/json; charset=utf-8',
+                                      headers={"Retry-After": str(e.retry_after)})
+            try:
+                response = flask.make_response(_handle_request(method_name))
+            except Exception:
+                slot.release()
+                raise
+            # held until the response is sent, streamed responses keep their slot while streaming
+            response.call_on_close(slot.release)
+            return response
+
+        def _handle_request(method_name):
+            if method_name not in self.message_route:
+                msg = f"method {method_name} not found/registered for current agent"
+                return ErrorMessage(error=msg).dict()
+
+            parameters, error_response = _read_parameters()
+            if error_response is not None:
+                return error_response
+            caller_metadata, caller_message_hash, caller_signature = _caller_from_headers()
+            parent_task_id = flask_request.headers.get("X-Agent-Task-Id") if caller_metadata else ""
 
             func = self.message_route[method_name].get('method')
             parameter_type = self.message_route[method_name].get('parameter')
@@ -417,7 +915,8 @@ class LAgent:
 
             try:
                 res = self.call_function(func, parameter_type(**parameters), caller_metadata, caller_message_hash=caller_message_hash,
-                                         caller_signature=caller_signature, parent_task_id=parent_task_id, log_onchain=log_onchain, with_log_queue=True)
+                                         caller_signature=caller_signature, parent_task_id=parent_task_id, log_onchain=log_onchain, with_log_queue=True,
+                                         route_name=method_name, caller_session=flask_request.headers.get(SESSION_HEADER))
             except AuthorizationException:
                 return flask.Response(status=401,
                                       response=json.dumps({
@@ -437,19 +936,19 @@ class LAgent:
             if isinstance(res, FlaskResponse):
                 return res
             elif isinstance(res, Model):
-                return res.dict()
+                return _render(res)
             elif isinstance(res, dict):
-                return response_type(**res).dict()
+                return _render(response_type(**res))
             elif isinstance(res, types.GeneratorType):
-                def generator():
-                    for chunk in res:
-                        if isinstance(chunk, Model):
-                            s = chunk.json()
-                        else:
-                            s = chunk
-                        yield s
-
-                return flask.Response(generator(), mimetype='text/event-stream')
+                def encode(chunk):
+                    if isinstance(chunk, Model):
+                        return chunk.json()
+                    elif isinstance(chunk, dict):
+                        return response_type(**chunk).json()
+                    return str(chunk)
+
+                return flask.Response(stream_events(res, encode, heartbeat_interval=heartbeat_interval),
+                                      mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
             else:
                 logging.error(f"invalid response type {type(res)}, should be Model or dict")
                 return flask.Response(status=500,
@@ -459,9 +958,29 @@ class LAgent:
                                       }),
                                       mimetype='application/json; charset=utf-8')
 
+        @http_server.route(f"/{SESSION_ROUTE}", methods=["POST"])
+        def _open_session():
+            caller_metadata, caller_message_hash, caller_signature = _caller_from_headers()
+            try:
+                token, expires_at = self.open_session(caller_metadata, caller_message_hash, caller_signature)
+            except AuthorizationException:
+                return flask.Response(status=401,
+                                      response=json.dumps({
+                                          "success": False,
+                                          "message": "current agent is payable,you have to subscribe before calling it"
+                                      }),
+                                      mimetype='application/json; charset=utf-8')
+            return {"token": token, "expires_at": expires_at}
+
         @http_server.route("/", methods=["GET"])
         def _api_list():
-            return self.api_list()
-
-        logging.info(f"Listening: http://{host}:{port}")
-        http_server.run(host=host, port=port)
+            _, body, etag = self.api_document()
+            response = flask.Response(body, content_type="application/json")
+            response.set_etag(etag)
+            # cached copies must be revalidated, which costs a 304 when nothing changed
+            response.headers["Cache-Control"] = "no-cache"
+            # callers warming up a connection (see AgentLink.warm_up) learn them before their first call
+            _announce_capabilities(response)
+            return response.make_conditional(flask_request)
+
+        return http_server
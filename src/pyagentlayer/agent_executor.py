@@ -1,5 +1,6 @@
 # -*- coding:utf-8 -*-
 import abc
+import functools
 import json
 import logging
 import math
@@ -7,19 +8,34 @@ import os.path
 import time
 from typing import List
 
+from eth_abi import decode as abi_decode, encode as abi_encode
 from eth_account import Account
+from eth_utils import function_abi_to_4byte_selector, to_checksum_address
+from eth_utils.abi import collapse_if_tuple
 from web3 import Web3
 from web3.contract import Contract
-from web3.exceptions import TransactionNotFound
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError, TransactionNotFound
 
+from .fee_oracle import FeeOracle
 from .models import SubscriptionPlan, SubscriptionPeriodEnum
+from .read_cache import BlockTracker, CachePolicy, ReadCache
+from .rpc_provider import BalancedHTTPProvider, batch_request
+from .utils.exceptions import TransactionFailedException
 
 logging.basicConfig(format='%(asctime)s: t-%(thread)d: %(levelname)s: %(message)s')
 logging.getLogger().setLevel(logging.INFO)
 
+# one url, or several separated by comma to balance reads between them
 rpc_endpoint = os.environ.get("CHAIN_RPC", "https://testnet-rpc.agentlayer.xyz/")
 if not rpc_endpoint:
     raise ValueError("missing rpc endpoint environment: CHAIN_RPC")
+rpc_hedge_after = float(os.environ.get("CHAIN_RPC_HEDGE_AFTER", 0.5))
+# view call results are cached per block, the latest block number is read at most once per `block_time` seconds
+read_cache_enabled = os.environ.get("CHAIN_READ_CACHE", "1").lower() not in ("0", "false", "no")
+block_time = float(os.environ.get("CHAIN_BLOCK_TIME", 1))
+# fees are read once per block and gas estimated once per contract function, with this margin on top of the estimate
+fee_cache_enabled = os.environ.get("CHAIN_FEE_CACHE", "1").lower() not in ("0", "false", "no")
+gas_margin = float(os.environ.get("CHAIN_GAS_MARGIN", 1.2))
 
 agent_nft_address = Web3.to_checksum_address('0xB6B3ef5eA5e94796E43fE126626fa555C6919265')
 smart_wallet_factory_address = Web3.to_checksum_address('0xCd64Fa42F7f27D2b7cC1F58BED61B86EB1C9586d')
@@ -37,10 +53,51 @@ with open(os.path.join(os.path.dirname(__file__), "abi/Subscription.json"), "r")
     subscription_abi = json.loads("".join(f.readlines()))
 
 
+class PrecompiledCall:
+    """
+    selector and abi codec of a view function, built once when the module is loaded. a call is an `eth_call` of
+    pre-encoded calldata sent to the provider, without web3's per call abi lookup, argument normalization and
+    middlewares.
+    """
+
+    def __init__(self, fn_abi: dict):
+        self.name = fn_abi["name"]
+        self.selector = function_abi_to_4byte_selector(fn_abi)
+        self.input_types = [collapse_if_tuple(i) for i in fn_abi["inputs"]]
+        self.output_types = [collapse_if_tuple(o) for o in fn_abi["outputs"]]
+
+    def encode(self, args) -> str:
+        return "0x" + (self.selector + abi_encode(self.input_types, args)).hex()
+
+    def decode(self, result: str | None):
+        if result in (None, "0x"):
+            raise BadFunctionCallOutput(f"could not decode output of {self.name}: the contract is not deployed at the address or the call reverted")
+        values = abi_decode(self.output_types, bytes.fromhex(result[2:]))
+        # addresses are checksummed as web3 returns them
+        values = [to_checksum_address(v) if t == "address" else v for t, v in zip(self.output_types, values)]
+        return values[0] if len(values) == 1 else values
+
+
+def _raise_call_error(error):
+    # only reverts are contract logic errors, node failures (rate limits, missing state...) are raised as web3 does
+    if isinstance(error, dict) and (error.get("code") == 3 or error.get("data")
+                                    or "execution reverted" in str(error.get("message", "")).lower()):
+        raise ContractLogicError(error.get("message") or "execution reverted", data=error.get("data"))
+    raise ValueError(error)
+
+
+def precompile(abi: list, fn_names) -> dict[str, PrecompiledCall]:
+    return {f["name"]: PrecompiledCall(f) for f in abi if f.get("type") == "function" and f["name"] in fn_names}
+
+
 class AbstractExecutor(metaclass=abc.ABCMeta):
     account: Account | None
     contract: Contract
     account_address: str
+    # view functions whose results are cached, see `read_cache.CachePolicy`
+    read_cache_policies: dict[str, CachePolicy] = {}
+    # view functions called with raw `eth_call`, see `PrecompiledCall`
+    precompiled: dict[str, PrecompiledCall] = {}
 
     def __init__(self, contract: Contract, account: Account = None, account_address=None):
         self.contract = contract
@@ -51,7 +108,69 @@ class AbstractExecutor(metaclass=abc.ABCMeta):
             self.account_address = account_address
 
         self.w3 = contract.w3
-        self.chain_id = self.w3.eth.chain_id
+        self.read_cache = ReadCache(block_tracker(self.w3), self.read_cache_policies, enabled=read_cache_enabled)
+        self.fee_oracle = fee_oracle(self.w3)
+
+    @functools.cached_property
+    def chain_id(self):
+        # fetched on first use, building an executor doesn't need a round trip to the node
+        return self.w3.eth.chain_id
+
+    def _read(self, fn_name: str, *args):
+        call = self.precompiled.get(fn_name)
+
+        def load(block_identifier):
+            if call is not None:
+                return self._eth_call(call, args, block_identifier)
+            return self.contract.functions[fn_name](*args).call(block_identifier=block_identifier)
+
+        return self.read_cache.call(self.contract.address, fn_name, args, load)
+
+    def _eth_call(self, call: PrecompiledCall, args: tuple, block_identifier="latest"):
+        block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+        response = self.w3.provider.make_request("eth_call", [{"to": self.contract.address, "data": call.encode(args)}, block])
+        if "error" in response:
+            _raise_call_error(response["error"])
+        return call.decode(response.get("result"))
+
+    def batch_call(self, fn_name: str, args_list: list, block_identifier="latest", batch_size=100, timeout: float | None = None) -> list:
+        """
+        call a view function for each args in `args_list`, sending JSON-RPC batches of `batch_size` calls through the
+        provider (`timeout` seconds per batch, web3's default when None). the result of a reverted call is None, other
+        errors of the node are raised.
+        """
+        call = self.precompiled.get(fn_name) or PrecompiledCall(
+            next(f for f in self.contract.abi if f.get("type") == "function" and f.get("name") == fn_name))
+        block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+        results = []
+        for start in range(0, len(args_list), batch_size):
+            calls = [("eth_call", [{"to": self.contract.address, "data": call.encode(args)}, block])
+                     for args in args_list[start:start + batch_size]]
+            for item in batch_request(self.w3.provider, calls, timeout):
+                if "error" in item:
+                    try:
+                        _raise_call_error(item["error"])
+                    except ContractLogicError:
+                        results.append(None)
+                        continue
+                if item.get("result") in (None, "0x"):
+                    results.append(None)
+                    continue
+                decoded = call.decode(item["result"])
+                results.append(tuple(decoded) if isinstance(decoded, list) else decoded)
+        return results
+
+    def _build_transaction(self, fn_name: str, *args, nonce_block="latest") -> dict:
+        # fee, gas and chain id come from caches, the nonce is the only round trip left
+        fn = self.contract.functions[fn_name](*args)
+        tx = {
+            "from": self.account.address,
+            "nonce": self.w3.eth.get_transaction_count(self.account.address, nonce_block),
+            "chainId": self.chain_id,
+        }
+        tx.update(self.fee_oracle.transaction_fields(self.contract.address, fn_name,
+                                                     lambda: fn.estimate_gas({"from": self.account.address}), args))
+        return fn.build_transaction(tx)
 
     def waiting_for_confirmation(self, tx_hash):
         logging.info(f"waiting tx: {tx_hash.hex()}")
@@ -59,6 +178,13 @@ class AbstractExecutor(metaclass=abc.ABCMeta):
             try:
                 receipt = self.contract.w3.eth.get_transaction_receipt(tx_hash)
                 logging.info(f"tx: {tx_hash.hex()} confirmed at block {receipt.blockNumber}\tstatus: {'success' if receipt.get('status') == 1 else 'fail'}")
+                # our own write must be visible to the next read, even for values served stale
+                self.read_cache.tracker.observe(receipt.blockNumber)
+                self.read_cache.clear()
+                if receipt.get("status") != 1:
+                    # the cached estimate may be what ran out, the next transaction estimates again
+                    self.fee_oracle.forget(receipt.get("to") or self.contract.address)
+                    raise TransactionFailedException(tx_hash.hex(), receipt)
                 if receipt.contractAddress:
                     return receipt.contractAddress
                 return
@@ -67,19 +193,28 @@ class AbstractExecutor(metaclass=abc.ABCMeta):
 
 
 class AgentNft(AbstractExecutor):
+    read_cache_policies = {
+        "ownerOf": CachePolicy(),
+        "tokenURI": CachePolicy(),
+    }
+    precompiled = precompile(agent_nft_abi, ("ownerOf", "tokenURI"))
+
     def owner_of(self, token_id: int):
-        return self.contract.functions.ownerOf(int(token_id)).call()
+        return self._read("ownerOf", int(token_id))
 
     def token_uri(self, token_id: int):
-        return self.contract.functions.tokenURI(token_id).call()
+        return self._read("tokenURI", int(token_id))
+
+    def token_uris(self, token_ids: list) -> list:
+        return self.batch_call("tokenURI", [(int(token_id),) for token_id in token_ids])
+
+    def owners_of(self, token_ids: list) -> list:
+        return self.batch_call("ownerOf", [(int(token_id),) for token_id in token_ids])
 
     def safe_mint_sync(self, token_uri):
         if not self.account:
             raise ValueError("Agent without private key cannot mint nft with sdk.")
-        tx = self.contract.functions.safeMint(token_uri).build_transaction({
-            "from": self.account.address,
-            "nonce": self.contract.w3.eth.get_transaction_count(self.account.address, "pending")
-        })
+        tx = self._build_transaction("safeMint", token_uri, nonce_block="pending")
         signed_tx = self.account.sign_transaction(tx)
 
         # broadcast tx and wait for confirmation
@@ -94,24 +229,25 @@ class AgentNft(AbstractExecutor):
 
 
 class SmartWalletFactory(AbstractExecutor):
+    read_cache_policies = {
+        "eoaOwnedWallet": CachePolicy(),
+    }
+    precompiled = precompile(smart_wallet_factory_abi, ("eoaOwnedWallet",))
 
     def create_wallet(self):
-        owned_aa_wallet = self.contract.functions.eoaOwnedWallet(self.account_address).call()
+        owned_aa_wallet = self._read("eoaOwnedWallet", self.account_address)
         if owned_aa_wallet == '0x0000000000000000000000000000000000000000':
             if not self.account:
                 raise ValueError("Agent without private key cannot crate aa wallet.")
             # create
-            tx = self.contract.functions.createWallet().build_transaction({
-                "from": self.account.address,
-                "nonce": self.contract.w3.eth.get_transaction_count(self.account.address)
-            })
+            tx = self._build_transaction("createWallet")
             signed_tx = self.account.sign_transaction(tx)
 
             # broadcast tx and wait for confirmation
             tx_hash = self.contract.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
             logging.info(f"contract call: createWallet\ttx hash: {tx_hash.hex()}")
             self.waiting_for_confirmation(tx_hash)
-            return self.contract.functions.eoaOwnedWallet(self.account.address).call()
+            return self._read("eoaOwnedWallet", self.account.address)
         else:
             return owned_aa_wallet
 
@@ -131,10 +267,7 @@ class SmartWallet(AbstractExecutor):
             raise ValueError("Agent without private key cannot subscribe to other agent.")
 
         logging.info(f"subscribe to address: {target_address} with period: {str(period.name).lower()}\tauto renewal: {auto_renewal}")
-        tx = self.contract.functions.subscribeOtherAgent(period.value, target_address, auto_renewal).build_transaction({
-            "from": self.account.address,
-            "nonce": self.contract.w3.eth.get_transaction_count(self.account.address)
-        })
+        tx = self._build_transaction("subscribeOtherAgent", period.value, target_address, auto_renewal)
         signed_tx = self.account.sign_transaction(tx)
         # broadcast tx and wait for confirmation
         tx_hash = self.contract.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
@@ -143,24 +276,38 @@ class SmartWallet(AbstractExecutor):
 
 
 class AgentToken(AbstractExecutor):
+    read_cache_policies = {
+        "balanceOf": CachePolicy(),
+    }
+    precompiled = precompile(agent_abi, ("balanceOf",))
+
     def balance_of(self, address):
-        return self.contract.functions.balanceOf(address).call()
+        return self._read("balanceOf", address)
 
 
 class Subscription(AbstractExecutor):
+    read_cache_policies = {
+        "isSubscribed": CachePolicy(),
+        "isAutoRenewal": CachePolicy(),
+        "getSubscriptionLeftTime": CachePolicy(),
+        # prices change rarely and only by the agent owner, serve them up to 5 minutes stale while refreshing
+        "getSubscriptionPrice": CachePolicy(stale_while_revalidate=300),
+    }
+    precompiled = precompile(subscription_abi, ("isSubscribed", "isAutoRenewal", "getSubscriptionLeftTime", "getSubscriptionPrice"))
+
     def is_subscribed(self, subscriber, target_agent_address):
-        return self.contract.functions.isSubscribed(subscriber, target_agent_address).call()
+        return self._read("isSubscribed", subscriber, target_agent_address)
 
     def is_auto_renewal(self, subscriber, target_agent_address):
-        return self.contract.functions.isAutoRenewal(subscriber, target_agent_address).call()
+        return self._read("isAutoRenewal", subscriber, target_agent_address)
 
     def get_subscription_left_time(self, subscriber, target_agent_address):
-        return self.contract.functions.getSubscriptionLeftTime(subscriber, target_agent_address).call()
+        return self._read("getSubscriptionLeftTime", subscriber, target_agent_address)
 
     def get_subscription_plan(self, wallet) -> (int, int, int):
-        weekly_price = self.contract.functions.getSubscriptionPrice(SubscriptionPeriodEnum.WEEKLY.value, wallet).call()
-        monthly_price = self.contract.functions.getSubscriptionPrice(SubscriptionPeriodEnum.MONTHLY.value, wallet).call()
-        yearly_price = self.contract.functions.getSubscriptionPrice(SubscriptionPeriodEnum.YEARLY.value, wallet).call()
+        weekly_price = self._read("getSubscriptionPrice", SubscriptionPeriodEnum.WEEKLY.value, wallet)
+        monthly_price = self._read("getSubscriptionPrice", SubscriptionPeriodEnum.MONTHLY.value, wallet)
+        yearly_price = self._read("getSubscriptionPrice", SubscriptionPeriodEnum.YEARLY.value, wallet)
         return weekly_price, monthly_price, yearly_price
 
     def update_subscription_plan(self, wallet, subscription_plans: List[SubscriptionPlan] | None):
@@ -193,10 +340,7 @@ class Subscription(AbstractExecutor):
         if not self.account:
             raise ValueError("Agent without private key cannot update subscribe info.")
 
-        tx = self.contract.functions.setSubscriptionPrice(period.value, wallet, price).build_transaction({
-            "from": self.account.address,
-            "nonce": self.contract.w3.eth.get_transaction_count(self.account.address)
-        })
+        tx = self._build_transaction("setSubscriptionPrice", period.value, wallet, price)
         signed_tx = self.account.sign_transaction(tx)
         # broadcast tx and wait for confirmation
         tx_hash = self.contract.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
@@ -204,31 +348,64 @@ class Subscription(AbstractExecutor):
         self.waiting_for_confirmation(tx_hash)
 
 
+_providers = {}
+_block_trackers = {}
+_fee_oracles = {}
+
+
+def block_tracker(w3: Web3) -> BlockTracker:
+    # one tracker per node (or balancer), shared by all executors talking to it
+    key = str(w3.provider)
+    if key not in _block_trackers:
+        _block_trackers[key] = BlockTracker(w3, ttl=block_time)
+    return _block_trackers[key]
+
+
+def fee_oracle(w3: Web3) -> FeeOracle:
+    # gas estimates and fees are shared by all executors talking to a node, like its block tracker
+    key = str(w3.provider)
+    if key not in _fee_oracles:
+        _fee_oracles[key] = FeeOracle(w3, block_tracker(w3), gas_margin=gas_margin, enabled=fee_cache_enabled)
+    return _fee_oracles[key]
+
+
+def new_web3() -> Web3:
+    # executors (of every agent in the process) share one provider per endpoint list, so connections are pooled
+    # and a balancer tracks health and latency once per endpoint
+    if rpc_endpoint not in _providers:
+        endpoints = [e.strip() for e in rpc_endpoint.split(",") if e.strip()]
+        if len(endpoints) == 1:
+            _providers[rpc_endpoint] = Web3.HTTPProvider(endpoints[0])
+        else:
+            _providers[rpc_endpoint] = BalancedHTTPProvider(endpoints, hedge_after=rpc_hedge_after)
+    return Web3(_providers[rpc_endpoint])
+
+
 def new_agent_nft(account: Account = None, account_address: str = None) -> AgentNft:
-    web3 = Web3(Web3.HTTPProvider(rpc_endpoint))
+    web3 = new_web3()
     contract = web3.eth.contract(address=agent_nft_address, abi=agent_nft_abi)
     return AgentNft(contract=contract, account=account, account_address=account_address)
 
 
 def new_smart_wallet_factory(account: Account = None, account_address: str = None) -> SmartWalletFactory:
-    web3 = Web3(Web3.HTTPProvider(rpc_endpoint))
+    web3 = new_web3()
     contract = web3.eth.contract(address=smart_wallet_factory_address, abi=smart_wallet_factory_abi)
     return SmartWalletFactory(contract=contract, account=account, account_address=account_address)
 
 
 def new_smart_wallet(account: Account = None, eoa_account_address=None, smart_wallet_address: str = None) -> SmartWallet:
-    web3 = Web3(Web3.HTTPProvider(rpc_endpoint))
+    web3 = new_web3()
     contract = web3.eth.contract(address=smart_wallet_address, abi=smart_wallet_abi)
     return SmartWallet(contract=contract, account=account, account_address=eoa_account_address)
 
 
 def new_agent_token_contract(account: Account = None, account_address=None) -> AgentToken:
-    web3 = Web3(Web3.HTTPProvider(rpc_endpoint))
+    web3 = new_web3()
     contract = web3.eth.contract(address=agent_address, abi=agent_abi)
     return AgentToken(contract=contract, account=account, account_address=account_address)
 
 
 def new_subscription_contract(account=None, account_address=None) -> Subscription:
-    web3 = Web3(Web3.HTTPProvider(rpc_endpoint))
+    web3 = new_web3()
     contract = web3.eth.contract(address=subscription_address, abi=subscription_abi)
     return Subscription(contract=contract, account=account, account_address=account_address)
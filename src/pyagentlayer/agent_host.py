@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+import logging
+
+import flask
+import requests
+from flask import Flask
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import run_simple
+
+from . import metrics
+from .admission import AdmissionController
+from .agent import LAgent
+from .signature_cache import SignatureCache
+from .utils.sse import HEARTBEAT_INTERVAL
+
+
+class AgentHost:
+    """
+    serve several LAgent from one process and one port, routed by Host header or path prefix.
+
+    mounted agents share the web3 providers (shared per rpc endpoint in the process), one pooled http session for
+    calls to other agents, one agent metadata cache, one signature verification cache and one on-chain log shipper.
+    an agent mounted under a prefix must be registered with that prefix in its endpoint, e.g. http://host:8000/echo/
+    """
+
+    def __init__(self, log_onchain=True, heartbeat_interval=HEARTBEAT_INTERVAL, enable_metrics=True, pool_maxsize=64):
+        self.log_onchain = log_onchain
+        self.heartbeat_interval = heartbeat_interval
+        self.enable_metrics = enable_metrics
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # metadata of called agents by agent id, mounted agents are expected to use the same registry
+        self.agent_meta_cache = {}
+        # caller metadata by cid, to resolve X-Agent-Meta-Ref once for all agents
+        self.metadata_by_cid = {}
+        self.signature_cache = SignatureCache()
+
+        # prefix -> (agent, app), matched longest prefix first
+        self._prefixes = {}
+        # host name -> (agent, app)
+        self._hosts = {}
+        self._app = self._create_index_app()
+
+    def mount(self, agent: LAgent, prefix: str | None = None, host: str | None = None,
+              admission_control: AdmissionController | None = None) -> LAgent:
+        if prefix is None and host is None:
+            raise ValueError("prefix or host must be provided to mount an agent")
+        if prefix is not None:
+            prefix = "/" + prefix.strip("/")
+            if prefix == "/":
+                raise ValueError("agents can't be mounted at the root path, use a prefix or a host")
+            if prefix in self._prefixes:
+                raise ValueError(f"prefix {prefix} is already mounted")
+        if host is not None:
+            host = host.lower()
+            if host in self._hosts:
+                raise ValueError(f"host {host} is already mounted")
+
+        self._share(agent)
+        app = agent.create_app(log_onchain=self.log_onchain, heartbeat_interval=self.heartbeat_interval, enable_metrics=self.enable_metrics,
+                               admission_control=admission_control)
+        if prefix is not None:
+            self._prefixes[prefix] = (agent, app)
+            self._prefixes = dict(sorted(self._prefixes.items(), key=lambda item: len(item[0]), reverse=True))
+        if host is not None:
+            self._hosts[host] = (agent, app)
+        logging.info(f"mount agent {agent.metadata.name}({agent.agent_id}) at {host or ''}{prefix or '/'}")
+        return agent
+
+    def _share(self, agent: LAgent):
+        agent.signature_cache = self.signature_cache
+        agent.agent_link.agent_meta_cache = self.agent_meta_cache
+        agent.agent_link.metadata_by_cid = self.metadata_by_cid
+        agent.agent_link.session = self.session
+
+    def _create_index_app(self) -> Flask:
+        app = Flask(__name__)
+
+        @app.route("/", methods=["GET"])
+        def _agents():
+            return {
+                "agents": [{"name": agent.metadata.name, "id": agent.agent_id, "prefix": prefix} for prefix, (agent, _) in self._prefixes.items()]
+                          + [{"name": agent.metadata.name, "id": agent.agent_id, "host": host} for host, (agent, _) in self._hosts.items()]
+            }
+
+        if self.enable_metrics:
+            @app.route("/metrics", methods=["GET"])
+            def _metrics():
+                return flask.Response(metrics.REGISTRY.render(), content_type=metrics.PROMETHEUS_MIMETYPE)
+
+        return app
+
+    def __call__(self, environ, start_response):
+        host = environ.get("HTTP_HOST", "").split(":")[0].lower()
+        if host in self._hosts:
+            return self._hosts[host][1](environ, start_response)
+
+        path = environ.get("PATH_INFO", "")
+        for prefix, (_, app) in self._prefixes.items():
+            if path == prefix or path.startswith(prefix + "/"):
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+                environ["PATH_INFO"] = path[len(prefix):]
+                return app(environ, start_response)
+        return self._app(environ, start_response)
+
+    def run(self, host="0.0.0.0", port=8000):
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        logging.info(f"Listening: http://{host}:{port}, {len(self._prefixes) + len(self._hosts)} agents mounted")
+        run_simple(host, port, self, threaded=True)
@@ -0,0 +1,249 @@
+# -*- coding:utf-8 -*-
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from web3 import Web3
+
+from .agent_executor import AgentNft, new_agent_nft
+from .models import AgentMetadata
+from .utils.ipfs import AbsIPFSClient, AgentIPFSClient
+
+ZERO_TOPIC = "0x" + "00" * 32
+TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)").hex()
+METADATA_UPDATE_TOPIC = Web3.keccak(text="MetadataUpdate(uint256)").hex()
+BATCH_METADATA_UPDATE_TOPIC = Web3.keccak(text="BatchMetadataUpdate(uint256,uint256)").hex()
+
+
+class AgentIndex:
+    """
+    local sqlite index of registered agents with full text search over name and description.
+    ipfs metadata is cached by cid, so agents sharing metadata or re-indexed later are not downloaded again.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS agents (
+                    agent_id INTEGER PRIMARY KEY, owner TEXT, cid TEXT, name TEXT, description TEXT, endpoint TEXT,
+                    metadata TEXT, updated_at INTEGER
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS agents_fts USING fts5(name, description);
+                CREATE TABLE IF NOT EXISTS ipfs_cache (cid TEXT PRIMARY KEY, content TEXT);
+                CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+            """)
+
+    def _state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_state(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def pending(self) -> dict[int, str | None]:
+        # agents whose metadata couldn't be downloaded yet -> owner, retried by the next sync
+        return {int(agent_id): owner for agent_id, owner in json.loads(self._state("pending", "{}")).items()}
+
+    @pending.setter
+    def pending(self, owners: dict[int, str | None]):
+        self._set_state("pending", json.dumps({str(agent_id): owner for agent_id, owner in owners.items()}))
+
+    @property
+    def last_block(self) -> int:
+        return int(self._state("last_block", -1))
+
+    @last_block.setter
+    def last_block(self, block_number: int):
+        self._set_state("last_block", block_number)
+
+    def cached_cid(self, cid: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM ipfs_cache WHERE cid = ?", (cid,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def cache_cid(self, cid: str, content: dict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ipfs_cache (cid, content) VALUES (?, ?)", (cid, json.dumps(content)))
+
+    def agent_ids(self) -> list[int]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT agent_id FROM agents ORDER BY agent_id")]
+
+    def upsert(self, agent_id: int, owner: str | None, cid: str | None, metadata: dict | None):
+        metadata = metadata or {}
+        name, description = metadata.get("name") or "", metadata.get("description") or ""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO agents (agent_id, owner, cid, name, description, endpoint, metadata, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(agent_id) DO UPDATE SET owner = COALESCE(excluded.owner, owner), cid = excluded.cid, "
+                    "name = excluded.name, description = excluded.description, endpoint = excluded.endpoint, "
+                    "metadata = excluded.metadata, updated_at = excluded.updated_at",
+                    (agent_id, owner, cid, name, description, metadata.get("endpoint"), json.dumps(metadata), int(time.time())))
+                self._conn.execute("DELETE FROM agents_fts WHERE rowid = ?", (agent_id,))
+                self._conn.execute("INSERT INTO agents_fts (rowid, name, description) VALUES (?, ?, ?)", (agent_id, name, description))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def set_owner(self, agent_id: int, owner: str):
+        with self._lock:
+            self._conn.execute("UPDATE agents SET owner = ? WHERE agent_id = ?", (owner, agent_id))
+
+    def get(self, agent_id: int) -> AgentMetadata | None:
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM agents WHERE agent_id = ?", (int(agent_id),)).fetchone()
+        return _to_metadata(row[0]) if row else None
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[int, AgentMetadata]]:
+        """
+        agents whose name or description contain all words of `query` (prefix match), best match first.
+        """
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        fts_query = " ".join(f'"{word}"*' for word in words)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT agents.agent_id, agents.metadata FROM agents_fts JOIN agents ON agents.agent_id = agents_fts.rowid "
+                "WHERE agents_fts MATCH ? ORDER BY bm25(agents_fts) LIMIT ?", (fts_query, limit)).fetchall()
+        results = []
+        for agent_id, metadata in rows:
+            agent_metadata = _to_metadata(metadata)
+            if agent_metadata:
+                results.append((agent_id, agent_metadata))
+        return results
+
+
+def _to_metadata(metadata_json: str) -> AgentMetadata | None:
+    try:
+        return AgentMetadata.from_json(json.loads(metadata_json))
+    except Exception:
+        # metadata that doesn't follow the sdk format is still searchable but can't be returned as AgentMetadata
+        return None
+
+
+class AgentIndexCrawler:
+    """
+    keep an AgentIndex up to date with the AgentNFT contract.
+
+    token ids and owners come from Transfer logs read in block ranges, metadata changes from MetadataUpdate logs.
+    token uris are read with batched eth_call and ipfs metadata is downloaded concurrently, agents whose metadata
+    can't be downloaded stay pending and are retried by the next sync.
+    when the node refuses eth_getLogs, token ids are enumerated by probing ownerOf in batches instead.
+    """
+
+    def __init__(self, index: AgentIndex, agent_nft: AgentNft = None, ipfs_client: AbsIPFSClient = None,
+                 block_batch_size=5000, id_batch_size=100, max_workers=16):
+        self.index = index
+        self.agent_nft = agent_nft or new_agent_nft()
+        self.ipfs_client = ipfs_client or AgentIPFSClient()
+        self.block_batch_size = block_batch_size
+        self.id_batch_size = id_batch_size
+        self.max_workers = max_workers
+
+    def _changes_from_logs(self, from_block: int, to_block: int) -> (set, dict):
+        changed_ids, owners = set(), {}
+        w3 = self.agent_nft.w3
+        for start in range(from_block, to_block + 1, self.block_batch_size):
+            end = min(start + self.block_batch_size - 1, to_block)
+            logs = w3.eth.get_logs({
+                "address": self.agent_nft.contract.address,
+                "fromBlock": start,
+                "toBlock": end,
+                "topics": [[TRANSFER_TOPIC, METADATA_UPDATE_TOPIC, BATCH_METADATA_UPDATE_TOPIC]]
+            })
+            for log in logs:
+                topic = log["topics"][0].hex()
+                if topic == TRANSFER_TOPIC:
+                    token_id = int(log["topics"][3].hex(), 16)
+                    owners[token_id] = Web3.to_checksum_address("0x" + log["topics"][2].hex()[-40:])
+                    if log["topics"][1].hex() == ZERO_TOPIC:
+                        changed_ids.add(token_id)
+                elif topic == METADATA_UPDATE_TOPIC:
+                    changed_ids.add(w3.codec.decode(["uint256"], bytes(log["data"]))[0])
+                else:
+                    first, last = w3.codec.decode(["uint256", "uint256"], bytes(log["data"]))
+                    known = set(self.index.agent_ids()) | changed_ids
+                    changed_ids.update(i for i in known if first <= i <= last)
+        return changed_ids, owners
+
+    def _changes_from_probe(self) -> (set, dict):
+        changed_ids, owners = set(), {}
+        start = max(self.index.agent_ids(), default=0) + 1
+        while True:
+            token_ids = list(range(start, start + self.id_batch_size))
+            batch_owners = self.agent_nft.owners_of(token_ids)
+            found = {token_id: owner for token_id, owner in zip(token_ids, batch_owners) if owner}
+            if not found:
+                return changed_ids, owners
+            changed_ids.update(found)
+            owners.update(found)
+            start += self.id_batch_size
+
+    def _download(self, cid: str) -> dict | None:
+        metadata = self.index.cached_cid(cid)
+        if metadata is not None:
+            return metadata
+        try:
+            metadata = self.ipfs_client.download_file(cid)
+        except Exception as e:
+            logging.warning(f"download agent metadata {cid} failed with error message {e}")
+            return None
+        # content behind a cid never changes, keep it forever
+        self.index.cache_cid(cid, metadata)
+        return metadata
+
+    def sync(self) -> int:
+        """
+        index agents minted or updated since the last sync, return the number of (re-)indexed agents.
+        """
+        latest_block = self.agent_nft.w3.eth.block_number
+        from_block = self.index.last_block + 1
+        try:
+            changed_ids, owners = self._changes_from_logs(from_block, latest_block)
+        except Exception as e:
+            logging.warning(f"read AgentNFT logs failed with error message {e}, probing token ids instead")
+            changed_ids, owners = self._changes_from_probe()
+
+        for token_id, owner in owners.items():
+            if token_id not in changed_ids:
+                self.index.set_owner(token_id, owner)
+
+        pending = self.index.pending
+        for token_id, owner in pending.items():
+            owners.setdefault(token_id, owner)
+        token_ids = sorted(changed_ids | set(pending))
+        cids = []
+        for start in range(0, len(token_ids), self.id_batch_size):
+            cids.extend(self.agent_nft.token_uris(token_ids[start:start + self.id_batch_size]))
+
+        unique_cids = sorted({cid for cid in cids if cid})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            metadata_by_cid = dict(zip(unique_cids, pool.map(self._download, unique_cids)))
+
+        indexed, pending = 0, {}
+        for token_id, cid in zip(token_ids, cids):
+            metadata = metadata_by_cid.get(cid)
+            if cid and metadata is None:
+                # keep the agent's previous entry, if any, until its metadata can be downloaded
+                pending[token_id] = owners.get(token_id)
+                continue
+            self.index.upsert(token_id, owners.get(token_id), cid, metadata)
+            indexed += 1
+        self.index.pending = pending
+        self.index.last_block = latest_block
+        logging.info(f"agent index synced to block {latest_block}, {indexed} agents updated, {len(pending)} pending")
+        return indexed
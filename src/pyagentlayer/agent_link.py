@@ -1,42 +1,379 @@
 import json
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urljoin
 
+import requests
+
+from . import deadline, metrics, tracing
+from .circuit_breaker import CircuitBreaker, STATE_VALUES
 from .models import AgentMetadata
-from .registry_client import OnChainAgentRegistryClient
+from .registry_client import AbstractRegistryClient
+from .session import SESSION_HEADER, SESSION_ROUTE, SESSION_ROUTE_HEADER
+from .utils import codec
 from .utils.base_request import BaseRequestClient
+from .utils.exceptions import AgentCallException, CircuitOpenException, DeadlineExceededException
+
+# seconds an outbound call may take when the current request has no shorter deadline
+call_timeout = float(os.environ.get("AGENT_CALL_TIMEOUT", 60))
+# seconds before a hedged call sends its second request
+call_hedge_after = float(os.environ.get("AGENT_CALL_HEDGE_AFTER", 1))
+# body format and compression used with agents that announce support for them (json / msgpack / cbor, gzip / zstd / none)
+WIRE_FORMATS = {"json": codec.JSON, "msgpack": codec.MSGPACK, "cbor": codec.CBOR}
+wire_format = WIRE_FORMATS[os.environ.get("AGENT_WIRE_FORMAT", "json").lower()]
+wire_compression = os.environ.get("AGENT_WIRE_COMPRESSION", codec.GZIP).lower()
+
+# "<agent id>:<metadata cid>", sent instead of the full X-Agent-Meta to agents that resolve it
+METADATA_REF_HEADER = "X-Agent-Meta-Ref"
+# seconds a resolved metadata reference is trusted before the token uri is read again
+metadata_ref_ttl = float(os.environ.get("AGENT_METADATA_REF_TTL", 600))
+# seconds before a metadata reference that couldn't be resolved is tried again
+metadata_ref_retry_after = float(os.environ.get("AGENT_METADATA_REF_RETRY_AFTER", 30))
+# response headers announcing the request body formats and compressions an agent accepts
+ACCEPT_POST_HEADER = "Accept-Post"
+ACCEPT_ENCODING_HEADER = "Accept-Encoding"
+
+_links = weakref.WeakSet()
+
+
+def _breaker_states() -> dict:
+    states = {}
+    for link in list(_links):
+        for agent_id, breaker in list(link.breakers.items()):
+            states[(str(agent_id),)] = max(states.get((str(agent_id),), 0), STATE_VALUES[breaker.state])
+    return states
+
+
+metrics.REGISTRY.gauge("agent_link_circuit_state", "Circuit breaker state per target agent (0 closed, 1 half open, 2 open).",
+                       _breaker_states, ["agent_id"])
+
+
+def _is_failure(e: Exception) -> bool:
+    # answers refused by the target (bad parameters, unauthorized) say nothing about its health
+    if isinstance(e, AgentCallException) and e.status_code is not None:
+        return e.status_code >= 500 or e.status_code == 429
+    return True
+
+
+def _is_refused(e: BaseException) -> bool:
+    # 4xx answers are the target's final word, a second request gets the same
+    return isinstance(e, AgentCallException) and e.status_code is not None and e.status_code < 500
 
 
 class AgentLink(BaseRequestClient):
 
-    def __init__(self, agent_client: OnChainAgentRegistryClient) -> None:
+    def __init__(self, agent_client: AbstractRegistryClient, agent_meta_cache: dict | None = None, session: requests.Session | None = None,
+                 timeout: float | None = None, hedge_after: float | None = None, breaker_options: dict | None = None,
+                 metadata_by_cid: dict | None = None) -> None:
         self.agent_client = agent_client
-        self.agent_meta_cache = {}
-        super().__init__()
+        self.agent_meta_cache = {} if agent_meta_cache is None else agent_meta_cache
+        # "<agent id>:<metadata cid>" -> (caller metadata, monotonic time it is trusted until), to resolve X-Agent-Meta-Ref
+        self.metadata_by_cid = {} if metadata_by_cid is None else metadata_by_cid
+        # X-Agent-Meta-Ref that couldn't be resolved -> monotonic time of the next attempt
+        self._failed_refs = {}
+        # agent id -> (accepted body formats, accepted compressions), learned from the target's responses
+        self.capabilities = {}
+        # agent id -> session route, announced by payable agents
+        self.session_routes = {}
+        # agent id -> (session token or None, expires at), None until a failed handshake may be retried
+        self.sessions = {}
+        self.timeout = call_timeout if timeout is None else timeout
+        self.hedge_after = call_hedge_after if hedge_after is None else hedge_after
+        # see CircuitBreaker for the options
+        self.breaker_options = breaker_options or {}
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._pool = None
+        super().__init__(session=session)
+        _links.add(self)
 
     def _get_agent_meta(self, agent_id: int) -> AgentMetadata:
         if agent_id in self.agent_meta_cache:
+            metrics.record_cache("agent_metadata", True)
             return self.agent_meta_cache[agent_id]
         else:
+            metrics.record_cache("agent_metadata", False)
             agent_meta = self.agent_client.get_agent_meta(agent_id)
             self.agent_meta_cache[agent_id] = agent_meta
             return agent_meta
 
+    def resolve_metadata_ref(self, ref: str, max_size: int = 4096) -> AgentMetadata | None:
+        """
+        metadata of a caller sending X-Agent-Meta-Ref "<agent id>:<metadata cid>", None when it can't be resolved.
+        the cid must be the token uri of the agent, checked again every `metadata_ref_ttl` seconds. failed lookups are not
+        retried for `metadata_ref_retry_after` seconds.
+        """
+        metadata, valid_until = self.metadata_by_cid.get(ref, (None, 0))
+        if valid_until > time.monotonic():
+            metrics.record_cache("caller_metadata", True)
+            return metadata
+        if self._failed_refs.get(ref, 0) > time.monotonic():
+            metrics.record_cache("caller_metadata", True)
+            return None
+        metrics.record_cache("caller_metadata", False)
+        agent_id, _, cid = ref.partition(":")
+        ipfs_client = getattr(self.agent_client, "ipfs_client", None)
+        agent_nft = getattr(self.agent_client, "agent_nft", None)
+        try:
+            if ipfs_client is not None and agent_nft is not None and cid:
+                if agent_nft.token_uri(int(agent_id)) != cid:
+                    raise ValueError(f"{cid} is not the metadata of agent {agent_id}")
+                metadata = AgentMetadata.from_json(ipfs_client.download_file(cid))
+            else:
+                metadata = self._get_agent_meta(int(agent_id))
+        except Exception as e:
+            logging.warning(f"resolve caller metadata {ref} failed with error message {e}")
+            if len(self._failed_refs) >= max_size:
+                self._failed_refs.pop(next(iter(self._failed_refs)), None)
+            self._failed_refs[ref] = time.monotonic() + metadata_ref_retry_after
+            return None
+        if len(self.metadata_by_cid) >= max_size:
+            self.metadata_by_cid.pop(next(iter(self.metadata_by_cid)), None)
+        self.metadata_by_cid[ref] = (metadata, time.monotonic() + metadata_ref_ttl)
+        return metadata
+
+    def _encode_request(self, agent_id, headers: dict, parameters, metadata: AgentMetadata, metadata_ref: str | None,
+                        compact: bool) -> (dict, bytes):
+        # the compact form (binary body, compression, metadata reference) is only used with agents announcing support
+        headers = dict(headers)
+        accepted_types, accepted_encodings = self.capabilities.get(agent_id, ([], [])) if compact else ([], [])
+        if metadata_ref and accepted_types:
+            headers[METADATA_REF_HEADER] = metadata_ref
+        else:
+            headers["X-Agent-Meta"] = json.dumps(metadata.to_json())
+
+        content_type = wire_format if wire_format in accepted_types and wire_format in codec.content_types() else codec.JSON
+        data = codec.encode(parameters, content_type)
+        headers["Content-Type"] = content_type
+        if wire_compression in accepted_encodings and wire_compression in codec.encodings() and len(data) >= codec.COMPRESS_MIN_SIZE:
+            data = codec.compress(data, wire_compression)
+            headers["Content-Encoding"] = wire_compression
+        return headers, data
+
+    def _learn_capabilities(self, agent_id, response: requests.Response):
+        accept_post = response.headers.get(ACCEPT_POST_HEADER)
+        if accept_post is not None:
+            self.capabilities[agent_id] = (codec.parse_list(accept_post), codec.parse_list(response.headers.get(ACCEPT_ENCODING_HEADER)))
+        session_route = response.headers.get(SESSION_ROUTE_HEADER)
+        if session_route:
+            self.session_routes[agent_id] = session_route
+        else:
+            self.session_routes.pop(agent_id, None)
+
+    @staticmethod
+    def _decode_response(response: requests.Response, response_type):
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type in (codec.MSGPACK, codec.CBOR):
+            obj = codec.decode(response.content, content_type)
+            return response_type.model_validate(obj) if response_type else json.dumps(obj)
+        return response_type.model_validate_json(response.content) if response_type else response.text
+
+    def session_token(self, agent_id, current_agent_metadata: AgentMetadata, message_hash=None, signature=None,
+                metadata_ref: str | None = None, timeout: float | None = None, force=False) -> str | None:
+        """
+        session token for calls to `agent_id`, from the cache or a handshake with its session route. the handshake is
+        only made with agents that announced the route, or any agent with `force`. None when the target gives none.
+        """
+        token, expires_at = self.sessions.get(agent_id, (None, 0))
+        # renewed a little before it expires, so it doesn't expire in flight
+        if time.time() < expires_at - 10:
+            return token
+        route = self.session_routes.get(agent_id, SESSION_ROUTE if force else None)
+        if route is None:
+            return None
+
+        target_agent_meta = self._get_agent_meta(agent_id)
+        url = urljoin(target_agent_meta.endpoint.rstrip("/") + "/", route)
+        headers, data = self._encode_request(agent_id, {"X-Agent-Message-Hash": message_hash, "X-Agent-Signature": signature}, {},
+                                             current_agent_metadata, metadata_ref, compact=agent_id in self.capabilities)
+        try:
+            response = self.request(url, headers, None, timeout=deadline.budget(self.timeout if timeout is None else timeout), data=data)
+            result = response.json()
+            token, expires_at = result.get("token"), result.get("expires_at")
+        except Exception as e:
+            logging.warning(f"open session with agent {agent_id} failed with error message {e}")
+            token, expires_at = None, None
+        if not token or not expires_at:
+            # full authorization until the next attempt
+            self.sessions[agent_id] = (None, time.time() + 60)
+            return None
+        self.sessions[agent_id] = (token, expires_at)
+        return token
+
+    def _pooled_session(self) -> requests.Session:
+        # calls go through a pooled session once the link is warmed up, a bare `requests.post` reconnects each time
+        if self.session is None:
+            with self._breakers_lock:
+                if self.session is None:
+                    self.session = requests.Session()
+        return self.session
+
+    def warm_up(self, agent_id, timeout: float | None = None) -> AgentMetadata:
+        """
+        resolve the metadata of `agent_id` and open a pooled connection to its endpoint, so the first call costs what
+        the next ones do. the api description (GET /) is read over it, its headers tell the body formats and the
+        session route of the target.
+        """
+        target_agent_meta = self._get_agent_meta(agent_id)
+        url = target_agent_meta.endpoint.rstrip("/") + "/"
+        response = self._pooled_session().get(url, timeout=self.timeout if timeout is None else timeout)
+        if response.ok:
+            self._learn_capabilities(agent_id, response)
+        return target_agent_meta
+
+    def _breaker(self, agent_id) -> CircuitBreaker:
+        breaker = self.breakers.get(agent_id)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self.breakers.setdefault(agent_id, CircuitBreaker(**self.breaker_options))
+        return breaker
+
+    def breaker_stats(self) -> dict:
+        return {agent_id: breaker.stats() for agent_id, breaker in list(self.breakers.items())}
+
     def call(self, agent_id, task_id, method, parameters,
              current_agent_metadata: AgentMetadata,
              message_hash=None,
              signature=None,
-             sync=True):
+             sync=True,
+             response_type=None,
+             timeout: float | None = None,
+             hedge=False,
+             metadata_ref: str | None = None):
+        """
+        call `method` of agent `agent_id`.
+
+        the call fails after `timeout` seconds (default AGENT_CALL_TIMEOUT), or earlier when the request being served
+        has a shorter deadline, and the remaining time is sent to the target in the X-Agent-Timeout header.
+        `hedge` sends a second request when the first one is slow, only for methods safe to run twice.
+        a sync call with `response_type` returns the decoded response, which may then travel in a binary format.
+        `metadata_ref` ("<agent id>:<metadata cid>") replaces the caller metadata header for agents able to resolve it.
+        payable agents hand out a session token on the first call, sent with the next calls (see `session_token`).
+        """
         headers = {
-            "Content-Type": "application/json",
-            "X-Agent-Meta": json.dumps(current_agent_metadata.to_json()),
             "X-Agent-Task-Id": task_id,
             "X-Agent-Message-Hash": message_hash,
             "X-Agent-Signature": signature
         }
+        if sync and response_type is not None and wire_format != codec.JSON and wire_format in codec.content_types():
+            headers["Accept"] = f"{wire_format}, {codec.JSON};q=0.9"
 
-        target_agent_meta = self._get_agent_meta(agent_id)
-        url = urljoin(target_agent_meta.endpoint, method)
-        if sync:
-            return self.send(url, headers, parameters)
-        else:
-            return self.send_async(url, headers, parameters)
+        with tracing.start_span("agent.send", target_agent_id=str(agent_id), method=method, task_id=task_id):
+            tracing.inject_headers(headers)
+            timeout = deadline.budget(self.timeout if timeout is None else timeout)
+            if timeout is not None and timeout <= 0:
+                metrics.link_call_errors.inc(str(agent_id))
+                raise DeadlineExceededException(f"no time left to call agent {agent_id}")
+            if timeout is not None:
+                headers[deadline.DEADLINE_HEADER] = deadline.to_header(timeout)
+
+            target_agent_meta = self._get_agent_meta(agent_id)
+            # keep a path prefix in the endpoint (agents mounted on an AgentHost)
+            url = urljoin(target_agent_meta.endpoint.rstrip("/") + "/", method)
+            # the target checks the token instead of the subscription, the signature stays as a fallback
+            session = self.session_token(agent_id, current_agent_metadata, message_hash, signature, metadata_ref, timeout)
+            if session:
+                headers[SESSION_HEADER] = session
+
+            if sync:
+                start = time.perf_counter()
+                try:
+                    response = self._send_compact(agent_id, url, headers, parameters, current_agent_metadata, metadata_ref, timeout, hedge)
+                    return self._decode_response(response, response_type)
+                except Exception:
+                    metrics.link_call_errors.inc(str(agent_id))
+                    raise
+                finally:
+                    metrics.link_call_latency.observe(time.perf_counter() - start, str(agent_id))
+            else:
+                headers, data = self._encode_request(agent_id, headers, parameters, current_agent_metadata, metadata_ref, compact=True)
+                return self._stream(agent_id, url, headers, data, response_type, timeout)
+
+    def _send_compact(self, agent_id, url, headers, parameters, metadata, metadata_ref, timeout, hedge) -> requests.Response:
+        compact = agent_id in self.capabilities
+        request_headers, data = self._encode_request(agent_id, headers, parameters, metadata, metadata_ref, compact)
+        send = self._send_hedged if hedge else self.request
+        try:
+            response = self._send_guarded(agent_id, send, url, request_headers, timeout, data)
+        except AgentCallException as e:
+            # 401 is an authorization failure, sending the same caller again in plain json doesn't change it
+            if not compact or e.status_code not in (400, 415):
+                raise
+            # the target no longer accepts the compact form (e.g. downgraded, or can't resolve the metadata reference)
+            self.capabilities.pop(agent_id, None)
+            request_headers, data = self._encode_request(agent_id, headers, parameters, metadata, metadata_ref, False)
+            response = self._send_guarded(agent_id, send, url, request_headers, timeout, data)
+        self._learn_capabilities(agent_id, response)
+        return response
+
+    def _send_guarded(self, agent_id, send, url, headers, timeout, data) -> requests.Response:
+        # the breaker is asked right before the request goes out, every call it allows then records an outcome
+        breaker = self._breaker(agent_id)
+        if not breaker.allow():
+            raise CircuitOpenException(agent_id, breaker.retry_after())
+        start = time.perf_counter()
+        try:
+            response = send(url, headers, None, timeout=timeout, data=data)
+        except Exception as e:
+            breaker.record(not _is_failure(e), time.perf_counter() - start)
+            raise
+        except BaseException:
+            breaker.cancel()
+            raise
+        breaker.record(True, time.perf_counter() - start)
+        return response
+
+    def _stream(self, agent_id, url, headers, data, response_type, timeout):
+        # the breaker judges a stream by how its first event arrives, a stream never iterated is never sent
+        breaker = self._breaker(agent_id)
+        if not breaker.allow():
+            metrics.link_call_errors.inc(str(agent_id))
+            raise CircuitOpenException(agent_id, breaker.retry_after())
+        start = time.perf_counter()
+        recorded = False
+        try:
+            for item in self.send_async(url, headers, None, response_type=response_type, timeout=timeout, data=data):
+                if not recorded:
+                    breaker.record(True, time.perf_counter() - start)
+                    recorded = True
+                yield item
+            if not recorded:
+                breaker.record(True, time.perf_counter() - start)
+                recorded = True
+        except Exception as e:
+            if not recorded:
+                breaker.record(not _is_failure(e), time.perf_counter() - start)
+                recorded = True
+            raise
+        finally:
+            if not recorded:
+                breaker.cancel()
+
+    def _send_hedged(self, url, headers, parameters, timeout=None, data=None) -> requests.Response:
+        if self._pool is None:
+            with self._breakers_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent-link")
+        futures = [self._pool.submit(self.request, url, headers, parameters, timeout, data)]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if done and _is_refused(futures[0].exception()):
+            raise futures[0].exception()
+        if not done or futures[0].exception() is not None:
+            # slow, or failed on the way or on the target's side, race a second request
+            futures.append(self._pool.submit(self.request, url, headers, parameters, timeout, data))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+                if _is_refused(error):
+                    raise error
+        raise error
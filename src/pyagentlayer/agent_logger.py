@@ -2,8 +2,16 @@
 import logging
 import os
 import queue
+import threading
+import time
+
+from .metrics import REGISTRY
+from .utils.exceptions import CircuitOpenException
 
 agent_logger_id = os.environ.get("LOGGER_AGENT_ID", "5")
+# seconds before a failed log is sent again, doubled on each failure in a row up to the max
+log_retry_delay = float(os.environ.get("LOG_RETRY_DELAY", "0.5"))
+log_retry_max_delay = float(os.environ.get("LOG_RETRY_MAX_DELAY", "30"))
 
 
 class OnChainLog:
@@ -21,12 +29,17 @@ class OnChainLog:
         self.time_takes = time_takes
 
 
-log_queue: queue.Queue[OnChainLog] = queue.Queue()
+# (agent recording the log, log)
+log_queue: queue.Queue[tuple] = queue.Queue()
+_log_shipper: threading.Thread | None = None
+_log_shipper_lock = threading.Lock()
+REGISTRY.gauge("agent_onchain_log_queue_depth", "On-chain logs waiting to be recorded.", log_queue.qsize)
 
 
-def record_log(log: OnChainLog):
+def record_log(log: OnChainLog, agent=None):
+    # the log is sent by `agent`, by the agent which started the shipper when none is given
     global log_queue
-    log_queue.put_nowait(log)
+    log_queue.put_nowait((agent, log))
 
 
 def record_log_sync(agent, log: OnChainLog):
@@ -36,10 +49,31 @@ def record_log_sync(agent, log: OnChainLog):
 
 def monitor_new_onchain_log(agent):
     global log_queue
+    failures = 0
     while True:
-        log = log_queue.get()
+        sender, log = log_queue.get()
         try:
-            record_log_sync(agent, log)
+            record_log_sync(sender or agent, log)
+            failures = 0
+        except CircuitOpenException as e:
+            # the logger agent is failing, nothing is sent before the breaker lets a call through again
+            log_queue.put_nowait((sender, log))
+            time.sleep(e.retry_after or log_retry_delay)
         except Exception as e:
             logging.warning(f"record log on-chain failed with error message {e}")
-            log_queue.put_nowait(log)
+            log_queue.put_nowait((sender, log))
+            failures += 1
+            time.sleep(min(log_retry_delay * 2 ** (failures - 1), log_retry_max_delay))
+
+
+def start_log_shipper(agent) -> threading.Thread:
+    """
+    start the thread recording queued logs on-chain, once per process. each log is sent by the agent which queued it,
+    so agents served from one process share the queue and the thread but keep their own identity.
+    """
+    global _log_shipper
+    with _log_shipper_lock:
+        if _log_shipper is None or not _log_shipper.is_alive():
+            _log_shipper = threading.Thread(target=monitor_new_onchain_log, args=[agent], daemon=True)
+            _log_shipper.start()
+        return _log_shipper
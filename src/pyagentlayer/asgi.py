@@ -0,0 +1,389 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator
+
+from flask import Response as FlaskResponse
+
+from . import deadline, metrics, tracing
+from .admission import AdmissionController
+from .agent_link import METADATA_REF_HEADER, ACCEPT_POST_HEADER, ACCEPT_ENCODING_HEADER
+from .agent_logger import start_log_shipper
+from .models import AgentMetadata, ErrorMessage, Model
+from .session import SESSION_HEADER, SESSION_ROUTE, SESSION_ROUTE_HEADER
+from .utils import aio, codec
+from .utils.exceptions import AuthorizationException, OverloadedException
+from .utils.sse import stream_events, stream_events_async, SSE_MIMETYPE, SSE_HEADERS, HEARTBEAT_INTERVAL
+
+
+class Request:
+    method: str
+    path: str
+    # header names in lower case
+    headers: dict
+    body: bytes
+    remote_addr: str | None
+
+    def __init__(self, method: str, path: str, headers: dict, body: bytes, remote_addr: str | None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.remote_addr = remote_addr
+        self.caller = None
+        # the body went over codec.MAX_BODY_SIZE and was not read
+        self.too_large = False
+
+
+class Response:
+    status: int
+    headers: dict
+    body: bytes
+    # server-sent events, sent as they come instead of `body`
+    stream: AsyncIterator[str] | None
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str | None = "application/json",
+                 headers: dict | None = None, stream: AsyncIterator[str] | None = None):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        if content_type is not None:
+            self.headers.setdefault("Content-Type", content_type)
+        self.stream = stream
+        # called once the response is sent or the client is gone
+        self.on_close = []
+
+
+def _error_response(status: int, message: str, headers: dict | None = None, **fields) -> Response:
+    body = json.dumps({"success": False, "message": message, **fields}).encode("utf-8")
+    return Response(status, body, content_type="application/json; charset=utf-8", headers=headers)
+
+
+class AgentASGIApp:
+    """
+    asgi application serving an LAgent, with the routes and responses of the flask app, e.g.
+    `uvicorn.run(agent.create_asgi_app())` or `agent.run(asgi=True)`.
+
+    `async def` handlers and async generators run on the server's event loop, so one process holds as many in-flight
+    requests as the server accepts connections. sync handlers and the chain reads authorizing callers of payable agents
+    run in threads (`sync_workers` of them for handlers), and on-chain logs are always queued.
+    """
+
+    def __init__(self, agent, log_onchain=True, heartbeat_interval=HEARTBEAT_INTERVAL, enable_metrics=True,
+                 admission_control: AdmissionController | None = None, sync_workers=32):
+        self.agent = agent
+        self.log_onchain = log_onchain
+        self.heartbeat_interval = heartbeat_interval
+        self.enable_metrics = enable_metrics
+        self.admission_control = admission_control
+        self.executor = ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix="agent-sync")
+        agent.start_process_pools()
+
+        if log_onchain:
+            # start a thread for record onchain log
+            logging.debug("starting a thread for put agent log on-chain.")
+            start_log_shipper(agent)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        request = await self._read_request(scope, receive)
+        if request is None:
+            # client gone before the body was received
+            return
+        if request.too_large:
+            response = _error_response(413, f"request body larger than {codec.MAX_BODY_SIZE} bytes")
+        elif request.path == "/" and request.method in ("GET", "HEAD"):
+            response = self._api_list(request)
+        elif request.path == "/metrics" and self.enable_metrics and request.method == "GET":
+            response = Response(body=metrics.REGISTRY.render().encode("utf-8"), content_type=metrics.PROMETHEUS_MIMETYPE)
+        elif request.path == f"/{SESSION_ROUTE}" and request.method == "POST":
+            response = await self._open_session(request)
+        elif request.path.count("/") == 1 and len(request.path) > 1:
+            if request.method != "POST":
+                response = _error_response(405, "method not allowed", headers={"Allow": "POST"})
+            else:
+                response = await self._accept_request(request.path[1:], request)
+        else:
+            response = _error_response(404, "not found")
+        await self._send_response(response, receive, send, head=request.method == "HEAD")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_request(scope, receive) -> Request | None:
+        headers = {}
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").lower()
+            value = value.decode("latin-1")
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+        # bodies are read before the caller is authorized, stop reading at the limit
+        chunks = []
+        size = 0
+        too_large = headers.get("content-length", "0").isdigit() and int(headers.get("content-length", "0")) > codec.MAX_BODY_SIZE
+        while not too_large:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            too_large = size > codec.MAX_BODY_SIZE
+            if not message.get("more_body", False):
+                break
+
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):] or "/"
+        client = scope.get("client")
+        request = Request(scope["method"], path, headers, b"" if too_large else b"".join(chunks), client[0] if client else None)
+        request.too_large = too_large
+        return request
+
+    async def _send_response(self, response: Response, receive, send, head=False):
+        headers = [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in response.headers.items()]
+        if response.stream is None:
+            headers.append((b"content-length", str(len(response.body)).encode("latin-1")))
+        try:
+            await send({"type": "http.response.start", "status": response.status, "headers": headers})
+            if response.stream is None:
+                await send({"type": "http.response.body", "body": b"" if head else response.body})
+                return
+
+            disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+            try:
+                async for event in response.stream:
+                    if disconnected.done():
+                        logging.info("client disconnected, stop streaming response")
+                        break
+                    await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+                else:
+                    await send({"type": "http.response.body", "body": b""})
+            finally:
+                disconnected.cancel()
+                await response.stream.aclose()
+        finally:
+            for callback in response.on_close:
+                callback()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    def _api_list(self, request: Request) -> Response:
+        _, body, etag = self.agent.api_document()
+        headers = {
+            "ETag": f'"{etag}"',
+            # cached copies must be revalidated, which costs a 304 when nothing changed
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = [value.strip().removeprefix("W/") for value in request.headers.get("if-none-match", "").split(",")]
+        if headers["ETag"] in if_none_match or "*" in if_none_match:
+            response = Response(304, content_type=None, headers=headers)
+        else:
+            response = Response(body=body, headers=headers)
+        # callers warming up a connection (see AgentLink.warm_up) learn them before their first call
+        self._announce_capabilities(response)
+        return response
+
+    async def _open_session(self, request: Request) -> Response:
+        caller_metadata, caller_message_hash, caller_signature = await self._caller_from_headers(request)
+        try:
+            token, expires_at = await aio.run_in_executor(self.executor, self.agent.open_session, caller_metadata, caller_message_hash, caller_signature)
+        except AuthorizationException:
+            return _error_response(401, "current agent is payable,you have to subscribe before calling it")
+        return Response(body=json.dumps({"token": token, "expires_at": expires_at}).encode("utf-8"))
+
+    async def _accept_request(self, method_name: str, request: Request) -> Response:
+        start = time.perf_counter()
+        # joins the caller's trace when it sent a traceparent header
+        with tracing.start_span("agent.request", traceparent=request.headers.get(tracing.TRACEPARENT_HEADER),
+                                route=method_name, agent_id=self.agent.agent_id,
+                                parent_task_id=request.headers.get("x-agent-task-id")) as span:
+            # the caller's remaining budget bounds the calls this request makes to other agents
+            timeout = deadline.parse_header(request.headers.get(deadline.DEADLINE_HEADER.lower()))
+            if timeout is not None and timeout <= 0:
+                response = _error_response(504, "deadline exceeded")
+            else:
+                with deadline.scope(timeout):
+                    if self.admission_control is not None and method_name in self.agent.message_route:
+                        response = await self._admit_and_handle(method_name, request)
+                    else:
+                        response = await self._handle_request(method_name, request)
+            self._negotiate_encoding(request, response)
+            span.set_attribute("status_code", response.status)
+            if response.status >= 400:
+                span.status = "error"
+
+        if self.enable_metrics:
+            # unknown methods share one label, so callers can't blow up the number of series
+            route = method_name if method_name in self.agent.message_route else "unknown"
+            agent = str(self.agent.agent_id)
+            metrics.request_count.inc(agent, route)
+            metrics.request_latency.observe(time.perf_counter() - start, agent, route)
+            if response.status >= 400:
+                metrics.request_errors.inc(agent, route, str(response.status))
+        return response
+
+    def _announce_capabilities(self, response: Response):
+        # the body formats and compressions accepted, callers switch to them for the next requests
+        response.headers[ACCEPT_POST_HEADER] = ", ".join(codec.content_types())
+        response.headers[ACCEPT_ENCODING_HEADER] = ", ".join(codec.encodings())
+        if self.agent.subscription_plan:
+            # subscribers may trade their proof for a session token there
+            response.headers[SESSION_ROUTE_HEADER] = SESSION_ROUTE
+
+    def _negotiate_encoding(self, request: Request, response: Response):
+        self._announce_capabilities(response)
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+        if response.stream is not None or response.status != 200 or "Content-Encoding" in response.headers:
+            return
+        encoding = codec.negotiate(request.headers.get("accept-encoding"), codec.encodings())
+        if encoding and len(response.body) >= codec.COMPRESS_MIN_SIZE:
+            response.body = codec.compress(response.body, encoding)
+            response.headers["Content-Encoding"] = encoding
+
+    async def _caller_from_headers(self, request: Request) -> tuple:
+        # parsed once per request
+        if request.caller is not None:
+            return request.caller
+        caller_metadata = request.headers.get("x-agent-meta")
+        caller_metadata_ref = request.headers.get(METADATA_REF_HEADER.lower())
+        if caller_metadata:
+            caller_metadata = AgentMetadata.from_json(json.loads(caller_metadata))
+        elif caller_metadata_ref:
+            # may download the metadata from ipfs
+            caller_metadata = await aio.run_in_executor(self.executor, self.agent.agent_link.resolve_metadata_ref, caller_metadata_ref)
+        else:
+            caller_metadata = None
+        request.caller = caller_metadata, request.headers.get("x-agent-message-hash"), request.headers.get("x-agent-signature")
+        return request.caller
+
+    async def _admit_and_handle(self, method_name: str, request: Request) -> Response:
+        # only cheap checks before admission, the caller metadata is read once the request is admitted
+        caller = self.agent._caller_key(request.remote_addr, request.headers.get(SESSION_HEADER.lower()))
+        weight = self.admission_control.weight_of(self.agent._cached_tier(caller)) if self.admission_control.tier_weights else 1.0
+        try:
+            # waits on the event loop, not in a thread
+            slot = await self.admission_control.acquire_async(caller, weight)
+        except OverloadedException as e:
+            logging.info(f"reject request <{method_name}> from {caller}: {e.reason}")
+            return _error_response(429, "too many requests, please retry later", headers={"Retry-After": str(e.retry_after)},
+                                   queue_depth=e.queue_depth)
+        try:
+            response = await self._handle_request(method_name, request)
+        except BaseException:
+            slot.release()
+            raise
+        # held until the response is sent, streamed responses keep their slot while streaming
+        response.on_close.append(slot.release)
+        return response
+
+    def _read_parameters(self, request: Request) -> (dict | None, Response | None):
+        content_type = request.headers.get("content-type", codec.JSON).split(";")[0].strip().lower() or codec.JSON
+        content_encoding = request.headers.get("content-encoding")
+        if not codec.is_supported(content_type, content_encoding):
+            return None, _error_response(415, f"unsupported body {content_type} {content_encoding or ''}".strip(),
+                                         headers={ACCEPT_POST_HEADER: ", ".join(codec.content_types())})
+        try:
+            return codec.decode(codec.decompress(request.body, content_encoding), content_type), None
+        except codec.BodyTooLargeError:
+            return None, _error_response(413, f"request body larger than {codec.MAX_BODY_SIZE} bytes")
+        except Exception as e:
+            logging.warning(f"invalid request body: {e}")
+            return None, _error_response(400, "invalid request body")
+
+    @staticmethod
+    def _render(request: Request, model: Model) -> Response:
+        # binary formats only for callers asking for them, everyone else keeps json
+        content_type = codec.negotiate(request.headers.get("accept"), codec.content_types(), codec.JSON)
+        if content_type == codec.JSON:
+            return Response(body=model.model_dump_json().encode("utf-8"))
+        return Response(body=codec.encode(model.model_dump(mode="json"), content_type), content_type=content_type)
+
+    async def _handle_request(self, method_name: str, request: Request) -> Response:
+        if method_name not in self.agent.message_route:
+            msg = f"method {method_name} not found/registered for current agent"
+            return Response(body=ErrorMessage(error=msg).json().encode("utf-8"))
+
+        parameters, error_response = self._read_parameters(request)
+        if error_response is not None:
+            return error_response
+        caller_metadata, caller_message_hash, caller_signature = await self._caller_from_headers(request)
+        parent_task_id = request.headers.get("x-agent-task-id") if caller_metadata else ""
+
+        route = self.agent.message_route[method_name]
+        func = route.get('method')
+        parameter_type = route.get('parameter')
+        response_type = route.get('response')
+
+        try:
+            res = await self.agent.call_function_async(func, parameter_type(**parameters), caller_metadata, caller_message_hash=caller_message_hash,
+                                                       caller_signature=caller_signature, parent_task_id=parent_task_id, log_onchain=self.log_onchain,
+                                                       route_name=method_name, executor=self.executor,
+                                                       caller_session=request.headers.get(SESSION_HEADER.lower()))
+        except AuthorizationException:
+            return _error_response(401, "current agent is payable,you have to subscribe before calling it")
+        except Exception as e:
+            logging.error(e)
+            return _error_response(500, "Internal Server Error")
+
+        def encode(chunk):
+            if isinstance(chunk, Model):
+                return chunk.json()
+            elif isinstance(chunk, dict):
+                return response_type(**chunk).json()
+            return str(chunk)
+
+        if isinstance(res, FlaskResponse):
+            if res.is_streamed:
+                return Response(res.status_code, content_type=None, headers=dict(res.headers),
+                                stream=self._iterate_in_thread(str(chunk, "utf-8") if isinstance(chunk, bytes) else chunk for chunk in res.response))
+            return Response(res.status_code, res.get_data(), content_type=None, headers=dict(res.headers))
+        elif isinstance(res, Model):
+            return self._render(request, res)
+        elif isinstance(res, dict):
+            return self._render(request, response_type(**res))
+        elif hasattr(res, "__anext__"):
+            return Response(content_type=SSE_MIMETYPE, headers=SSE_HEADERS,
+                            stream=stream_events_async(res, encode, heartbeat_interval=self.heartbeat_interval))
+        elif hasattr(res, "__next__"):
+            # sync generators keep their producer thread, see stream_events
+            return Response(content_type=SSE_MIMETYPE, headers=SSE_HEADERS,
+                            stream=self._iterate_in_thread(stream_events(res, encode, heartbeat_interval=self.heartbeat_interval)))
+        else:
+            logging.error(f"invalid response type {type(res)}, should be Model or dict")
+            return _error_response(500, "Internal Server Error")
+
+    async def _iterate_in_thread(self, events: Iterator[str]) -> AsyncIterator[str]:
+        end = object()
+        try:
+            while True:
+                event = await aio.run_in_executor(self.executor, next, events, end)
+                if event is end:
+                    return
+                yield event
+        finally:
+            if hasattr(events, "close"):
+                try:
+                    events.close()
+                except ValueError:
+                    # still running in a worker thread, it stops on its own once the chunk is produced
+                    pass
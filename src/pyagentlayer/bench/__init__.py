@@ -0,0 +1,5 @@
+from .calls import CallBenchReport, run_call_bench
+from .chain import LocalChain
+from .ipfs import LocalIPFS
+from .load import LoadGenerator, LoadReport
+from .runner import LocalEndpoints, run_bench, use_local_network
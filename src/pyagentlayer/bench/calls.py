@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+import time
+
+from eth_account import Account
+
+from .chain import LocalChain
+from .runner import LocalEndpoints
+from .. import agent_executor
+
+
+class CallBenchReport:
+    def __init__(self, iterations: int, results: dict):
+        self.iterations = iterations
+        # fn name -> path -> (wall time, cpu time of the calling thread) per call in seconds
+        self.results = results
+
+    def to_json(self) -> dict:
+        report = {}
+        for fn_name, paths in self.results.items():
+            (web3_wall, web3_cpu), (raw_wall, raw_cpu) = paths["web3"], paths["precompiled"]
+            report[fn_name] = {
+                "web3_us": round(web3_wall * 1e6, 1),
+                "precompiled_us": round(raw_wall * 1e6, 1),
+                "web3_cpu_us": round(web3_cpu * 1e6, 1),
+                "precompiled_cpu_us": round(raw_cpu * 1e6, 1),
+                "cpu_speedup": round(web3_cpu / raw_cpu, 2) if raw_cpu else 0.0,
+            }
+        return report
+
+    def __str__(self):
+        return "\n".join(f"{fn_name}: " + ", ".join(f"{k} {v}" for k, v in values.items())
+                         for fn_name, values in self.to_json().items())
+
+
+def _measure(call, iterations: int) -> (float, float):
+    call()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - wall) / iterations, (time.thread_time() - cpu) / iterations
+
+
+def run_call_bench(iterations=1000, rpc_latency=0.0) -> CallBenchReport:
+    """
+    compare web3's `contract.functions.X(...).call()` to the precompiled raw `eth_call` of the executors, against the
+    local chain stand-in with the read cache bypassed. the cpu time is the one of the calling thread, the chain is
+    served from other threads.
+    """
+    chain = LocalChain(latency=rpc_latency).start()
+    try:
+        with LocalEndpoints(chain):
+            return _run_call_bench(chain, iterations)
+    finally:
+        chain.stop()
+
+
+def _run_call_bench(chain: LocalChain, iterations: int) -> CallBenchReport:
+    owner = Account.create().address
+    subscriber = chain.smart_wallet_of(Account.create().address, create=True)
+    target = chain.smart_wallet_of(owner, create=True)
+    chain.subscribe(subscriber, target)
+    chain.prices[(2, target.lower())] = 10 ** 18
+    token_id = chain.mint(owner, "ipfs://bench")
+
+    calls = [
+        (agent_executor.new_subscription_contract(), "isSubscribed", (subscriber, target)),
+        (agent_executor.new_subscription_contract(), "getSubscriptionPrice", (2, target)),
+        (agent_executor.new_agent_nft(), "ownerOf", (token_id,)),
+    ]
+    results = {}
+    for executor, fn_name, args in calls:
+        precompiled = executor.precompiled[fn_name]
+        results[fn_name] = {
+            "web3": _measure(lambda: executor.contract.functions[fn_name](*args).call(), iterations),
+            "precompiled": _measure(lambda: executor._eth_call(precompiled, args), iterations),
+        }
+    return CallBenchReport(iterations, results)
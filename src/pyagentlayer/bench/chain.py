@@ -0,0 +1,315 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_account._utils.legacy_transactions import Transaction
+from eth_account._utils.typed_transactions import TypedTransaction
+from eth_utils import function_abi_to_4byte_selector, keccak, to_checksum_address
+from flask import Flask, request as flask_request
+from hexbytes import HexBytes
+
+from .server import BackgroundServer
+from .. import agent_executor
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+TRANSFER_TOPIC = "0x" + keccak(text="Transfer(address,address,uint256)").hex()
+SUBSCRIPTION_SECONDS = {1: 7 * 24 * 3600, 2: 30 * 24 * 3600, 3: 365 * 24 * 3600}
+
+
+def _hex(value: int) -> str:
+    return hex(value)
+
+
+def _word(value) -> str:
+    # 32 byte topic for an address or integer
+    if isinstance(value, str):
+        return "0x" + value[2:].lower().rjust(64, "0")
+    return "0x" + hex(value)[2:].rjust(64, "0")
+
+
+def _decode_raw_transaction(raw: bytes) -> dict:
+    if raw[0] <= 0x7f:
+        return TypedTransaction.from_bytes(HexBytes(raw)).as_dict()
+    return rlp.decode(raw, Transaction).as_dict()
+
+
+class LocalChain:
+    """
+    in-process stand-in for the agentlayer chain, implementing the AgentNFT, SmartWalletFactory, SmartWallet, AGENT and
+    Subscription views and transactions used by `agent_executor`, served over JSON-RPC.
+
+    every request sleeps `latency` seconds to simulate a remote node, each transaction is mined in its own block.
+    """
+
+    chain_id = 1337
+    base_fee = 1_000_000_000
+    gas_limit = 300_000
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.block_number = 1
+        self._lock = threading.Lock()
+
+        self.owners = {}
+        self.token_uris = {}
+        self.next_token_id = 1
+        # eoa -> smart wallet
+        self.smart_wallets = {}
+        # (period, wallet) -> price
+        self.prices = {}
+        # (subscriber, target) -> (expire time, auto renewal)
+        self.subscriptions = {}
+        self.balances = {}
+        self.nonces = {}
+        self.receipts = {}
+        self.logs = []
+
+        self._functions = {
+            agent_executor.agent_nft_address.lower(): self._selectors(agent_executor.agent_nft_abi),
+            agent_executor.smart_wallet_factory_address.lower(): self._selectors(agent_executor.smart_wallet_factory_abi),
+            agent_executor.agent_address.lower(): self._selectors(agent_executor.agent_abi),
+            agent_executor.subscription_address.lower(): self._selectors(agent_executor.subscription_abi),
+        }
+        self._smart_wallet_functions = self._selectors(agent_executor.smart_wallet_abi)
+
+        self.app = Flask(__name__)
+        self.app.add_url_rule("/", "rpc", self._rpc, methods=["POST"])
+        self._server = None
+
+    @staticmethod
+    def _selectors(abi) -> dict:
+        return {function_abi_to_4byte_selector(f): f for f in abi if f.get("type") == "function"}
+
+    # state helpers, also used to preload fixtures without sending transactions
+
+    def mint(self, owner: str, token_uri: str, emit_log=True) -> int:
+        with self._lock:
+            token_id = self.next_token_id
+            self.next_token_id += 1
+            self.owners[token_id] = owner.lower()
+            self.token_uris[token_id] = token_uri
+            if emit_log:
+                # preloaded mints get their own block, like a mined transaction
+                self.block_number += 1
+            block_number = self.block_number
+        if emit_log:
+            self._append_logs([self._transfer_log(owner, token_id)], block_number, _word(0))
+        return token_id
+
+    @staticmethod
+    def _transfer_log(owner, token_id):
+        return {"address": agent_executor.agent_nft_address, "topics": [TRANSFER_TOPIC, _word(ZERO_ADDRESS), _word(owner), _word(token_id)]}
+
+    def _append_logs(self, logs, block_number, tx_hash) -> list:
+        block_hash = _word(block_number)
+        formatted = [{
+            "address": log["address"],
+            "topics": log["topics"],
+            "data": log.get("data", "0x"),
+            "blockHash": block_hash,
+            "blockNumber": _hex(block_number),
+            "transactionHash": tx_hash,
+            "transactionIndex": "0x0",
+            "logIndex": _hex(i),
+            "removed": False,
+        } for i, log in enumerate(logs)]
+        with self._lock:
+            self.logs.extend(formatted)
+        return formatted
+
+    def smart_wallet_of(self, eoa: str, create=False) -> str:
+        eoa = eoa.lower()
+        if eoa not in self.smart_wallets and create:
+            self.smart_wallets[eoa] = to_checksum_address(keccak(text=f"smart-wallet:{eoa}")[-20:])
+        return self.smart_wallets.get(eoa, ZERO_ADDRESS)
+
+    def subscribe(self, subscriber: str, target: str, period: int = 2, auto_renewal=False):
+        self.subscriptions[(subscriber.lower(), target.lower())] = (int(time.time()) + SUBSCRIPTION_SECONDS[period], auto_renewal)
+
+    def set_balance(self, address: str, amount: int):
+        self.balances[address.lower()] = amount
+
+    # contract calls
+
+    def _view(self, sender, to, fn_name, args):
+        if fn_name in ("ownerOf", "tokenURI"):
+            if args[0] not in self.owners:
+                raise ValueError(f"execution reverted: ERC721NonexistentToken({args[0]})")
+            return self.owners[args[0]] if fn_name == "ownerOf" else self.token_uris[args[0]]
+        if fn_name == "eoaOwnedWallet":
+            return self.smart_wallet_of(args[0])
+        if fn_name == "balanceOf":
+            return self.balances.get(args[0].lower(), 0)
+        if fn_name == "getSubscriptionPrice":
+            return self.prices.get((args[0], args[1].lower()), 0)
+        if fn_name in ("isSubscribed", "isAutoRenewal", "getSubscriptionLeftTime"):
+            expire_time, auto_renewal = self.subscriptions.get((args[0].lower(), args[1].lower()), (0, False))
+            left_time = max(expire_time - int(time.time()), 0)
+            if fn_name == "isSubscribed":
+                return left_time > 0
+            return auto_renewal if fn_name == "isAutoRenewal" else left_time
+        raise ValueError(f"unsupported view {fn_name}")
+
+    def _transact(self, sender, to, fn_name, args) -> list:
+        # returns the logs emitted by the transaction
+        if fn_name == "safeMint":
+            token_id = self.mint(sender, args[0], emit_log=False)
+            # the executor reads the token id from the second log
+            return [self._transfer_log(sender, token_id), self._transfer_log(sender, token_id)]
+        if fn_name == "createWallet":
+            self.smart_wallet_of(sender, create=True)
+            return []
+        if fn_name == "setSubscriptionPrice":
+            self.prices[(args[0], args[1].lower())] = args[2]
+            return []
+        if fn_name == "subscribeOtherAgent":
+            period, target, auto_renewal = args
+            price = self.prices.get((period, target.lower()), 0)
+            wallet = to.lower()
+            if self.balances.get(wallet, 0) < price:
+                raise ValueError("insufficient balance")
+            self.balances[wallet] = self.balances.get(wallet, 0) - price
+            self.balances[target.lower()] = self.balances.get(target.lower(), 0) + price
+            self.subscribe(wallet, target, period, auto_renewal)
+            return []
+        raise ValueError(f"unsupported transaction {fn_name}")
+
+    def _function(self, to: str, data: bytes):
+        functions = self._functions.get(to.lower(), self._smart_wallet_functions)
+        fn = functions.get(bytes(data[:4]))
+        if fn is None:
+            raise ValueError(f"unknown selector {bytes(data[:4]).hex()} for {to}")
+        args = decode([i["type"] for i in fn["inputs"]], bytes(data[4:]))
+        return fn, list(args)
+
+    def _call(self, params):
+        call = params[0]
+        fn, args = self._function(call["to"], bytes.fromhex(call.get("data", call.get("input", "0x"))[2:]))
+        result = self._view(call.get("from"), call["to"], fn["name"], args)
+        return "0x" + encode([o["type"] for o in fn["outputs"]], [result]).hex()
+
+    def _send_raw_transaction(self, params):
+        raw = bytes.fromhex(params[0][2:])
+        sender = Account.recover_transaction(raw).lower()
+        tx = _decode_raw_transaction(raw)
+        to = "0x" + bytes(tx["to"]).hex()
+        tx_hash = "0x" + keccak(raw).hex()
+        fn, args = self._function(to, bytes(tx["data"]))
+        with self._lock:
+            self.nonces[sender] = max(self.nonces.get(sender, 0), tx["nonce"] + 1)
+            self.block_number += 1
+            block_number = self.block_number
+        try:
+            logs = self._transact(sender, to, fn["name"], args)
+            status = 1
+        except ValueError:
+            logs, status = [], 0
+        self.receipts[tx_hash] = {
+            "transactionHash": tx_hash,
+            "transactionIndex": "0x0",
+            "blockHash": _word(block_number),
+            "blockNumber": _hex(block_number),
+            "from": sender,
+            "to": to,
+            "cumulativeGasUsed": _hex(self.gas_limit),
+            "gasUsed": _hex(self.gas_limit),
+            "effectiveGasPrice": _hex(self.base_fee),
+            "contractAddress": None,
+            "logs": self._append_logs(logs, block_number, tx_hash),
+            "logsBloom": "0x" + "00" * 256,
+            "status": _hex(status),
+            "type": "0x2",
+        }
+        return tx_hash
+
+    def _block(self, params):
+        number = self._block_number(params[0])
+        return {
+            "number": _hex(number),
+            "hash": _word(number),
+            "parentHash": _word(number - 1),
+            "timestamp": _hex(int(time.time())),
+            "baseFeePerGas": _hex(self.base_fee),
+            "gasLimit": _hex(30_000_000),
+            "gasUsed": "0x0",
+            "miner": ZERO_ADDRESS,
+            "transactions": [],
+        }
+
+    def _get_logs(self, params):
+        query = params[0]
+        addresses = query.get("address") or []
+        addresses = {a.lower() for a in ([addresses] if isinstance(addresses, str) else addresses)}
+        from_block = self._block_number(query.get("fromBlock", "latest"))
+        to_block = self._block_number(query.get("toBlock", "latest"))
+        topics = (query.get("topics") or [None])[0]
+        topics = {topics} if isinstance(topics, str) else set(topics or [])
+        return [log for log in list(self.logs)
+                if (not addresses or log["address"].lower() in addresses)
+                and from_block <= int(log["blockNumber"], 16) <= to_block
+                and (not topics or log["topics"][0] in topics)]
+
+    def _block_number(self, block) -> int:
+        if isinstance(block, int):
+            return block
+        return self.block_number if block in ("latest", "pending", "safe", "finalized") else int(block, 16)
+
+    def handle(self, method: str, params: list):
+        if method == "eth_chainId":
+            return _hex(self.chain_id)
+        if method == "net_version":
+            return str(self.chain_id)
+        if method == "eth_blockNumber":
+            return _hex(self.block_number)
+        if method == "eth_getBlockByNumber":
+            return self._block(params)
+        if method == "eth_call":
+            return self._call(params)
+        if method == "eth_getTransactionCount":
+            return _hex(self.nonces.get(params[0].lower(), 0))
+        if method == "eth_estimateGas":
+            return _hex(self.gas_limit)
+        if method == "eth_gasPrice":
+            return _hex(self.base_fee)
+        if method == "eth_maxPriorityFeePerGas":
+            return _hex(self.base_fee // 10)
+        if method == "eth_sendRawTransaction":
+            return self._send_raw_transaction(params)
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        if method == "eth_getLogs":
+            return self._get_logs(params)
+        raise NotImplementedError(method)
+
+    def _rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+        payload = flask_request.get_json()
+        if isinstance(payload, list):
+            return [self._handle_one(p) for p in payload]
+        return self._handle_one(payload)
+
+    def _handle_one(self, payload):
+        response = {"jsonrpc": "2.0", "id": payload.get("id")}
+        try:
+            response["result"] = self.handle(payload["method"], payload.get("params", []))
+        except NotImplementedError as e:
+            response["error"] = {"code": -32601, "message": f"method not found: {e}"}
+        except Exception as e:
+            response["error"] = {"code": -32000, "message": str(e)}
+        return response
+
+    @property
+    def url(self) -> str:
+        return self._server.url
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server = BackgroundServer(self.app, host, port).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.stop()
@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import json
+import threading
+import time
+
+from flask import Flask, request as flask_request
+
+from .server import BackgroundServer
+from ..utils.ipfs import AbsIPFSClient
+
+
+class LocalIPFSClient(AbsIPFSClient):
+    def __init__(self, endpoint):
+        super().__init__()
+        self._endpoint = endpoint
+
+
+class LocalIPFS:
+    """
+    stand-in for the ipfs upload api and gateway, files are kept in memory and addressed by their sha256.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.files = {}
+        self._lock = threading.Lock()
+        self.app = Flask(__name__)
+        self.app.add_url_rule("/api/ipfs", "upload", self._upload, methods=["POST"])
+        self.app.add_url_rule("/ipfs/<cid>", "download", self._download, methods=["GET"])
+        self._server = None
+
+    def add(self, content: bytes) -> str:
+        cid = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            self.files[cid] = content
+        return cid
+
+    def add_json(self, json_data: dict) -> str:
+        return self.add(json.dumps(json_data).encode("utf-8"))
+
+    def _upload(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return {"cid": self.add(flask_request.files["file"].read())}
+
+    def _download(self, cid):
+        if self.latency:
+            time.sleep(self.latency)
+        if cid not in self.files:
+            return {"error": {"message": f"{cid} not found"}}, 404
+        return self.files[cid], 200, {"Content-Type": "application/octet-stream"}
+
+    @property
+    def gateway_url(self) -> str:
+        return f"{self._server.url}/ipfs/"
+
+    def client(self) -> LocalIPFSClient:
+        return LocalIPFSClient(f"{self._server.url}/api/ipfs")
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server = BackgroundServer(self.app, host, port).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.stop()
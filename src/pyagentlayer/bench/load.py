@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+import itertools
+import threading
+import time
+
+import requests
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class LoadReport:
+    def __init__(self, latencies: list, errors: int, elapsed: float):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def to_json(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(self.throughput, 1),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+            "max_ms": round(self.latencies[-1] * 1000, 2) if self.latencies else 0.0,
+        }
+
+    def __str__(self):
+        report = self.to_json()
+        return "\n".join(f"{k}: {v}" for k, v in report.items())
+
+
+class LoadGenerator:
+    """
+    drive POST /<method_name> of an agent from `concurrency` threads until `total_requests` are sent.
+    """
+
+    def __init__(self, url: str, payload: dict, headers: dict | None = None, total_requests=1000, concurrency=8, warmup=10):
+        self.url = url
+        self.payload = payload
+        self.headers = headers or {}
+        self.total_requests = total_requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+
+    def _worker(self, counter, latencies: list, errors: list):
+        session = requests.Session()
+        while next(counter) < self.total_requests:
+            start = time.perf_counter()
+            try:
+                response = session.post(self.url, json=self.payload, headers=self.headers)
+                ok = response.ok
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(1)
+
+    def run(self) -> LoadReport:
+        session = requests.Session()
+        for _ in range(self.warmup):
+            session.post(self.url, json=self.payload, headers=self.headers)
+
+        # itertools.count hands out request numbers without a lock
+        counter = itertools.count()
+        latencies, errors = [], []
+        threads = [threading.Thread(target=self._worker, args=(counter, latencies, errors), daemon=True) for _ in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return LoadReport(latencies, len(errors), time.perf_counter() - start)
@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+import json
+import logging
+import uuid
+from datetime import datetime
+
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+from .chain import LocalChain
+from .ipfs import LocalIPFS
+from .load import LoadGenerator, LoadReport
+from .server import BackgroundServer
+from .. import agent_executor
+from ..models import AgentMetadata
+from ..utils import ipfs as ipfs_module
+
+
+class LocalEndpoints:
+    """
+    point executors and ipfs clients created from now on at the local stand-ins, until `restore` or the end of the
+    with block using it, which put back the endpoints of the process.
+    """
+
+    def __init__(self, chain: LocalChain, ipfs: LocalIPFS | None = None):
+        self._saved = (agent_executor.rpc_endpoint, ipfs_module.ipfs_gateway)
+        agent_executor.rpc_endpoint = chain.url
+        if ipfs is not None:
+            ipfs_module.ipfs_gateway = ipfs.gateway_url
+
+    def restore(self):
+        agent_executor.rpc_endpoint, ipfs_module.ipfs_gateway = self._saved
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.restore()
+
+
+def use_local_network(agent, chain: LocalChain, ipfs: LocalIPFS) -> LocalEndpoints:
+    """
+    point the agent's executors, registry and ipfs client at the local stand-ins and register it there. the returned
+    endpoints restore those of the process when used as a context manager (or on `restore`).
+    """
+    endpoints = LocalEndpoints(chain, ipfs)
+    try:
+        _register_locally(agent, chain, ipfs)
+    except BaseException:
+        endpoints.restore()
+        raise
+    return endpoints
+
+
+def _register_locally(agent, chain: LocalChain, ipfs: LocalIPFS):
+    if agent.wallet:
+        agent._init_with_private_key(agent.wallet.key.hex())
+    else:
+        agent._init_with_signature(agent.message_hash, agent.signature)
+        # without private key the agent can't send the setup transactions itself
+        wallet = chain.smart_wallet_of(agent.wallet_address, create=True)
+        for plan in agent.subscription_plan or []:
+            chain.prices[(plan.period.value, wallet)] = int(plan.price_in_agent * 10 ** 18)
+    agent.agent_client.ipfs_client = ipfs.client()
+
+    metadata = dict(agent.metadata.to_json(), wallet=agent.wallet_address)
+    agent.agent_id = chain.mint(agent.wallet_address, ipfs.add_json(metadata))
+
+
+def subscribed_caller_headers(agent, chain: LocalChain) -> dict:
+    # a fresh caller subscribed to the agent, so payable agents run the full authorization path
+    caller = Account.create()
+    caller_wallet = chain.smart_wallet_of(caller.address, create=True)
+    chain.subscribe(caller_wallet, agent.aa_wallet_address)
+    metadata = AgentMetadata(key=str(uuid.uuid4()), name="bench-caller", description="", version="1.0.0", endpoint="http://localhost",
+                             register_time=int(datetime.now().timestamp()), wallet=caller.address, contract_wallet=caller_wallet)
+    signed_message = caller.sign_message(encode_defunct(text="sign in agentlayer for agent call"))
+    return {
+        "X-Agent-Meta": json.dumps(metadata.to_json()),
+        "X-Agent-Task-Id": "",
+        "X-Agent-Message-Hash": signed_message.messageHash.hex(),
+        "X-Agent-Signature": signed_message.signature.hex(),
+    }
+
+
+def run_bench(agent, method: str | None = None, payload: dict | None = None, total_requests=1000, concurrency=8,
+              rpc_latency=0.0, ipfs_latency=0.0, host="127.0.0.1", port=0) -> LoadReport:
+    """
+    run the agent against local chain/ipfs stand-ins and measure POST /<method> throughput and latency.
+    """
+    if not agent.message_route:
+        raise ValueError("agent has no registered message to benchmark")
+    method = method or next(iter(agent.message_route))
+    if method not in agent.message_route:
+        raise ValueError(f"method {method} not found/registered for current agent")
+
+    chain = LocalChain(latency=rpc_latency).start()
+    ipfs = LocalIPFS(latency=ipfs_latency).start()
+    try:
+        with use_local_network(agent, chain, ipfs):
+            agent.initialize()
+            server = BackgroundServer(agent.create_app(log_onchain=False), host, port).start()
+            try:
+                headers = subscribed_caller_headers(agent, chain) if agent.subscription_plan else {}
+                logging.info(f"benchmark {server.url}/{method}: {total_requests} requests, concurrency {concurrency}, rpc latency {rpc_latency * 1000:.1f} ms")
+                return LoadGenerator(f"{server.url}/{method}", payload or {}, headers=headers,
+                                     total_requests=total_requests, concurrency=concurrency).run()
+            finally:
+                server.stop()
+    finally:
+        chain.stop()
+        ipfs.stop()
@@ -0,0 +1,27 @@
+# -*- coding:utf-8 -*-
+import logging
+import threading
+
+from werkzeug.serving import make_server
+
+
+class BackgroundServer:
+    """
+    serve a wsgi app from a daemon thread, port 0 picks a free port.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self._server = make_server(host, port, app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def start(self):
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
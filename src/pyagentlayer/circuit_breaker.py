@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# gauge values of the states
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    circuit breaker over the last `window` calls to one target.
+
+    the circuit opens when, over at least `min_calls` calls, the rate of failed calls reaches `failure_rate_threshold`
+    or the rate of calls slower than `slow_call_threshold` seconds reaches `slow_call_rate_threshold`. calls are then
+    rejected without being sent for `open_timeout` seconds, after which `half_open_calls` probe calls are let through:
+    the circuit closes when they all succeed and opens again on the first failure.
+    """
+
+    def __init__(self, failure_rate_threshold=0.5, slow_call_threshold=10.0, slow_call_rate_threshold=0.8, window=20,
+                 min_calls=5, open_timeout=30.0, half_open_calls=1):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        # (failed, slow) of the last calls
+        self._calls = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        whether a call may be sent now, a call allowed must be followed by `record` or `cancel`.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probes = self._probe_successes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, success: bool, latency: float):
+        with self._lock:
+            slow = latency > self.slow_call_threshold
+            if self.state == HALF_OPEN:
+                if not success or slow:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self.state = CLOSED
+                    self._calls.clear()
+                return
+
+            self._calls.append((not success, slow))
+            if len(self._calls) < self.min_calls:
+                return
+            failure_rate = sum(1 for failed, _ in self._calls if failed) / len(self._calls)
+            slow_rate = sum(1 for _, slow in self._calls if slow) / len(self._calls)
+            if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                self._open()
+
+    def cancel(self):
+        # an allowed call that ended without an outcome (e.g. a stream closed early) gives its probe back
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > self._probe_successes:
+                self._probes -= 1
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self.open_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(sum(1 for failed, _ in self._calls if failed) / calls, 3) if calls else 0.0,
+                "slow_rate": round(sum(1 for _, slow in self._calls if slow) / calls, 3) if calls else 0.0,
+                "retry_after": round(self.retry_after(), 1),
+            }
@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+import contextvars
+import time
+from contextlib import contextmanager
+
+# remaining time budget of a call in milliseconds, relative so it doesn't depend on the clocks of both agents
+DEADLINE_HEADER = "X-Agent-Timeout"
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining() -> float | None:
+    # seconds left before the deadline of the current request, None without deadline
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def budget(timeout: float | None) -> float | None:
+    # time allowed for an outbound call: `timeout`, shortened to what is left of the current deadline
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
+def parse_header(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(int(value), 0) / 1000
+    except ValueError:
+        return None
+
+
+def to_header(timeout: float) -> str:
+    return str(max(int(timeout * 1000), 0))
+
+
+@contextmanager
+def scope(timeout: float | None):
+    """
+    run the block with a deadline `timeout` seconds from now, an enclosing deadline that is earlier still applies.
+    """
+    if timeout is None:
+        yield
+        return
+    deadline = time.monotonic() + timeout
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
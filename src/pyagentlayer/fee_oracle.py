@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+import threading
+from typing import Callable
+
+from web3 import Web3
+
+from . import metrics
+from .read_cache import BlockTracker
+
+
+def argument_shape(args) -> tuple:
+    # type of each argument, with the length of the ones whose size drives the gas cost
+    shape = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            shape.append(("array", len(arg), argument_shape(arg)))
+        elif isinstance(arg, (str, bytes, bytearray)):
+            shape.append((type(arg).__name__, len(arg)))
+        else:
+            shape.append(type(arg).__name__)
+    return tuple(shape)
+
+
+class FeeOracle:
+    """
+    fee and gas fields of a transaction without asking the node for each one.
+
+    the base fee and the priority fee are read once per block (as told by the `BlockTracker`), the max fee is derived
+    from them the way web3 does (2 * base fee + priority fee). the gas limit is estimated once per (contract,
+    function, argument shape) and reused with `gas_margin` on top: the shape holds the type of each argument and the
+    length of strings, bytes and arrays, what changes the cost of a call the most.
+    """
+
+    def __init__(self, w3: Web3, tracker: BlockTracker, gas_margin: float = 1.2, enabled: bool = True):
+        self.w3 = w3
+        self.tracker = tracker
+        self.gas_margin = gas_margin
+        self.enabled = enabled
+        # (block number, fee fields)
+        self._fees = None
+        # (contract address, fn name, argument shape) -> gas limit with margin
+        self._gas = {}
+        self._lock = threading.Lock()
+
+    def fees(self) -> dict:
+        block = self.tracker.block_number()
+        fees = self._fees
+        if fees is not None and fees[0] == block:
+            metrics.record_cache("fee", True)
+            return fees[1]
+        metrics.record_cache("fee", False)
+        base_fee = self.w3.eth.get_block("latest").get("baseFeePerGas")
+        if base_fee is None:
+            # chain without EIP-1559, legacy transactions
+            fields = {"gasPrice": self.w3.eth.gas_price}
+        else:
+            priority_fee = self.w3.eth.max_priority_fee
+            fields = {"maxFeePerGas": 2 * base_fee + priority_fee, "maxPriorityFeePerGas": priority_fee}
+        self._fees = (block, fields)
+        return fields
+
+    def gas(self, contract_address: str, fn_name: str, estimate: Callable[[], int], args: tuple = ()) -> int:
+        key = (contract_address.lower(), fn_name, argument_shape(args))
+        gas = self._gas.get(key)
+        if gas is not None:
+            metrics.record_cache("gas_estimate", True)
+            return gas
+        metrics.record_cache("gas_estimate", False)
+        gas = int(estimate() * self.gas_margin)
+        with self._lock:
+            self._gas[key] = gas
+        return gas
+
+    def forget(self, contract_address: str):
+        # a failed transaction may have run out of gas, estimate the functions of the contract again
+        with self._lock:
+            for key in [key for key in self._gas if key[0] == contract_address.lower()]:
+                self._gas.pop(key, None)
+
+    def transaction_fields(self, contract_address: str, fn_name: str, estimate: Callable[[], int],
+                           args: tuple = ()) -> dict:
+        """
+        gas and fee fields for `build_transaction`, none when disabled so web3 fills them in itself.
+        """
+        if not self.enabled:
+            return {}
+        return dict(self.fees(), gas=self.gas(contract_address, fn_name, estimate, args))
+
@@ -0,0 +1,233 @@
+# -*- coding:utf-8 -*-
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Metric:
+    """
+    a metric keeps one shard of values per thread, only the owning thread writes to its shard, so the hot path
+    doesn't take any lock. shards are summed when the metric is rendered, the shards of threads that ended are then
+    merged into one and dropped, so short-lived threads don't pile up.
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # (owning thread, shard)
+        self._shards = []
+        # values of the threads that ended
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # once per thread
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire(self):
+        # with _shards_lock held: an ended thread doesn't write to its shard anymore, merge it into _retired
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _add(self._retired, shard)
+        self._shards = alive
+
+    def _merged(self) -> dict:
+        with self._shards_lock:
+            self._retire()
+            merged = {labels: list(values) for labels, values in self._retired.items()}
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _add(merged, shard)
+        return merged
+
+    def _format_labels(self, labels, extra=()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            shard[labels] = [amount]
+        else:
+            values[0] += amount
+
+    def value(self, *labels):
+        return self._merged().get(labels, [0])[0]
+
+    def samples(self):
+        return [f"{self.name}{self._format_labels(labels)} {_number(values[0])}" for labels, values in sorted(self._merged().items())]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            # one slot per bucket, then +Inf, sum
+            values = shard[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[i] += 1
+                break
+        else:
+            values[len(self.buckets)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def time_stream(self, stream, start: float, *labels):
+        """
+        observe the time from `start` (a `time.perf_counter()` value) until the sync or async iterator `stream` is
+        exhausted, fails or is closed. a generator handler only runs while its stream is iterated.
+        """
+        if hasattr(stream, "__anext__"):
+            return self._time_async_stream(stream, start, labels)
+        return self._time_stream(stream, start, labels)
+
+    def _time_stream(self, stream, start, labels):
+        try:
+            yield from stream
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    async def _time_async_stream(self, stream, start, labels):
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+            finally:
+                self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        lines = []
+        for labels, values in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    a gauge read from a callback at scrape time, e.g. a queue size.
+    with label names, the callback returns a dict of label values tuple -> value.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float | dict], labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def samples(self):
+        if not self.labelnames:
+            return [f"{self.name} {_number(self.func())}"]
+        return [f"{self.name}{self._format_labels(labels)} {_number(value)}" for labels, value in sorted(self.func().items())]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # registering the same name twice returns the existing metric
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, func, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, func, labelnames))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+def _add(merged: dict, shard: dict):
+    for labels, values in list(shard.items()):
+        if labels not in merged:
+            merged[labels] = list(values)
+        else:
+            merged[labels] = [a + b for a, b in zip(merged[labels], values)]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = MetricsRegistry()
+
+# agents hosted in one process may have routes of the same name, series are labeled with the agent id too
+request_count = REGISTRY.counter("agent_requests_total", "Requests accepted per agent and route.", ["agent", "route"])
+request_errors = REGISTRY.counter("agent_request_errors_total", "Failed requests per agent, route and status code.", ["agent", "route", "status"])
+request_latency = REGISTRY.histogram("agent_request_duration_seconds", "Total time spent serving a request.", ["agent", "route"])
+authorization_latency = REGISTRY.histogram("agent_authorization_duration_seconds", "Time spent in caller authorization.", ["agent", "route"])
+handler_latency = REGISTRY.histogram("agent_handler_duration_seconds", "Time spent in the route handler.", ["agent", "route"])
+link_call_latency = REGISTRY.histogram("agent_link_call_duration_seconds", "Latency of outbound calls per target agent.", ["agent_id"])
+link_call_errors = REGISTRY.counter("agent_link_call_errors_total", "Failed outbound calls per target agent.", ["agent_id"])
+cache_requests = REGISTRY.counter("agent_cache_requests_total", "Cache lookups per cache and result (hit/miss).", ["cache", "result"])
+
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.inc(cache, "hit" if hit else "miss")
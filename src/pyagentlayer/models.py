@@ -7,17 +7,25 @@ from eth_account import Account
 from pydantic import BaseModel
 
 
+# schema digest per model class, a class schema never changes once defined
+_schema_digests: dict[type, str] = {}
+
+
 class Model(BaseModel):
     @staticmethod
     def build_schema_digest(model: Union["Model", Type["Model"]]) -> str:
-        digest = (
-            hashlib.sha256(
-                model.schema_json(indent=None, sort_keys=True).encode("utf8")
+        model_class = model if isinstance(model, type) else type(model)
+        digest = _schema_digests.get(model_class)
+        if digest is None:
+            digest = (
+                hashlib.sha256(
+                    model_class.schema_json(indent=None, sort_keys=True).encode("utf8")
+                )
+                .digest()
+                .hex()
             )
-            .digest()
-            .hex()
-        )
-        return f"model:{digest}"
+            digest = _schema_digests[model_class] = f"model:{digest}"
+        return digest
 
 
 class ErrorMessage(Model):
@@ -81,7 +89,8 @@ class Context:
                  wallet_eoa: Account,
                  wallet_aa: str,
                  agent_metadata: AgentMetadata,
-                 caller_metadata: AgentMetadata | None = None
+                 caller_metadata: AgentMetadata | None = None,
+                 task_id: str | None = None
                  ):
         # agent eoa wallet
         self.wallet_eoa = wallet_eoa
@@ -90,6 +99,8 @@ class Context:
 
         self.agent_metadata = agent_metadata
         self.caller_metadata = caller_metadata
+        # id of the request, sent as parent task id by the calls the handler makes
+        self.task_id = task_id
 
 
 class SubscriptionPeriodEnum(Enum):
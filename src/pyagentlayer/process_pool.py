@@ -0,0 +1,173 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from pydantic import BaseModel
+
+from .metrics import REGISTRY
+
+# str / bytes fields at least this large are passed to the worker through shared memory instead of being pickled
+SHARED_MEMORY_MIN_SIZE = 64 * 1024
+
+_pools = weakref.WeakSet()
+REGISTRY.gauge("agent_process_pool_queue_depth", "Handler calls submitted to a process pool and not finished, per pool.",
+               lambda: {(pool.name,): pool.queue_depth for pool in list(_pools)}, ["pool"])
+REGISTRY.gauge("agent_process_pool_workers", "Worker processes per pool.",
+               lambda: {(pool.name,): pool.max_workers for pool in list(_pools)}, ["pool"])
+
+
+class _SharedPayload:
+    # a field value left in a shared memory block
+    def __init__(self, name: str, size: int, text: bool, view: bool = False):
+        self.name = name
+        self.size = size
+        self.text = text
+        # handed to the handler as a read-only memoryview over the block
+        self.view = view
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(name=name)
+    # the block belongs to the parent, which unlinks it, the worker's tracker must not clean it up too
+    try:
+        resource_tracker.unregister(block._name, "shared_memory")
+    except Exception:
+        pass
+    return block
+
+
+def _load(value, attached: list):
+    if not isinstance(value, _SharedPayload):
+        return value
+    block = _attach(value.name)
+    if value.view:
+        view = block.buf[:value.size].toreadonly()
+        attached.append((block, view))
+        return view
+    try:
+        # a single copy out of the block: decoded from it, or copied once for bytes
+        with block.buf[:value.size] as data:
+            return str(data, "utf-8") if value.text else bytes(data)
+    finally:
+        block.close()
+
+
+def _detach(attached: list):
+    for block, view in attached:
+        try:
+            view.release()
+            block.close()
+        except BufferError:
+            # the handler kept a view of the block, the mapping is closed once that is collected
+            logging.debug(f"shared memory block {block.name} still used after the handler returned")
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _run(func, ctx, model_type, fields: dict):
+    # runs in the worker: the model was validated by the parent, it is only rebuilt
+    attached = []
+    try:
+        parameter = model_type.model_construct(**{key: _load(value, attached) for key, value in fields.items()})
+        if inspect.iscoroutinefunction(func):
+            return asyncio.run(func(ctx, parameter))
+        return func(ctx, parameter)
+    finally:
+        _detach(attached)
+
+
+class ProcessPool:
+    """
+    warm pool of `max_workers` processes running the handlers of a route, for cpu bound work that would hold the GIL.
+
+    the request model is sent to the worker field by field, large str / bytes fields through shared memory: str fields
+    are decoded from the block, bytes fields copied out of it, or with `shared_buffers` handed to the handler as
+    read-only memoryviews over the block, valid until it returns. the handler must be importable by the worker (a
+    module level function), and return a Model or a dict; its context and result are pickled.
+    """
+
+    def __init__(self, name: str, max_workers: int | None = None, shared_buffers: bool = False):
+        self.name = name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.shared_buffers = shared_buffers
+        self.queue_depth = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        _pools.add(self)
+
+    def start(self) -> "ProcessPool":
+        """
+        start the worker processes now rather than on the first calls, best before the server starts its threads.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                # a task per worker makes the executor spawn them all
+                pids = {future.result() for future in [self._executor.submit(_warm_up) for _ in range(self.max_workers)]}
+                logging.debug(f"process pool {self.name} started with workers {sorted(pids)}")
+        return self
+
+    def submit(self, func, ctx, parameter: BaseModel) -> Future:
+        self.start()
+        blocks = []
+        fields = {}
+        for key, value in parameter.__dict__.items():
+            if isinstance(value, (str, bytes)) and len(value) >= SHARED_MEMORY_MIN_SIZE:
+                data = value.encode("utf-8") if isinstance(value, str) else value
+                block = shared_memory.SharedMemory(create=True, size=len(data))
+                block.buf[:len(data)] = data
+                blocks.append(block)
+                text = isinstance(value, str)
+                value = _SharedPayload(block.name, len(data), text, view=self.shared_buffers and not text)
+            fields[key] = value
+
+        with self._lock:
+            self.queue_depth += 1
+        try:
+            future = self._executor.submit(_run, func, ctx, type(parameter), fields)
+        except Exception:
+            self._done(blocks)
+            raise
+        future.add_done_callback(lambda _: self._done(blocks))
+        return future
+
+    def call(self, func, ctx, parameter: BaseModel, timeout: float | None = None):
+        """
+        run the handler in a worker and wait at most `timeout` seconds for its result. a call cut off before it was
+        handed to a worker is cancelled; one already handed over can't be stopped, it runs to its end in its worker
+        (and is counted in the queue depth until then) while its result is dropped.
+        """
+        future = self.submit(func, ctx, parameter)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    async def call_async(self, func, ctx, parameter: BaseModel, timeout: float | None = None):
+        # cancelling the wrapping future cancels a call not handed to a worker yet, see `call`
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(func, ctx, parameter)), timeout)
+
+    def _done(self, blocks: list):
+        with self._lock:
+            self.queue_depth -= 1
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    def stats(self) -> dict:
+        return {"name": self.name, "workers": self.max_workers, "queue_depth": self.queue_depth}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
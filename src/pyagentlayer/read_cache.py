@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from web3 import Web3
+
+from . import metrics
+
+
+class CachePolicy:
+    """
+    how the result of one view function is cached.
+
+    results are kept for the block they were read at. with `stale_while_revalidate` seconds set, a result read at an
+    older block is still returned for that long while it is refreshed in the background, for values that rarely change
+    (e.g. subscription prices) and where one stale answer is acceptable.
+    """
+
+    def __init__(self, enabled: bool = True, stale_while_revalidate: float = 0):
+        self.enabled = enabled
+        self.stale_while_revalidate = stale_while_revalidate
+
+
+class BlockTracker:
+    """
+    latest block number of a node, read at most once every `ttl` seconds whoever asks for it.
+    """
+
+    def __init__(self, w3: Web3, ttl: float = 1.0):
+        self.w3 = w3
+        self.ttl = ttl
+        self._block = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def block_number(self) -> int:
+        if self._block is None or time.monotonic() - self._fetched_at >= self.ttl:
+            with self._lock:
+                # another thread may have refreshed it while we were waiting for the lock
+                if self._block is None or time.monotonic() - self._fetched_at >= self.ttl:
+                    self.observe(self.w3.eth.block_number)
+        return self._block
+
+    def observe(self, block_number: int):
+        # blocks seen elsewhere (e.g. in a receipt) move the tracker forward without a round trip, never backward
+        if self._block is None or block_number >= self._block:
+            self._block = block_number
+            self._fetched_at = time.monotonic()
+
+
+class ReadCache:
+    """
+    results of contract view calls keyed by (contract, function, args) and the block they were read at.
+    a call is only answered from the cache for the latest block, so a new block invalidates every entry
+    except those allowed to be served stale.
+    """
+
+    def __init__(self, tracker: BlockTracker, policies: dict[str, CachePolicy] | None = None, enabled: bool = True):
+        self.tracker = tracker
+        self.policies = dict(policies or {})
+        self.enabled = enabled
+        # (address, fn_name, args) -> (block number, value, stored at)
+        self._entries = {}
+        self._refreshing = set()
+        self._block = None
+        self._lock = threading.Lock()
+
+    def configure(self, fn_name: str, policy: CachePolicy | None):
+        if policy is None:
+            self.policies.pop(fn_name, None)
+        else:
+            self.policies[fn_name] = policy
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def call(self, address: str, fn_name: str, args: tuple, load: Callable[[Any], Any]):
+        """
+        return the cached result of `fn_name(*args)` on `address`, calling `load(block_identifier)` on a miss.
+        """
+        policy = self.policies.get(fn_name)
+        if not self.enabled or policy is None or not policy.enabled:
+            return load("latest")
+
+        block = self.tracker.block_number()
+        if block != self._block:
+            self._evict(block)
+        key = (address, fn_name, args)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry_block, value, stored_at = entry
+            if entry_block == block:
+                metrics.record_cache("chain_read", True)
+                return value
+            if policy.stale_while_revalidate and time.monotonic() - stored_at < policy.stale_while_revalidate:
+                metrics.record_cache("chain_read", True)
+                self._revalidate(key, block, load)
+                return value
+
+        metrics.record_cache("chain_read", False)
+        value = load(block)
+        self._entries[key] = (block, value, time.monotonic())
+        return value
+
+    def _evict(self, block: int):
+        # drop entries of older blocks that can't be served stale, keeps the cache bounded by the working set
+        with self._lock:
+            self._block = block
+            for key, (entry_block, _, _) in list(self._entries.items()):
+                policy = self.policies.get(key[1])
+                if entry_block != block and not (policy and policy.stale_while_revalidate):
+                    self._entries.pop(key, None)
+
+    def _revalidate(self, key, block: int, load: Callable[[Any], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._entries[key] = (block, load(block), time.monotonic())
+            except Exception as e:
+                logging.warning(f"refresh cached {key[1]}{key[2]} failed with error message {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -1,6 +1,10 @@
 # -*- coding:utf-8 -*-
+import copy
+import json
 import logging
 import os
+import sqlite3
+import threading
 from abc import ABC, abstractmethod
 
 import dotenv
@@ -59,6 +63,17 @@ class OnChainAgentRegistryClient(AbstractRegistryClient):
         logging.info(f"mint agent id success: {agent_id}")
         return agent_id
 
+    def export_snapshot(self, agent_ids) -> dict:
+        # snapshot of the given agents, to preload an in-memory or sqlite registry
+        agents = []
+        for agent_id in agent_ids:
+            agents.append({
+                "agent_id": int(agent_id),
+                "owner": self.agent_nft.owner_of(agent_id),
+                "metadata": self.get_agent_meta(agent_id).to_json()
+            })
+        return {"agents": agents}
+
     def get_agent_meta(self, agent_id) -> AgentMetadata:
         ipfs_cid = self.agent_nft.token_uri(int(agent_id))
         logging.debug(f"get token uri success, {ipfs_cid}")
@@ -68,3 +83,119 @@ class OnChainAgentRegistryClient(AbstractRegistryClient):
         logging.debug(f"get agent metadata success: {agent_metadata_dict}")
 
         return self.metadata
+
+
+class LocalRegistryClient(AbstractRegistryClient, ABC):
+    """
+    registry kept off-chain for dev clusters and tests, preloaded from a snapshot such as the one returned by
+    `OnChainAgentRegistryClient.export_snapshot` (`{"agents": [{"agent_id", "owner", "metadata"}]}`).
+
+    agents sharing one registry each act through their own `for_wallet` view, ownership and registration are then
+    checked against the wallet of that agent.
+    """
+    wallet_address: str | None
+
+    def __init__(self, wallet_address: str = None, snapshot: dict | str | None = None):
+        self.wallet_address = wallet_address
+        if snapshot is not None:
+            self.load_snapshot(snapshot)
+
+    def load_snapshot(self, snapshot: dict | str):
+        if isinstance(snapshot, str):
+            with open(snapshot, "r") as f:
+                snapshot = json.load(f)
+        for agent in snapshot.get("agents", []):
+            self._put(int(agent["agent_id"]), agent["owner"], agent["metadata"])
+
+    def for_wallet(self, wallet_address: str) -> "LocalRegistryClient":
+        # a client over the same store acting for `wallet_address`
+        view = copy.copy(self)
+        view.wallet_address = wallet_address
+        return view
+
+    @abstractmethod
+    def _put(self, agent_id: int, owner: str, metadata: dict):
+        pass
+
+    @abstractmethod
+    def _get(self, agent_id: int) -> tuple[str, dict] | None:
+        pass
+
+    @abstractmethod
+    def _next_agent_id(self) -> int:
+        pass
+
+    def is_owner(self, agent_id):
+        agent = self._get(int(agent_id))
+        return agent is not None and self.wallet_address is not None and agent[0].lower() == self.wallet_address.lower()
+
+    def register(self, metadata: AgentMetadata):
+        agent_id = self._next_agent_id()
+        self._put(agent_id, self.wallet_address, dict(metadata.to_json()))
+        logging.info(f"register agent in local registry success: {agent_id}")
+        return agent_id
+
+    def get_agent_meta(self, agent_id) -> AgentMetadata:
+        agent = self._get(int(agent_id))
+        if agent is None:
+            raise ValueError(f"agent {agent_id} not found in local registry")
+        if agent[1] is None:
+            # id reserved by a registration still in progress
+            raise ValueError(f"agent {agent_id} is not registered yet in local registry")
+        return AgentMetadata.from_json(dict(agent[1]))
+
+
+class InMemoryRegistryClient(LocalRegistryClient):
+    def __init__(self, wallet_address: str = None, snapshot: dict | str | None = None):
+        self._agents = {}
+        self._lock = threading.Lock()
+        super().__init__(wallet_address=wallet_address, snapshot=snapshot)
+
+    def _put(self, agent_id, owner, metadata):
+        self._agents[agent_id] = (owner, metadata)
+
+    def _get(self, agent_id):
+        return self._agents.get(agent_id)
+
+    def _next_agent_id(self):
+        with self._lock:
+            agent_id = max(self._agents, default=0) + 1
+            # reserve the id until register stores the metadata
+            self._agents[agent_id] = (self.wallet_address, None)
+            return agent_id
+
+    def export_snapshot(self) -> dict:
+        return {"agents": [{"agent_id": agent_id, "owner": owner, "metadata": metadata}
+                           for agent_id, (owner, metadata) in sorted(self._agents.items()) if metadata is not None]}
+
+
+class SQLiteRegistryClient(LocalRegistryClient):
+    def __init__(self, path: str = ":memory:", wallet_address: str = None, snapshot: dict | str | None = None):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS agents (agent_id INTEGER PRIMARY KEY, owner TEXT, metadata TEXT)")
+        super().__init__(wallet_address=wallet_address, snapshot=snapshot)
+
+    def _put(self, agent_id, owner, metadata):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO agents (agent_id, owner, metadata) VALUES (?, ?, ?)",
+                               (agent_id, owner, json.dumps(metadata)))
+
+    def _get(self, agent_id):
+        with self._lock:
+            row = self._conn.execute("SELECT owner, metadata FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _next_agent_id(self):
+        with self._lock:
+            # an empty row reserves the id until register stores the metadata
+            cursor = self._conn.execute("INSERT INTO agents (owner, metadata) VALUES (?, 'null')", (self.wallet_address,))
+            return cursor.lastrowid
+
+    def export_snapshot(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT agent_id, owner, metadata FROM agents WHERE metadata != 'null' ORDER BY agent_id").fetchall()
+        return {"agents": [{"agent_id": agent_id, "owner": owner, "metadata": json.loads(metadata)} for agent_id, owner, metadata in rows]}
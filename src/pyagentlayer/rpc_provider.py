@@ -0,0 +1,271 @@
+# -*- coding:utf-8 -*-
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any
+
+from web3 import HTTPProvider
+from web3._utils.request import make_post_request
+from web3.providers.base import BaseProvider, JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+# methods that must see the state written by our own transactions, always sent to the pinned endpoint
+PINNED_METHODS = {
+    "eth_sendRawTransaction",
+    "eth_sendTransaction",
+    "eth_getTransactionCount",
+    "eth_getTransactionReceipt",
+    "eth_getTransactionByHash",
+}
+# position of the block parameter of reads, a read at a block number can only be answered by nodes which have it
+BLOCK_PARAMS = {
+    "eth_call": 1,
+    "eth_estimateGas": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getStorageAt": 2,
+    "eth_getBlockByNumber": 0,
+}
+# error codes of a request the node handled fine: reverted execution, malformed request or parameters
+CALL_ERROR_CODES = {3, -32600, -32602}
+
+
+def _block_number(value) -> int | None:
+    # block tags (latest, pending, safe...) and block hashes don't pin a number
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.startswith("0x") and len(value) <= 18:
+        return int(value, 16)
+    return None
+
+
+def required_block(method: str, params: Any) -> int | None:
+    """
+    block number a read is pinned at, None for reads of the latest state.
+    """
+    if method == "eth_getLogs" and params and isinstance(params[0], dict):
+        blocks = [_block_number(params[0].get(key)) for key in ("fromBlock", "toBlock")]
+        blocks = [block for block in blocks if block is not None]
+        return max(blocks) if blocks else None
+    position = BLOCK_PARAMS.get(method)
+    if position is None or not isinstance(params, (list, tuple)) or len(params) <= position:
+        return None
+    return _block_number(params[position])
+
+
+def is_endpoint_error(response: RPCResponse) -> bool:
+    """
+    whether the error of a response comes from the node (rate limited, internal error, missing state...) rather than
+    from the request, such errors count against the health of the endpoint.
+    """
+    error = response.get("error") if isinstance(response, dict) else None
+    if error is None:
+        return False
+    if not isinstance(error, dict):
+        return True
+    message = str(error.get("message", "")).lower()
+    return error.get("code") not in CALL_ERROR_CODES and "revert" not in message
+
+
+class RPCEndpointState:
+    def __init__(self, url: str, request_kwargs: dict | None = None):
+        self.url = url
+        self.provider = HTTPProvider(url, request_kwargs=request_kwargs)
+        # exponentially weighted moving average of the latency in seconds
+        self.latency = None
+        self.healthy = True
+        self.failures = 0
+        # highest block the endpoint is known to have
+        self.block = None
+
+    def observe_block(self, block: int | None):
+        if block is not None and (self.block is None or block > self.block):
+            self.block = block
+
+    def has_block(self, block: int | None) -> bool:
+        return block is None or (self.block is not None and self.block >= block)
+
+    def record(self, latency: float, alpha: float):
+        self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+        self.failures = 0
+        self.healthy = True
+
+    def record_failure(self, max_failures: int):
+        self.failures += 1
+        if self.failures >= max_failures:
+            self.healthy = False
+
+    def score(self) -> float:
+        # endpoints never measured are tried before slow ones
+        return 0.0 if self.latency is None else self.latency
+
+
+class BalancedHTTPProvider(JSONBaseProvider):
+    """
+    web3 provider over several rpc endpoints.
+
+    reads go to the healthy endpoint with the lowest latency (EWMA of probes and real requests), and are hedged to the
+    next best endpoint when no answer arrives within `hedge_after` seconds (or twice the expected latency).
+    transactions, nonces and receipts stay on one pinned endpoint so they see a consistent state.
+
+    json-rpc errors of the node (rate limits such as -32005, internal errors) count as failures like transport errors,
+    reverts don't. reads at a block number only go to endpoints known to have that block (as seen by probes and
+    answers), to the most advanced endpoint when none is known to have it yet.
+    """
+
+    def __init__(self, endpoints: list[str], hedge_after: float = 0.5, probe_interval: float = 15, ewma_alpha: float = 0.3,
+                 max_failures: int = 2, request_kwargs: dict | None = None):
+        super().__init__()
+        if not endpoints:
+            raise ValueError("at least one rpc endpoint is required")
+        self.endpoints = [RPCEndpointState(url, request_kwargs) for url in endpoints]
+        self.hedge_after = hedge_after
+        self.ewma_alpha = ewma_alpha
+        self.max_failures = max_failures
+        self._pinned = self.endpoints[0]
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.endpoints)), thread_name_prefix="rpc")
+        self._lock = threading.Lock()
+        if probe_interval and len(self.endpoints) > 1:
+            threading.Thread(target=self._probe_forever, args=(probe_interval,), daemon=True).start()
+
+    def __str__(self):
+        return f"RPC balancer over {', '.join(e.url for e in self.endpoints)}"
+
+    def _ranked(self, block: int | None = None) -> list[RPCEndpointState]:
+        healthy = [e for e in self.endpoints if e.healthy] or self.endpoints
+        synced = [e for e in healthy if e.has_block(block)]
+        if not synced:
+            # the pinned endpoint first on a tie, our own transactions were mined there
+            synced = [max(healthy, key=lambda e: (-1 if e.block is None else e.block, e is self._pinned))]
+        return sorted(synced, key=RPCEndpointState.score)
+
+    def _pinned_endpoint(self) -> RPCEndpointState:
+        with self._lock:
+            if not self._pinned.healthy:
+                # move the pin only when the pinned node fails, nonce reads and sends then follow together
+                self._pinned = self._ranked()[0]
+                logging.warning(f"pinned rpc endpoint moved to {self._pinned.url}")
+            return self._pinned
+
+    def _request(self, endpoint: RPCEndpointState, method: RPCEndpoint, params: Any) -> RPCResponse:
+        start = time.perf_counter()
+        try:
+            response = endpoint.provider.make_request(method, params)
+        except Exception:
+            endpoint.record_failure(self.max_failures)
+            raise
+        if is_endpoint_error(response):
+            endpoint.record_failure(self.max_failures)
+            logging.warning(f"rpc endpoint {endpoint.url} answered {method} with error {response['error']}")
+            return response
+        endpoint.record(time.perf_counter() - start, self.ewma_alpha)
+        result = response.get("result")
+        if method == "eth_blockNumber":
+            endpoint.observe_block(_block_number(result))
+        elif method == "eth_getTransactionReceipt" and isinstance(result, dict):
+            endpoint.observe_block(_block_number(result.get("blockNumber")))
+        else:
+            # a node answering a read at a block has it
+            endpoint.observe_block(required_block(method, params))
+        return response
+
+    @staticmethod
+    def _failed(future) -> bool:
+        return future.exception() is not None or is_endpoint_error(future.result())
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if method in PINNED_METHODS:
+            return self._request(self._pinned_endpoint(), method, params)
+
+        ranked = self._ranked(required_block(method, params))
+        if len(ranked) == 1:
+            return self._request(ranked[0], method, params)
+
+        best, backup = ranked[0], ranked[1]
+        hedge_after = self.hedge_after if best.latency is None else min(self.hedge_after, 2 * best.latency)
+        futures = [self._pool.submit(self._request, best, method, params)]
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done or self._failed(futures[0]):
+            # too slow or failed, race the next best endpoint
+            futures.append(self._pool.submit(self._request, backup, method, params))
+
+        failed = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not self._failed(future):
+                    return future.result()
+                failed = future
+        # both failed, an error answer is returned to web3 as is
+        return failed.result()
+
+    def make_batch_request(self, calls: list[tuple[str, Any]], timeout: float | None = None) -> list[RPCResponse]:
+        # batches are read-only calls, sent to the best endpoint and to the next one when it fails
+        blocks = [block for block in (required_block(method, params) for method, params in calls) if block is not None]
+        error, failed = None, None
+        for endpoint in self._ranked(max(blocks) if blocks else None):
+            start = time.perf_counter()
+            try:
+                responses = _post_batch(endpoint.provider, calls, timeout)
+            except Exception as e:
+                endpoint.record_failure(self.max_failures)
+                logging.warning(f"rpc batch request to {endpoint.url} failed with error message {e}")
+                error = e
+                continue
+            if any(is_endpoint_error(response) for response in responses):
+                endpoint.record_failure(self.max_failures)
+                logging.warning(f"rpc endpoint {endpoint.url} answered a batch with errors")
+                failed = responses
+                continue
+            endpoint.record(time.perf_counter() - start, self.ewma_alpha)
+            if blocks:
+                endpoint.observe_block(max(blocks))
+            return responses
+        if failed is not None:
+            return failed
+        raise error
+
+    def _probe_forever(self, interval: float):
+        while True:
+            for endpoint in self.endpoints:
+                try:
+                    self._request(endpoint, RPCEndpoint("eth_blockNumber"), [])
+                except Exception as e:
+                    logging.debug(f"probe rpc endpoint {endpoint.url} failed with error message {e}")
+            time.sleep(interval)
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return any(e.provider.is_connected(show_traceback) for e in self.endpoints)
+
+    def stats(self) -> list[dict]:
+        return [{"url": e.url, "healthy": e.healthy, "latency_ms": None if e.latency is None else round(e.latency * 1000, 2),
+                 "block": e.block, "pinned": e is self._pinned} for e in self.endpoints]
+
+
+def batch_request(provider: BaseProvider, calls: list[tuple[str, Any]], timeout: float | None = None) -> list[RPCResponse]:
+    """
+    send (method, params) calls as one JSON-RPC batch through `provider`, return the responses in the order of the calls.
+    """
+    if isinstance(provider, BalancedHTTPProvider):
+        return provider.make_batch_request(calls, timeout)
+    if not isinstance(provider, HTTPProvider):
+        # providers without batch support answer one call at a time
+        return [provider.make_request(RPCEndpoint(method), params) for method, params in calls]
+    return _post_batch(provider, calls, timeout)
+
+
+def _post_batch(provider: HTTPProvider, calls: list[tuple[str, Any]], timeout: float | None) -> list[RPCResponse]:
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+    request_kwargs = provider.get_request_kwargs()
+    if timeout is not None:
+        request_kwargs["timeout"] = timeout
+    # the session and the default timeout of web3's own requests
+    response = json.loads(make_post_request(provider.endpoint_uri, json.dumps(payload).encode("utf-8"), **request_kwargs))
+    if isinstance(response, dict):
+        # a node refusing the whole batch (too large, rate limited...) answers with a single error
+        raise ValueError(f"rpc batch request failed: {response.get('error', response)}")
+    by_id = {item.get("id"): item for item in response if isinstance(item, dict)}
+    return [by_id.get(i, {"error": {"code": -32603, "message": "missing from the batch response"}}) for i in range(len(calls))]
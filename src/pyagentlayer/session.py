@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import hmac
+import os
+import time
+
+from . import metrics
+
+# session token of the caller, sent instead of proving the subscription again on every call
+SESSION_HEADER = "X-Agent-Session"
+# response header of payable agents, the route handing out session tokens
+SESSION_ROUTE_HEADER = "X-Agent-Session-Route"
+SESSION_ROUTE = "_session"
+
+# seconds a session token is valid at most, it never outlives the caller's subscription
+session_ttl = int(os.environ.get("AGENT_SESSION_TTL", 900))
+# key signing the tokens, set the same value on every process serving one agent so they accept each other's tokens
+session_secret = os.environ.get("AGENT_SESSION_SECRET")
+
+
+class SessionTokens:
+    """
+    issue and verify session tokens "<wallet>.<expiry>.<hmac>" once a caller proved its signature and subscription.
+    the hmac also covers the audience, the agent issuing the token, so agents sharing a secret don't accept each
+    other's tokens.
+
+    verifying a token is one hmac and a constant time comparison, instead of the subscription reads and the signature
+    recovery of a full authorization.
+    """
+
+    def __init__(self, secret: bytes | str | None = None, ttl: int | None = None):
+        secret = session_secret if secret is None else secret
+        if secret is None:
+            # tokens are then only valid for this process
+            secret = os.urandom(32)
+        self.secret = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self.ttl = session_ttl if ttl is None else ttl
+
+    def _sign(self, audience: str, wallet: str, expires_at: int) -> str:
+        payload = f"{audience.lower()}.{wallet}.{expires_at}"
+        return hmac.new(self.secret, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def issue(self, audience: str, wallet: str, subscription_expires_at: int | None = None) -> (str, int):
+        expires_at = int(time.time()) + self.ttl
+        if subscription_expires_at is not None:
+            expires_at = min(expires_at, int(subscription_expires_at))
+        wallet = wallet.lower()
+        return f"{wallet}.{expires_at}.{self._sign(audience, wallet, expires_at)}", expires_at
+
+    def verify(self, audience: str, token: str | None) -> str | None:
+        # wallet the token was issued to by `audience`, None when the token is invalid, expired or issued by another agent
+        if not token:
+            return None
+        try:
+            wallet, expires_at, signature = token.split(".")
+            expires_at = int(expires_at)
+        except ValueError:
+            return None
+        valid = expires_at > time.time() and hmac.compare_digest(signature, self._sign(audience, wallet, expires_at))
+        metrics.record_cache("session", valid)
+        return wallet if valid else None
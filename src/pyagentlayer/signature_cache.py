@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from eth_account import Account
+
+from . import metrics
+
+
+def is_valid_signature(address: str, message, signature) -> bool:
+    try:
+        return Account._recover_hash(message_hash=message, signature=signature).lower() == address.lower()
+    except Exception as e:
+        logging.warning(f"check signature error with message {str(e)}\taddress:{address}\tmessage:{message}\tsignature:{signature}")
+    return False
+
+
+class SignatureCache:
+    """
+    bounded LRU of signature verification results keyed by (address, message hash, signature).
+
+    the result doesn't depend on the verifying agent, so agents served by one AgentHost share a single cache and a caller
+    is verified once for all of them.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, address: str, message_hash: str, signature: str) -> bool | None:
+        # result of an earlier verification, None when the signature wasn't verified yet
+        with self._lock:
+            return self._entries.get((address.lower(), message_hash, signature))
+
+    def verify(self, address: str, message_hash: str, signature: str, verifier: Callable[..., bool] = is_valid_signature) -> bool:
+        key = (address.lower(), message_hash, signature)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                metrics.record_cache("signature", True)
+                return self._entries[key]
+        metrics.record_cache("signature", False)
+        valid = verifier(address, message=message_hash, signature=signature)
+        with self._lock:
+            self._entries[key] = valid
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return valid
@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+import abc
+import atexit
+import collections
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# W3C trace context header, see https://www.w3.org/TR/trace-context/
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    name: str
+    start_time: float
+    end_time: float | None
+    attributes: dict
+    status: str
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None = None, attributes: dict | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.end_time = None
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        self.end_time = self.start_time + self.duration_ms / 1000
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_json(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def export(self, span: Span):
+        pass
+
+
+class NoopSpanExporter(SpanExporter):
+    def export(self, span: Span):
+        pass
+
+
+class JsonLinesFileExporter(SpanExporter):
+    """
+    append finished spans to a file, one json object per line.
+
+    spans are buffered and written by a background thread every `flush_interval` seconds, so a request only appends
+    to the buffer. spans beyond `max_buffered` are dropped (and counted) while the file can't keep up.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_buffered: int = 10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._buffer = collections.deque()
+        # one writer at a time, the background thread or an explicit flush
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        if len(self._buffer) >= self.max_buffered:
+            self.dropped += 1
+            return
+        self._buffer.append(span)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"write spans to {self.path} failed with error message {e}")
+
+    def flush(self):
+        with self._lock:
+            lines = []
+            while self._buffer:
+                lines.append(json.dumps(self._buffer.popleft().to_json(), default=str) + "\n")
+            if lines:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+
+
+_exporter: SpanExporter = JsonLinesFileExporter(os.environ["AGENT_TRACE_FILE"]) if os.environ.get("AGENT_TRACE_FILE") else NoopSpanExporter()
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+def set_exporter(exporter: SpanExporter):
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    # return (trace_id, parent span id), None for a missing or malformed header
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match or match.group(1) == "ff" or match.group(2) == "0" * 32 or match.group(3) == "0" * 16:
+        return None
+    return match.group(2), match.group(3)
+
+
+@contextmanager
+def start_span(name: str, traceparent: str | None = None, **attributes):
+    """
+    start a span as child of the current span, or of the remote parent in `traceparent` when given.
+    """
+    remote_parent = parse_traceparent(traceparent)
+    parent = current_span()
+    if remote_parent:
+        trace_id, parent_id = remote_parent
+    elif parent:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+
+    span = Span(name, trace_id, parent_id, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.status = "error"
+        span.set_attribute("error", str(e))
+        raise
+    finally:
+        span.end()
+        _current_span.reset(token)
+        try:
+            _exporter.export(span)
+        except Exception as e:
+            logging.warning(f"export span failed with error message {e}")
+
+
+def inject_headers(headers: dict) -> dict:
+    span = current_span()
+    if span:
+        headers[TRACEPARENT_HEADER] = span.traceparent()
+    return headers
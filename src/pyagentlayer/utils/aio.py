@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from typing import AsyncIterator, Iterator
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """
+    event loop running in a daemon thread, started once per process. async handlers served by the wsgi app run on it.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agent-event-loop", daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro, timeout: float | None = None):
+    """
+    run `coro` on the background loop and wait for its result from the calling (non event loop) thread.
+    the coroutine sees the caller's context, e.g. the current trace span and deadline.
+    """
+    loop = background_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+    tasks = []
+
+    def start():
+        # tasks copy the context current when they are created
+        task = context.run(loop.create_task, coro)
+        task.add_done_callback(lambda t: _copy_result(t, future))
+        tasks.append(task)
+
+    loop.call_soon_threadsafe(start)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        loop.call_soon_threadsafe(lambda: [task.cancel() for task in tasks])
+        raise
+
+
+def _copy_result(task: asyncio.Task, future: concurrent.futures.Future):
+    if future.cancelled():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def iterate(chunks: AsyncIterator) -> Iterator:
+    """
+    iterate an async generator from a (non event loop) thread, one chunk at a time on the background loop.
+    """
+    try:
+        while True:
+            try:
+                yield run_coroutine(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        if hasattr(chunks, "aclose"):
+            run_coroutine(chunks.aclose())
+
+
+async def run_in_executor(executor: concurrent.futures.Executor | None, func, *args):
+    # blocking call off the event loop, keeping the current context (trace span, deadline) in the worker thread
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
@@ -1,39 +1,55 @@
 # -*- coding:utf-8 -*-
-import json
 from abc import ABC
 
 import requests
 from requests.exceptions import HTTPError, ReadTimeout
 
+from .exceptions import AgentCallException
+from .sse import iter_events, EVENT_DONE, EVENT_ERROR, EVENT_MESSAGE
+
 
 class BaseRequestClient(ABC):
-    def __init__(self) -> None:
+    def __init__(self, session: requests.Session | None = None) -> None:
         super().__init__()
+        # pooled connections, may be shared between clients (see AgentHost)
+        self.session = session
+
+    def send(self, url, headers, payload, timeout=None):
+        return self.request(url, headers, payload, timeout=timeout).text
 
-    def send(self, url, headers, payload):
-        response = self.make_request(url, headers, payload)
+    def request(self, url, headers, payload, timeout=None, data: bytes | None = None) -> requests.Response:
+        # `data` is a body already encoded (see utils.codec), sent instead of `payload` as json
+        response = self.make_request(url, headers, payload, timeout=timeout, data=data)
         if response.ok:
-            return response.text
+            return response
         else:
-            raise ValueError(f"call agent failed with message:{response.text} status: {response.status_code}")
-
-    def send_async(self, url, headers, payload):
-        response = self.make_request(url, headers, payload, True)
+            raise AgentCallException(f"call agent failed with message:{response.text} status: {response.status_code}", response.status_code)
+
+    def send_async(self, url, headers, payload, response_type=None, timeout=None, data: bytes | None = None):
+        """
+        read a server-sent event stream, yield each event decoded into `response_type` when given, else its raw data.
+        `timeout` bounds the connection and each wait for data, the stream itself may last longer.
+        """
+        headers = {**headers, "Accept": "text/event-stream"}
+        response = self.make_request(url, headers, payload, True, timeout=timeout, data=data)
         if response.status_code != 200:
-            raise Exception('There is a internet request problem. Please try again later.')
-
-        def get_streaming_answer(data_str):
-            try:
-                data = json.loads(data_str.replace('data: ', '').strip())
-                return data.get('answer', '')
-            except Exception as e:
-                return ''
-
-        for chunk in response.iter_lines(decode_unicode=True):
-            yield chunk
-
-    def make_request(self, url, headers, payload, stream=False):
+            raise AgentCallException('There is a internet request problem. Please try again later.', response.status_code)
+
+        with response:
+            # chunk_size=None hands over data as soon as it arrives instead of waiting for a full buffer
+            for event in iter_events(response.iter_lines(chunk_size=None, decode_unicode=True)):
+                if event.event == EVENT_DONE:
+                    return
+                if event.event == EVENT_ERROR:
+                    raise ValueError(f"call agent failed with message:{event.data}")
+                if event.event != EVENT_MESSAGE:
+                    continue
+                yield response_type.model_validate_json(event.data) if response_type else event.data
+
+    def make_request(self, url, headers, payload, stream=False, timeout=None, data: bytes | None = None):
         try:
-            return requests.post(url, headers=headers, json=payload, stream=stream)
-        except (HTTPError, ReadTimeout):
-            raise Exception('There is a internet request problem. Please try again later.')
+            return (self.session or requests).post(url, headers=headers, json=payload if data is None else None, data=data,
+                                                   stream=stream, timeout=timeout)
+        except (HTTPError, ReadTimeout) as e:
+            # no answer from the agent, no status code
+            raise AgentCallException('There is a internet request problem. Please try again later.') from e
@@ -0,0 +1,144 @@
+# -*- coding:utf-8 -*-
+"""
+cid of a file as `ipfs add` computes it with its defaults, without a node: 256 KiB chunks in a balanced UnixFS dag of at
+most 174 links per node. v0 wraps chunks in dag-pb nodes (Qm...), v1 keeps them as raw blocks (bafk... / bafy...).
+"""
+import base64
+import hashlib
+from typing import Iterable
+
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+
+# multicodec codes
+_DAG_PB = 0x70
+_RAW = 0x55
+_SHA2_256 = 0x12
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+# UnixFS Data.Type
+_FILE = 2
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number: int, value: bytes) -> bytes:
+    # length-delimited protobuf field
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _uint_field(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _multihash(block: bytes) -> bytes:
+    return bytes([_SHA2_256, 32]) + hashlib.sha256(block).digest()
+
+
+def _base58(data: bytes) -> str:
+    n = int.from_bytes(data, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 58)
+        out = _BASE58_ALPHABET[rem] + out
+    return "1" * (len(data) - len(data.lstrip(b"\0"))) + out
+
+
+def _unixfs_file(data: bytes | None, filesize: int, blocksizes: list[int] = ()) -> bytes:
+    message = _uint_field(1, _FILE)
+    if data:
+        message += _field(2, data)
+    message += _uint_field(3, filesize)
+    for size in blocksizes:
+        message += _uint_field(4, size)
+    return message
+
+
+def _dag_pb_node(links: list[tuple[bytes, int]], data: bytes) -> bytes:
+    # links (PBNode field 2) are serialized before data (field 1), each with an empty name
+    node = b""
+    for cid, tsize in links:
+        node += _field(2, _field(1, cid) + _field(2, b"") + _uint_field(3, tsize))
+    return node + _field(1, data)
+
+
+class _Node:
+    # cid bytes, size of the file content below the node, size of the blocks below the node (Tsize)
+    def __init__(self, cid: bytes, filesize: int, tsize: int):
+        self.cid = cid
+        self.filesize = filesize
+        self.tsize = tsize
+
+
+def _leaf(chunk: bytes, version: int) -> _Node:
+    if version == 0:
+        block = _dag_pb_node([], _unixfs_file(chunk, len(chunk)))
+        return _Node(_multihash(block), len(chunk), len(block))
+    return _Node(_varint(1) + _varint(_RAW) + _multihash(chunk), len(chunk), len(chunk))
+
+
+def _parent(children: list[_Node], version: int) -> _Node:
+    filesize = sum(child.filesize for child in children)
+    block = _dag_pb_node([(child.cid, child.tsize) for child in children],
+                         _unixfs_file(None, filesize, [child.filesize for child in children]))
+    cid = _multihash(block) if version == 0 else _varint(1) + _varint(_DAG_PB) + _multihash(block)
+    return _Node(cid, filesize, len(block) + sum(child.tsize for child in children))
+
+
+def _encode(cid: bytes, version: int) -> str:
+    if version == 0:
+        return _base58(cid)
+    return "b" + base64.b32encode(cid).decode("ascii").lower().rstrip("=")
+
+
+class CIDBuilder:
+    """
+    compute the v0 and v1 cids of content fed in pieces, e.g. while it is streamed somewhere else.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._leaves = {0: [], 1: []}
+
+    def update(self, piece: bytes):
+        # pieces of any size are cut into fixed size chunks
+        if self._buffer:
+            piece = self._buffer + piece
+        offset = 0
+        while len(piece) - offset >= CHUNK_SIZE:
+            self._add(piece[offset:offset + CHUNK_SIZE])
+            offset += CHUNK_SIZE
+        self._buffer = piece[offset:]
+
+    def _add(self, chunk: bytes):
+        for version, leaves in self._leaves.items():
+            leaves.append(_leaf(chunk, version))
+
+    def cids(self) -> (str, str):
+        if self._buffer or not self._leaves[0]:
+            self._add(self._buffer)
+            self._buffer = b""
+        return self._root(0), self._root(1)
+
+    def _root(self, version: int) -> str:
+        nodes = self._leaves[version]
+        while len(nodes) > 1:
+            nodes = [_parent(nodes[i:i + MAX_LINKS], version) for i in range(0, len(nodes), MAX_LINKS)]
+        return _encode(nodes[0].cid, version)
+
+
+def compute_cid(data: bytes | Iterable[bytes], version: int = 0) -> str:
+    builder = CIDBuilder()
+    for piece in [data] if isinstance(data, bytes) else data:
+        builder.update(piece)
+    return builder.cids()[version]
@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+import gzip
+import io
+import json
+import os
+import zlib
+
+# binary formats and zstd are optional, install them with `pip install PyAgentlayer[binary]`
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+# largest request body accepted, before and after decompression
+MAX_BODY_SIZE = int(os.environ.get("AGENT_MAX_BODY_SIZE", 16 * 1024 * 1024))
+# decompressed in pieces of this size, so a body can be rejected before it is all inflated
+_DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class BodyTooLargeError(ValueError):
+    pass
+
+
+def content_types() -> list[str]:
+    # request and response bodies this process can decode and encode, most compact first
+    types = []
+    if msgpack is not None:
+        types.append(MSGPACK)
+    if cbor2 is not None:
+        types.append(CBOR)
+    types.append(JSON)
+    return types
+
+
+def encodings() -> list[str]:
+    return ([ZSTD] if zstandard is not None else []) + [GZIP]
+
+
+def encode(obj, content_type: str) -> bytes:
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    if content_type == CBOR and cbor2 is not None:
+        return cbor2.dumps(obj)
+    if content_type == JSON:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    raise ValueError(f"unsupported content type {content_type}")
+
+
+def decode(data: bytes, content_type: str):
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    if content_type == CBOR and cbor2 is not None:
+        return cbor2.loads(data)
+    if content_type == JSON or content_type.endswith("+json"):
+        return json.loads(data)
+    raise ValueError(f"unsupported content type {content_type}")
+
+
+def is_supported(content_type: str, content_encoding: str | None) -> bool:
+    # whether a request body in this format and compression can be decoded
+    if content_type not in content_types() and not content_type.endswith("+json"):
+        return False
+    return not content_encoding or content_encoding in encodings() + ["identity"]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == GZIP:
+        # level 5 is most of the gain of level 9 at a fraction of the cpu
+        return gzip.compress(data, compresslevel=5)
+    raise ValueError(f"unsupported content encoding {encoding}")
+
+
+def decompress(data: bytes, encoding: str | None, max_size: int | None = None) -> bytes:
+    """
+    decompress a body, raises BodyTooLargeError as soon as the output goes over `max_size` (default MAX_BODY_SIZE),
+    so a small compressed bomb is never inflated in full.
+    """
+    max_size = MAX_BODY_SIZE if max_size is None else max_size
+    if not encoding or encoding == "identity":
+        output = data
+    elif encoding == ZSTD and zstandard is not None:
+        # frames written by stream compressors don't carry the content size, read until the limit instead
+        buffer = bytearray()
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+            while len(buffer) <= max_size:
+                chunk = reader.read(_DECOMPRESS_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+        output = bytes(buffer)
+    elif encoding == GZIP:
+        output = _gunzip(data, max_size)
+    else:
+        raise ValueError(f"unsupported content encoding {encoding}")
+    if len(output) > max_size:
+        raise BodyTooLargeError(f"body larger than {max_size} bytes")
+    return output
+
+
+def _gunzip(data: bytes, max_size: int) -> bytes:
+    output = bytearray()
+    while data and len(output) <= max_size:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = data
+        while not decompressor.eof and len(output) <= max_size:
+            chunk = decompressor.decompress(pending, _DECOMPRESS_CHUNK_SIZE)
+            pending = decompressor.unconsumed_tail
+            if not chunk and not pending:
+                break
+            output += chunk
+        if not decompressor.eof:
+            if len(output) > max_size:
+                break
+            raise ValueError("truncated gzip body")
+        # concatenated gzip members, as gzip.decompress accepts
+        data = decompressor.unused_data
+    return bytes(output)
+
+
+def _parse_list(header: str | None) -> list[tuple[str, float]]:
+    # "a, b;q=0.5" -> [("a", 1.0), ("b", 0.5)]
+    items = []
+    for part in (header or "").split(","):
+        value, _, params = part.strip().partition(";")
+        if not value:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, number = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        items.append((value.strip().lower(), q))
+    return items
+
+
+def negotiate(header: str | None, supported: list[str], default: str | None = None) -> str | None:
+    """
+    the supported value the client prefers in an Accept / Accept-Encoding header, `default` when none matches.
+    ties are broken by the order of `supported`.
+    """
+    accepted = {value: q for value, q in _parse_list(header) if q > 0}
+    candidates = [value for value in supported if value in accepted]
+    if not candidates:
+        return default
+    return max(candidates, key=lambda value: (accepted[value], -supported.index(value)))
+
+
+def parse_list(header: str | None) -> list[str]:
+    return [value for value, q in _parse_list(header) if q > 0]
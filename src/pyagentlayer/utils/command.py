@@ -1,5 +1,6 @@
 # -*- coding:utf-8 -*-
 import argparse
+import json
 
 from ..agent import LAgent
 from ..models import SubscriptionPeriodEnum
@@ -18,6 +19,18 @@ def run_agent(agent: LAgent, host="0.0.0.0", port=8000, log_onchain=True):
     parser_subscribe.add_argument("--plan", type=str, choices=["weekly", "monthly", "yearly"], default="monthly", help="Subscription plan")
     parser_subscribe.add_argument("--auto-renewal", type=bool, default=False, help="Auto renewal")
 
+    parser_bench = subparsers.add_parser('bench', help='Benchmark Agent against local chain and ipfs stand-ins, on-chain logging is disabled')
+    parser_bench.add_argument("--method", type=str, default=None, help="Method to call, defaults to the first registered one")
+    parser_bench.add_argument("--payload", type=json.loads, default={}, help="Request body as json")
+    parser_bench.add_argument("--requests", type=int, default=1000, help="Number of requests")
+    parser_bench.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser_bench.add_argument("--rpc-latency", type=float, default=0.0, help="Simulated rpc latency in ms")
+    parser_bench.add_argument("--ipfs-latency", type=float, default=0.0, help="Simulated ipfs latency in ms")
+
+    parser_bench_calls = subparsers.add_parser('bench-calls', help='Compare web3 contract calls to the precompiled eth_call of the executors, against a local chain')
+    parser_bench_calls.add_argument("--iterations", type=int, default=1000, help="Calls per function and path")
+    parser_bench_calls.add_argument("--rpc-latency", type=float, default=0.0, help="Simulated rpc latency in ms")
+
     args = parser.parse_args()
 
     if args.subcommand == 'register':
@@ -25,6 +38,14 @@ def run_agent(agent: LAgent, host="0.0.0.0", port=8000, log_onchain=True):
     elif args.subcommand == 'subscribe':
         period = SubscriptionPeriodEnum.get_by_name(args.plan)
         agent.subscribe(args.agent_id, period, args.auto_renewal)
+    elif args.subcommand == 'bench':
+        from ..bench import run_bench
+        report = run_bench(agent, method=args.method, payload=args.payload, total_requests=args.requests, concurrency=args.concurrency,
+                           rpc_latency=args.rpc_latency / 1000, ipfs_latency=args.ipfs_latency / 1000)
+        print(report)
+    elif args.subcommand == 'bench-calls':
+        from ..bench import run_call_bench
+        print(run_call_bench(iterations=args.iterations, rpc_latency=args.rpc_latency / 1000))
     elif args.subcommand == 'run' or args.subcommand is None:
         agent.initialize()
         agent.run(host=host, port=port, log_onchain=log_onchain)
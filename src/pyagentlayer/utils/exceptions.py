@@ -2,3 +2,40 @@
 class AuthorizationException(Exception):
     # 401
     pass
+
+
+class OverloadedException(Exception):
+    # 429
+    def __init__(self, reason: str, retry_after: int = 1, queue_depth: int = 0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+
+class AgentCallException(ValueError):
+    # non-2xx answer of a called agent
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenException(Exception):
+    # calls to the target agent are failing, rejected without being sent
+    def __init__(self, agent_id, retry_after: float = 0):
+        super().__init__(f"circuit to agent {agent_id} is open, retry in {round(retry_after, 1)} s")
+        self.agent_id = agent_id
+        self.retry_after = retry_after
+
+
+class DeadlineExceededException(Exception):
+    # 504
+    pass
+
+
+class TransactionFailedException(Exception):
+    # mined with status 0 (reverted or out of gas)
+    def __init__(self, tx_hash: str, receipt=None):
+        super().__init__(f"transaction {tx_hash} failed")
+        self.tx_hash = tx_hash
+        self.receipt = receipt
@@ -4,11 +4,25 @@ import hashlib
 import io
 import json
 import logging
+import os
 import tempfile
+import threading
+import uuid
+from typing import Iterable, Iterator
 from urllib.parse import urlparse
 
 import requests
 
+from .cid import CIDBuilder
+
+ipfs_gateway = os.environ.get("IPFS_GATEWAY", "https://quicknode.quicknode-ipfs.com/ipfs/")
+# seconds a download from the gateway may take
+ipfs_download_timeout = float(os.environ.get("IPFS_DOWNLOAD_TIMEOUT", 10))
+# json file recording the cids already pinned, uploads of the same content are skipped
+pin_manifest_path = os.environ.get("IPFS_PIN_MANIFEST")
+# bytes read and sent at a time when streaming an upload
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 
 def generate_hash(input_string):
     hash_object = hashlib.sha256()
@@ -18,50 +32,167 @@ def generate_hash(input_string):
     return hash_value
 
 
+class PinManifest:
+    """
+    cids known to be pinned by the upload service, by locally computed cid and by source url, so content that was already
+    uploaded isn't sent again. kept in memory, and in a json file when `path` is set (IPFS_PIN_MANIFEST).
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = os.path.expanduser(path) if path else None
+        # local cid (v0 and v1) -> cid returned by the upload service
+        self.cids = {}
+        # url -> {"cid", "etag", "last_modified"} of the last upload from that url
+        self.sources = {}
+        self._lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    manifest = json.load(f)
+                self.cids = manifest.get("cids", {})
+                self.sources = manifest.get("sources", {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"read ipfs pin manifest {self.path} failed with error message {e}")
+
+    def get(self, local_cids) -> str | None:
+        for local_cid in local_cids:
+            if local_cid in self.cids:
+                return self.cids[local_cid]
+        return None
+
+    def add(self, local_cids, cid: str, url: str | None = None, etag: str | None = None, last_modified: str | None = None):
+        with self._lock:
+            for local_cid in local_cids:
+                self.cids[local_cid] = cid
+            if url is not None:
+                self.sources[url] = {"cid": cid, "etag": etag, "last_modified": last_modified}
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # written aside then renamed, a crash never leaves a truncated manifest
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            json.dump({"cids": self.cids, "sources": self.sources}, f)
+        os.replace(f.name, self.path)
+
+
 class AbsIPFSClient(metaclass=abc.ABCMeta):
 
-    def __init__(self):
+    def __init__(self, manifest: PinManifest | None = None):
         self._headers = {}
         self._endpoint = None
+        self.manifest = PinManifest(pin_manifest_path) if manifest is None else manifest
 
     def upload_file(self, filepath):
         if isinstance(filepath, str) and urlparse(filepath).scheme in ['http', 'https']:
-            response = requests.get(filepath)
-            if response.status_code == 200:
-                files = {'file': (filepath.split('/')[-1], response.content)}
-                resp = requests.post(self._endpoint, headers=self._headers, files=files)
-                cid = json.loads(resp.content).get('cid')
-                logging.debug(f'upload file {filepath} to ipfs success. cid: {cid}')
-                return cid
-            else:
-                logging.error(f'Failed to download file from {filepath}')
-        else:
-            if (isinstance(filepath, tempfile._TemporaryFileWrapper)
-                    or isinstance(filepath, io.IOBase)):
-                resp = requests.post(self._endpoint, headers=self._headers, files={'file': filepath})
-            else:
-                with open(filepath, 'rb') as f:
-                    resp = requests.post(self._endpoint, headers=self._headers, files={'file': f})
-
-            assert resp.ok
-            res_json = json.loads(resp.content)
-            if "error" in res_json:
-                logging.error(f'error when upload json to ipfs.')
-                raise ValueError(res_json.get("error").get("message"))
-
-            cid = json.loads(resp.content).get('cid')
-            logging.debug(f'upload file to ipfs success. cid: {cid}')
-            return cid
+            return self._upload_url(filepath)
+
+        if isinstance(filepath, (tempfile._TemporaryFileWrapper, io.IOBase)):
+            filename = os.path.basename(getattr(filepath, "name", "file"))
+            filepath.seek(0)
+            local_cids = self._local_cids(filepath)
+            filepath.seek(0)
+            return self._upload(filename, local_cids, self._read_chunks(filepath))
+        with open(filepath, 'rb') as f:
+            local_cids = self._local_cids(f)
+            f.seek(0)
+            return self._upload(os.path.basename(filepath), local_cids, self._read_chunks(f))
+
+    def upload_bytes(self, data: bytes, filename: str = "file") -> str:
+        # uploaded from memory, or not at all when the same content is known to be pinned
+        builder = CIDBuilder()
+        builder.update(data)
+        return self._upload(filename, builder.cids(), data)
 
     def upload_json(self, json_data: dict):
-        with tempfile.NamedTemporaryFile(mode="w+") as f:
-            f.write(json.dumps(json_data))
-            f.seek(0)
-            return self.upload_file(f)
+        return self.upload_bytes(json.dumps(json_data).encode("utf-8"), "data.json")
+
+    def _upload(self, filename: str, local_cids, body) -> str:
+        cid = self.manifest.get(local_cids)
+        if cid is not None:
+            logging.debug(f"{filename} is already pinned, skip uploading to ipfs. cid: {cid}")
+            return cid
+        cid = self._post(filename, body)
+        self.manifest.add(local_cids, cid)
+        logging.debug(f'upload file to ipfs success. cid: {cid}')
+        return cid
+
+    def _upload_url(self, url: str) -> str | None:
+        # the remote file is streamed to the upload endpoint, and not downloaded again while the server says unchanged
+        source = self.manifest.sources.get(url)
+        headers = {}
+        if source and source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source and source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+        with requests.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and source:
+                logging.debug(f"{url} is unchanged, skip uploading to ipfs. cid: {source['cid']}")
+                return source["cid"]
+            if response.status_code != 200:
+                logging.error(f'Failed to download file from {url}')
+                return None
+
+            builder = CIDBuilder()
+
+            def chunks():
+                for chunk in response.iter_content(chunk_size=UPLOAD_CHUNK_SIZE):
+                    builder.update(chunk)
+                    yield chunk
+
+            cid = self._post(url.split('/')[-1], chunks())
+        self.manifest.add(builder.cids(), cid, url=url, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        logging.debug(f'upload file {url} to ipfs success. cid: {cid}')
+        return cid
+
+    def _post(self, filename: str, body: bytes | Iterable[bytes]) -> str:
+        """
+        post a multipart upload of `body`. bytes are sent with a content length, an iterable of chunks is streamed
+        with chunked transfer encoding, never held in memory as a whole.
+        """
+        boundary = uuid.uuid4().hex
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        if isinstance(body, bytes):
+            data = head + body + tail
+        else:
+            def stream():
+                yield head
+                yield from body
+                yield tail
+
+            data = stream()
+        resp = requests.post(self._endpoint, headers={**self._headers, "Content-Type": f"multipart/form-data; boundary={boundary}"}, data=data)
+
+        assert resp.ok
+        res_json = json.loads(resp.content)
+        if "error" in res_json:
+            logging.error(f'error when upload json to ipfs.')
+            raise ValueError(res_json.get("error").get("message"))
+        return res_json.get('cid')
+
+    @staticmethod
+    def _read_chunks(f) -> Iterator[bytes]:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+    @classmethod
+    def _local_cids(cls, f) -> (str, str):
+        builder = CIDBuilder()
+        for chunk in cls._read_chunks(f):
+            builder.update(chunk)
+        return builder.cids()
 
     @staticmethod
-    def download_file(file_cid):
-        resp = requests.get(f'https://quicknode.quicknode-ipfs.com/ipfs/{file_cid}')
+    def download_file(file_cid, timeout: float | None = None):
+        resp = requests.get(f'{ipfs_gateway.rstrip("/")}/{file_cid}', timeout=ipfs_download_timeout if timeout is None else timeout)
         assert resp.ok
         return json.loads(resp.content)
 
@@ -0,0 +1,176 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import threading
+from typing import AsyncIterator, Iterable, Iterator
+
+SSE_MIMETYPE = "text/event-stream"
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # ask reverse proxies (nginx) not to buffer the stream
+    "X-Accel-Buffering": "no",
+}
+# seconds without a chunk from the handler before a keepalive comment is sent
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT = ": keepalive\n\n"
+
+EVENT_MESSAGE = "message"
+EVENT_ERROR = "error"
+EVENT_DONE = "done"
+
+_END = object()
+
+
+class ServerSentEvent:
+    event: str
+    data: str
+    id: str | None
+
+    def __init__(self, data: str, event: str = EVENT_MESSAGE, id: str | None = None):
+        self.data = data
+        self.event = event
+        self.id = id
+
+    def json(self):
+        return json.loads(self.data)
+
+
+def format_event(data: str, event: str | None = None, id: str | None = None) -> str:
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    # multi-line payloads are sent as one `data:` field per line
+    for line in data.splitlines() or [""]:
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_events(chunks: Iterator, encode, heartbeat_interval: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+    """
+    frame the chunks of a handler generator as server-sent events.
+
+    the handler generator runs in its own thread, so keepalive comments can be sent while it is busy. once the
+    client disconnects the server closes this generator, and the handler generator is stopped before its next chunk.
+    """
+    # the body is iterated after the view returned, keep the request's context (e.g. the current trace span) of now
+    return _stream_events(chunks, encode, heartbeat_interval, contextvars.copy_context())
+
+
+def _stream_events(chunks: Iterator, encode, heartbeat_interval: float, context: contextvars.Context) -> Iterator[str]:
+    events = queue.Queue(maxsize=64)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                events.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if stopped.is_set() or not put((EVENT_MESSAGE, encode(chunk))):
+                    logging.info("client disconnected, stop streaming response")
+                    break
+            else:
+                put((EVENT_DONE, ""))
+        except Exception as e:
+            logging.error(f"streaming handler failed with error message {e}")
+            put((EVENT_ERROR, json.dumps({"success": False, "message": "Internal Server Error"})))
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            put((_END, None))
+
+    threading.Thread(target=context.run, args=(produce,), daemon=True).start()
+    try:
+        # send something right away so headers are flushed and the client knows the stream is alive
+        yield HEARTBEAT
+        while True:
+            try:
+                event, data = events.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            if event is _END:
+                return
+            yield format_event(data, event=None if event == EVENT_MESSAGE else event)
+    finally:
+        stopped.set()
+
+
+async def stream_events_async(chunks: AsyncIterator, encode, heartbeat_interval: float = HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+    """
+    frame the chunks of an async handler generator as server-sent events, on the event loop serving the request.
+    keepalive comments are sent while the next chunk is awaited, closing this generator closes the handler generator.
+    """
+    yield HEARTBEAT
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=heartbeat_interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                yield format_event("", event=EVENT_DONE)
+                return
+            except Exception as e:
+                logging.error(f"streaming handler failed with error message {e}")
+                yield format_event(json.dumps({"success": False, "message": "Internal Server Error"}), event=EVENT_ERROR)
+                return
+            finally:
+                if pending.done():
+                    pending = None
+            yield format_event(encode(chunk))
+    finally:
+        if pending is not None:
+            # a generator can't be closed while its next chunk is computed
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+
+def iter_events(lines: Iterable[str]) -> Iterator[ServerSentEvent]:
+    # parse a text/event-stream line by line, see https://html.spec.whatwg.org/multipage/server-sent-events.html
+    event = EVENT_MESSAGE
+    event_id = None
+    data = []
+    for line in lines:
+        if line == "":
+            if data:
+                yield ServerSentEvent(data="\n".join(data), event=event, id=event_id)
+            event = EVENT_MESSAGE
+            data = []
+            continue
+        if line.startswith(":"):
+            # comment, used for keepalive
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            data.append(value)
+        elif field == "event":
+            event = value
+        elif field == "id":
+            event_id = value
+    if data:
+        yield ServerSentEvent(data="\n".join(data), event=event, id=event_id)
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from tools.function_signatures.solidity_parser import CONTAINER_KEYWORDS, SolidityParseError, tokenize
+
+# findings of earlier audits per unit of source (a contract's declarations, a function), so a resubmitted contract only
+# has its changed units and the units depending on them audited again
+
+AUDIT_STORE_PATH = os.getenv("AUDIT_STORE_PATH", "audit_findings.json")
+
+FILE_UNIT = "<file>"
+UNIT_KEYWORDS = ("function", "constructor", "fallback", "receive", "modifier")
+
+_OPENING = {"(", "[", "{"}
+_CLOSING = {")", "]", "}"}
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _group_end(tokens, i):
+    # index after the balanced group opening at tokens[i]
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j] in _OPENING:
+            depth += 1
+        elif tokens[j] in _CLOSING:
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    raise SolidityParseError(f"unbalanced '{tokens[i]}' in source")
+
+
+def _split_body(container, tokens, units):
+    # functions and modifiers with a body become units, the remaining declarations are returned
+    rest = []
+    i = 0
+    while i < len(tokens):
+        keyword = tokens[i]
+        if keyword in _OPENING:
+            end = _group_end(tokens, i)
+            rest.extend(tokens[i:end])
+            i = end
+            continue
+        if keyword not in UNIT_KEYWORDS or (i + 1 < len(tokens) and tokens[i + 1] == "="):
+            rest.append(keyword)
+            i += 1
+            continue
+        j = i + 1
+        while j < len(tokens) and tokens[j] not in ("{", ";"):
+            j = _group_end(tokens, j) if tokens[j] in _OPENING else j + 1
+        if j == len(tokens) or tokens[j] == ";":
+            # declarations without a body (interfaces, abstract functions, function type variables)
+            rest.extend(tokens[i:j + 1])
+            i = j + 1
+            continue
+        end = _group_end(tokens, j)
+        if keyword in ("constructor", "fallback", "receive"):
+            name = keyword
+        elif _IDENTIFIER.fullmatch(tokens[i + 1]):
+            name = tokens[i + 1]
+        else:
+            name = "fallback"
+        unit = f"{container}.{name}" if container else name
+        # overloads are told apart by their order in the contract
+        n = 1
+        while unit in units:
+            n += 1
+            unit = f"{container}.{name}#{n}" if container else f"{name}#{n}"
+        units[unit] = tokens[i:end]
+        i = end
+    return rest
+
+
+def split_units(code):
+    """
+    cut solidity source into units of normalized tokens (no whitespace, no comments): `<contract>` for the declarations
+    of a contract other than its functions (inheritance, state, events...), `<contract>.<function>` per function or
+    modifier, free functions by name and `<file>` for the rest of the file (pragmas, imports, file level types).
+    source that can't be cut is a single `<file>` unit.
+    """
+    tokens = tokenize(code)
+    units = {}
+    try:
+        file_level = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in CONTAINER_KEYWORDS and i + 1 < len(tokens) and _IDENTIFIER.fullmatch(tokens[i + 1]):
+                name = tokens[i + 1]
+                start = i
+                while i < len(tokens) and tokens[i] != "{":
+                    i += 1
+                if i == len(tokens):
+                    raise SolidityParseError(f"missing body for {tokens[start]} {name}")
+                end = _group_end(tokens, i)
+                units[name] = tokens[start:i + 1] + _split_body(name, tokens[i + 1:end - 1], units) + ["}"]
+                i = end
+            else:
+                file_level.append(tokens[i])
+                i += 1
+        file_level = _split_body("", file_level, units)
+    except SolidityParseError:
+        return {FILE_UNIT: tokens}
+    if file_level:
+        units[FILE_UNIT] = file_level
+    return units
+
+
+def dependencies(units):
+    """
+    the units each unit uses: its contract's declarations, the contracts it names, the functions and modifiers it
+    calls (by name, in any contract, so inherited and overridden ones are included) and the rest of the file.
+    """
+    by_name = {}
+    for unit in units:
+        by_name.setdefault(unit.rsplit(".", 1)[-1].split("#")[0], set()).add(unit)
+    result = {}
+    for unit, tokens in units.items():
+        deps = set()
+        for token in tokens:
+            deps |= by_name.get(token, set())
+        if "." in unit:
+            deps.add(unit.split(".")[0])
+        if FILE_UNIT in units:
+            deps.add(FILE_UNIT)
+        deps.discard(unit)
+        result[unit] = deps
+    return result
+
+
+def unit_keys(units, version=""):
+    """
+    store key of each unit: the hash of its tokens and of the tokens of every unit it depends on, directly or not, so
+    a change to a unit also changes the keys of its dependents. `version` (e.g. the prompts and models of the audit) is
+    part of every key, findings of another version are not reused.
+    """
+    version = _digest(version)
+    hashes = {unit: _digest(" ".join(tokens)) for unit, tokens in units.items()}
+    deps = dependencies(units)
+    keys = {}
+    for unit in units:
+        seen = set()
+        pending = [unit]
+        while pending:
+            for dep in deps[pending.pop()]:
+                if dep not in seen and dep != unit:
+                    seen.add(dep)
+                    pending.append(dep)
+        keys[unit] = _digest("\n".join([version, f"{unit}:{hashes[unit]}"] + sorted(f"{dep}:{hashes[dep]}" for dep in seen)))
+    return keys
+
+
+def focus_instruction(recomputed):
+    return ("\n\nThe rest of this code was audited before, only report vulnerabilities involving these parts of it: "
+            + ", ".join(recomputed))
+
+
+class FindingsStore:
+    """
+    findings per unit key in a json file. a finding is filed under the units it names (all recomputed units when it
+    names none), and is reused only while all of them are unchanged.
+    """
+
+    def __init__(self, path=AUDIT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.units = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.units = json.load(f)
+
+    def lookup(self, keys):
+        """
+        returns the stored findings still valid for `keys` ({unit: key}) and the units to audit again.
+        """
+        current = set(keys.values())
+        reused = []
+        recomputed = []
+        with self._lock:
+            for unit, key in keys.items():
+                if key not in self.units:
+                    recomputed.append(unit)
+                    continue
+                for entry in self.units[key]:
+                    if entry["finding"] not in reused and all(k in current for k in entry["units"]):
+                        reused.append(entry["finding"])
+        return reused, recomputed
+
+    def record(self, keys, recomputed, findings):
+        """
+        file the findings of an audit of the `recomputed` units, units without findings are stored empty.
+        """
+        names = {}
+        for unit in recomputed:
+            names.setdefault(unit.rsplit(".", 1)[-1].split("#")[0], []).append(unit)
+        with self._lock:
+            for unit in recomputed:
+                self.units[keys[unit]] = []
+            for finding in findings:
+                units = [unit for name in _IDENTIFIER.findall(finding) for unit in names.get(name, [])] or recomputed
+                finding_keys = sorted({keys[unit] for unit in units})
+                for key in finding_keys:
+                    self.units[key].append({"finding": finding, "units": finding_keys})
+            if self.path:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.units, f)
+                os.replace(tmp, self.path)
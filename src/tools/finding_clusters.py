@@ -0,0 +1,101 @@
+import hashlib
+import re
+
+# near-duplicate findings are grouped locally, so one LLM verification can stand for each group
+
+_WORD = re.compile(r"[a-z0-9_]+")
+_FUNCTION_DEF = re.compile(r"\bfunction\s+([A-Za-z_$][\w$]*)")
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+SHINGLE_SIZE = 3
+NUM_HASHES = 64
+_PRIME = (1 << 61) - 1
+# (a, b) of the hash functions h(x) = (a * x + b) mod p, fixed so signatures are comparable between runs
+_PERMUTATIONS = [(int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % (_PRIME - 1) + 1,
+                  int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % _PRIME) for i in range(NUM_HASHES)]
+
+# words too common in findings to tell two of them apart
+STOPWORDS = {"a", "an", "the", "and", "or", "of", "to", "in", "on", "is", "are", "be", "can", "could", "this", "that",
+             "it", "its", "by", "for", "with", "as", "at", "so", "any", "function", "contract", "because", "which", "before",
+             "after", "from", "has", "have", "not", "no", "allows", "may", "vulnerable", "vulnerability", "issue"}
+
+
+def function_names(code):
+    return set(_FUNCTION_DEF.findall(code))
+
+
+def referenced_functions(text, known_functions):
+    # functions of the audited code a finding talks about
+    return {name for name in _IDENTIFIER.findall(text) if name in known_functions}
+
+
+def shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def words(text):
+    return {word for word in _WORD.findall(text.lower()) if word not in STOPWORDS}
+
+
+def jaccard(set_a, set_b):
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+def minhash(text):
+    hashed = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big") for shingle in shingles(text)]
+    if not hashed:
+        return None
+    return [min((a * x + b) % _PRIME for x in hashed) for a, b in _PERMUTATIONS]
+
+
+def estimated_jaccard(signature_a, signature_b):
+    if signature_a is None or signature_b is None:
+        return 1.0 if signature_a is signature_b else 0.0
+    return sum(1 for x, y in zip(signature_a, signature_b) if x == y) / NUM_HASHES
+
+
+def cluster_findings(findings, code, threshold=0.5, same_functions_threshold=0.25):
+    """
+    group findings describing the same issue, returns lists of indexes into `findings`, representative first.
+
+    two findings are near-duplicates when the estimated jaccard similarity of their word shingles (minhash) reaches
+    `threshold`, or, when they point at the same functions of `code`, when the jaccard similarity of their words reaches
+    `same_functions_threshold` (paraphrases of one bug). the representative of a group is the member most similar to
+    the others.
+    """
+    known_functions = function_names(code)
+    signatures = [minhash(finding) for finding in findings]
+    functions = [referenced_functions(finding, known_functions) for finding in findings]
+    vocabularies = [words(finding) for finding in findings]
+
+    parents = list(range(len(findings)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    similarity = {}
+    for i in range(len(findings)):
+        for j in range(i + 1, len(findings)):
+            score = estimated_jaccard(signatures[i], signatures[j])
+            similarity[i, j] = similarity[j, i] = score
+            same_functions = functions[i] and functions[i] == functions[j]
+            if score >= threshold or (same_functions and jaccard(vocabularies[i], vocabularies[j]) >= same_functions_threshold):
+                parents[find(i)] = find(j)
+
+    clusters = {}
+    for i in range(len(findings)):
+        clusters.setdefault(find(i), []).append(i)
+
+    result = []
+    for members in clusters.values():
+        representative = max(members, key=lambda i: (sum(similarity[i, j] for j in members if j != i), len(findings[i])))
+        result.append([representative] + [i for i in members if i != representative])
+    return sorted(result, key=lambda members: members[0])
@@ -1,20 +1,31 @@
-from openai import OpenAI
+import json
+import logging
+
 import prompts
 import os
 # from dotenv import load_do
 from dotenv import load_dotenv
+from solidity_parser import extract_signatures, SolidityParseError
 load_dotenv()
 
 def read_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-client = OpenAI(
-    api_key = os.environ.get("OPENAI_API_KEY")
-)
+_client = None
+
+def _openai_client():
+    # created lazily, the local extractor doesn't need openai installed
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(
+            api_key = os.environ.get("OPENAI_API_KEY")
+        )
+    return _client
 
 def ask_chatGPT_function_signature(source_code):
-    completion = client.chat.completions.create(
+    completion = _openai_client().chat.completions.create(
         model="gpt-3.5-turbo",
         messages = [
             {"role":"system", "content": "You are solidity analyzer"},
@@ -22,9 +33,19 @@ def ask_chatGPT_function_signature(source_code):
         ]
     )
 
-    # Its response time as long as 10+ seconds for a single file, how to optimize it
+    # Its response time as long as 10+ seconds for a single file, use get_function_signatures instead
     return completion.choices[0].message.content
 
+def get_function_signatures(source_code, llm_fallback=False):
+    # parse locally in milliseconds, only ask the LLM when the source can't be parsed
+    try:
+        return json.dumps(extract_signatures(source_code))
+    except SolidityParseError as e:
+        if not llm_fallback:
+            raise
+        logging.warning(f"local signature extraction failed with error message {e}, falling back to LLM")
+        return ask_chatGPT_function_signature(source_code)
+
 if __name__ == '__main__':
     #local test
     file_path = 'file/user/solidity/project/NFT.sol' # An OpenZepplin NFT contract
@@ -34,3 +55,4 @@ if __name__ == '__main__':
     print(file_path)
     soliditySourceCode = read_file(file_path)
     print(soliditySourceCode)
+    print(get_function_signatures(soliditySourceCode))
@@ -0,0 +1,271 @@
+import re
+
+# a small tokenizer/parser for solidity declarations, enough to list the function, event, modifier and
+# error signatures of a source file without compiling it or asking an LLM
+
+_TOKEN_RE = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<ident>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<number>\d[\w.]*)
+  | (?P<space>\s+)
+  | (?P<punct>.)
+''', re.VERBOSE | re.DOTALL)
+
+CONTAINER_KEYWORDS = ("contract", "interface", "library")
+DECLARATION_KEYWORDS = ("function", "constructor", "fallback", "receive", "modifier", "event", "error")
+VISIBILITY_KEYWORDS = ("public", "external", "internal", "private")
+MUTABILITY_KEYWORDS = ("pure", "view", "payable", "constant")
+
+# solidity aliases and their canonical abi names
+_TYPE_ALIASES = {
+    "uint": "uint256",
+    "int": "int256",
+    "byte": "bytes1",
+    "fixed": "fixed128x18",
+    "ufixed": "ufixed128x18",
+}
+
+_CLOSING = {"(": ")", "[": "]", "{": "}"}
+
+
+class SolidityParseError(Exception):
+    pass
+
+
+def tokenize(source_code: str) -> list[str]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(source_code):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        if kind == "punct" and (match.group() in ("'", '"') or source_code.startswith("/*", match.start())):
+            raise SolidityParseError(f"unterminated string or comment at offset {match.start()}")
+        tokens.append(match.group())
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: list[str]):
+        self.tokens = tokens
+        self.pos = 0
+        self.result = {}
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def expect(self, token):
+        if self.peek() != token:
+            raise SolidityParseError(f"expected '{token}' at token {self.pos}, got '{self.peek()}'")
+        self.pos += 1
+
+    def skip_group(self) -> list[str]:
+        # consume a balanced (), [] or {} group starting at the current token and return its inner tokens
+        opening = self.peek()
+        if opening not in _CLOSING:
+            raise SolidityParseError(f"expected group at token {self.pos}, got '{opening}'")
+        stack = [_CLOSING[opening]]
+        start = self.pos + 1
+        self.pos += 1
+        while stack:
+            token = self.peek()
+            if token is None:
+                raise SolidityParseError(f"unbalanced '{opening}' in source")
+            if token in _CLOSING:
+                stack.append(_CLOSING[token])
+            elif token in (")", "]", "}"):
+                if token != stack.pop():
+                    raise SolidityParseError(f"mismatched '{token}' at token {self.pos}")
+            self.pos += 1
+        return self.tokens[start:self.pos - 1]
+
+    def container(self, name, kind):
+        if name not in self.result:
+            self.result[name] = {"kind": kind, "functions": [], "modifiers": [], "events": [], "errors": []}
+        return self.result[name]
+
+    def parse(self) -> dict:
+        while self.peek() is not None:
+            token = self.peek()
+            if token in CONTAINER_KEYWORDS and _is_identifier(self.peek(1)):
+                self.parse_container()
+            elif token in ("function", "event", "error") and _is_identifier(self.peek(1)) and self.peek(2) == "(":
+                # free functions, events and errors declared at file level
+                self.parse_declaration(self.container("", "file"), "file")
+            elif token in _CLOSING:
+                self.skip_group()
+            elif token in (")", "]", "}"):
+                raise SolidityParseError(f"unexpected '{token}' at token {self.pos}")
+            else:
+                self.pos += 1
+        return self.result
+
+    def parse_container(self):
+        kind = self.peek()
+        name = self.peek(1)
+        self.pos += 2
+        # skip inheritance list, e.g. `is ERC721, Ownable(msg.sender)`
+        while self.peek() != "{":
+            if self.peek() is None or self.peek() == ";":
+                raise SolidityParseError(f"missing body for {kind} {name}")
+            if self.peek() == "(":
+                self.skip_group()
+            else:
+                self.pos += 1
+        self.expect("{")
+        container = self.container(name, kind)
+        while self.peek() != "}":
+            token = self.peek()
+            if token is None:
+                raise SolidityParseError(f"unterminated {kind} {name}")
+            if token in DECLARATION_KEYWORDS and self.peek(1) != "=":
+                self.parse_declaration(container, kind)
+            elif token in _CLOSING:
+                self.skip_group()
+            elif token in (")", "]"):
+                raise SolidityParseError(f"unexpected '{token}' at token {self.pos}")
+            else:
+                self.pos += 1
+        self.expect("}")
+
+    def parse_declaration(self, container: dict, container_kind: str):
+        keyword = self.peek()
+        self.pos += 1
+
+        name = keyword if keyword in ("constructor", "fallback", "receive") else None
+        if name is None and _is_identifier(self.peek()):
+            name = self.peek()
+            self.pos += 1
+        if keyword in ("event", "error") and name is None:
+            # `event` / `error` used as a plain identifier
+            return
+        if self.peek() != "(":
+            if keyword == "modifier" and name:
+                # modifiers may omit the parameter list
+                params = []
+            else:
+                return
+        else:
+            params = self.skip_group()
+
+        visibility = ""
+        mutability = ""
+        returns = []
+        while self.peek() not in ("{", ";"):
+            token = self.peek()
+            if token is None:
+                raise SolidityParseError(f"unterminated declaration of {name}")
+            if token in VISIBILITY_KEYWORDS:
+                visibility = token
+                self.pos += 1
+            elif token in MUTABILITY_KEYWORDS:
+                mutability = "view" if token == "constant" else token
+                self.pos += 1
+            elif token == "returns":
+                self.pos += 1
+                returns = [_canonical_type(p) for p in _split_params(self.skip_group())]
+            elif token in _CLOSING:
+                # override(A, B) and modifier invocation arguments
+                self.skip_group()
+            else:
+                self.pos += 1
+
+        is_state_variable = False
+        if self.peek() == "{":
+            self.skip_group()
+        else:
+            # `function (uint) external f;` declares a variable of function type, not a function
+            is_state_variable = keyword == "function" and name is None and _is_identifier(self.tokens[self.pos - 1])
+            self.pos += 1
+
+        if keyword == "function" and name is None:
+            if is_state_variable:
+                return
+            # pre-0.6 unnamed fallback function
+            name = "fallback"
+
+        signature = f"{name}({','.join(_canonical_type(p) for p in _split_params(params))})"
+        if keyword in ("event", "error", "modifier"):
+            container[f"{keyword}s"].append(signature)
+            return
+
+        if container_kind == "file":
+            # free functions are only callable inside the file's contracts, and can't declare a visibility
+            visibility = "internal"
+        elif not visibility:
+            visibility = "external" if container_kind == "interface" or name in ("fallback", "receive") else "public"
+        container["functions"].append({
+            "name": name,
+            "signature": signature,
+            "visibility": visibility,
+            "state_mutability": mutability or "nonpayable",
+            "returns": returns,
+        })
+
+
+def _is_identifier(token) -> bool:
+    return token is not None and re.fullmatch(r"[A-Za-z_$][A-Za-z0-9_$]*", token) is not None
+
+
+def _split_params(tokens: list[str]) -> list[list[str]]:
+    params = []
+    current = []
+    depth = 0
+    for token in tokens:
+        if token in _CLOSING:
+            depth += 1
+        elif token in (")", "]", "}"):
+            depth -= 1
+        if token == "," and depth == 0:
+            params.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        params.append(current)
+    return params
+
+
+def _canonical_type(tokens: list[str]) -> str:
+    if not tokens:
+        raise SolidityParseError("empty parameter")
+    if tokens[0] == "mapping":
+        # only legal for internal functions, keep the source spelling without spaces
+        depth = 0
+        for i, token in enumerate(tokens):
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+                if depth == 0:
+                    return "".join(tokens[:i + 1])
+        raise SolidityParseError("unbalanced mapping type")
+    if tokens[0] == "function":
+        return "function"
+
+    type_name = _TYPE_ALIASES.get(tokens[0], tokens[0])
+    i = 1
+    # qualified user defined types, e.g. `IERC20.Permit`
+    while i + 1 < len(tokens) and tokens[i] == "." and _is_identifier(tokens[i + 1]):
+        type_name += "." + tokens[i + 1]
+        i += 2
+    if type_name == "address" and i < len(tokens) and tokens[i] == "payable":
+        i += 1
+    while i < len(tokens) and tokens[i] == "[":
+        end = tokens.index("]", i)
+        type_name += "[" + "".join(tokens[i + 1:end]) + "]"
+        i = end + 1
+    return type_name
+
+
+def extract_signatures(source_code: str) -> dict:
+    """
+    list function, modifier, event and error signatures grouped by contract/interface/library name,
+    declarations at file level are grouped under the empty name.
+    raise SolidityParseError when the source can not be parsed.
+    """
+    result = _Parser(tokenize(source_code)).parse()
+    if not result:
+        raise SolidityParseError("no contract, interface or library declaration found")
+    return result
@@ -1,42 +1,225 @@
-from flask import Flask, request, jsonify
-from function_signatures import ask_chatGPT_function_signature
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flask import Flask, Response, request, jsonify
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from function_signatures import get_function_signatures
 app = Flask(__name__)
 
 app.config['TIMEOUT'] = 60
+# ask the LLM only when the local parser can't handle the uploaded source
+app.config['LLM_FALLBACK'] = os.environ.get('SIGNATURE_LLM_FALLBACK', 'false').lower() in ('1', 'true', 'yes')
 
 MAX_FILE_SIZE = 1024 * 1024 * 2
+MAX_FILES = int(os.environ.get('SIGNATURE_MAX_FILES', 200))
+# an archive is kept in memory until it is unpacked
+MAX_ARCHIVE_SIZE = int(os.environ.get('SIGNATURE_MAX_ARCHIVE_SIZE', 1024 * 1024 * 32))
+# whole /upload_files request, /upload_file takes one source
+MAX_UPLOAD_SIZE = int(os.environ.get('SIGNATURE_MAX_UPLOAD_SIZE', 1024 * 1024 * 64))
+MAX_WORKERS = int(os.environ.get('SIGNATURE_MAX_WORKERS', 8))
+# results of recently processed sources, keyed by content hash
+MAX_CACHED_RESULTS = 1024
+READ_CHUNK_SIZE = 64 * 1024
+# multipart boundaries and part headers around a file
+MULTIPART_OVERHEAD = 16 * 1024
 
-def validate_file(file):
-    
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    print("uploadedfilename:" + file.filename)
+# the local parser is cpu bound, processes parse sources in parallel
+executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+
+class FileTooLargeException(Exception):
+    pass
+
+
+def read_limited(stream, limit=MAX_FILE_SIZE):
+    # read in chunks and stop as soon as the limit is exceeded, instead of loading the whole body first
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return buffer.getvalue()
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise FileTooLargeException(f'File size exceeds {limit // (1024 * 1024)}MB limit')
+
+def is_archive(filename):
+    return filename.endswith(('.zip', '.tar', '.tar.gz', '.tgz'))
+
+def iter_archive(filename, fileobj):
+    # yield (name, content or exception) for each solidity source inside a zip or tar upload
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.endswith('.sol'):
+                    continue
+                if info.file_size > MAX_FILE_SIZE:
+                    yield info.filename, FileTooLargeException(f'File size exceeds {MAX_FILE_SIZE // (1024 * 1024)}MB limit')
+                    continue
+                with archive.open(info) as member:
+                    try:
+                        yield info.filename, read_limited(member)
+                    except FileTooLargeException as e:
+                        yield info.filename, e
+    else:
+        # stream mode, members are read in order without seeking
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for info in archive:
+                if not info.isfile() or not info.name.endswith('.sol'):
+                    continue
+                if info.size > MAX_FILE_SIZE:
+                    yield info.name, FileTooLargeException(f'File size exceeds {MAX_FILE_SIZE // (1024 * 1024)}MB limit')
+                    continue
+                yield info.name, read_limited(archive.extractfile(info))
+
+def iter_file_parts(max_size):
+    """
+    yield (filename, content or exception) for each `file` part of the multipart request body, read from the request
+    stream as it arrives instead of being spooled by `request.files`. a part over its limit is skipped, a body over
+    `max_size` bytes raises FileTooLargeException.
+    """
+    _, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if not options.get('boundary'):
+        raise ValueError('expected a multipart/form-data body')
+    decoder = MultipartDecoder(options['boundary'].encode('ascii'), max_form_memory_size=READ_CHUNK_SIZE + MULTIPART_OVERHEAD)
+    stream = request.stream
+    received = 0
+    part = None
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        received += len(chunk)
+        if received > max_size:
+            raise FileTooLargeException(f'Request size exceeds {max_size // (1024 * 1024)}MB limit')
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File) and event.name == 'file':
+                limit = MAX_ARCHIVE_SIZE if is_archive(event.filename or '') else MAX_FILE_SIZE
+                part = [event.filename or '', io.BytesIO(), limit]
+            elif isinstance(event, Data) and part is not None:
+                buffer, limit = part[1], part[2]
+                if buffer is not None:
+                    buffer.write(event.data)
+                    if buffer.tell() > limit:
+                        # drop the rest of the part
+                        part[1] = None
+                if not event.more_data:
+                    name, buffer, limit = part
+                    part = None
+                    if buffer is None:
+                        yield name, FileTooLargeException(f'File size exceeds {limit // (1024 * 1024)}MB limit')
+                    else:
+                        yield name, buffer.getvalue()
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            return
+        if not chunk:
+            raise ValueError('incomplete multipart body')
+
+def iter_uploaded_sources():
+    count = 0
+    for filename, content in iter_file_parts(MAX_UPLOAD_SIZE):
+        if filename == '':
+            continue
+        if is_archive(filename) and not isinstance(content, Exception):
+            sources = iter_archive(filename, io.BytesIO(content))
+        else:
+            sources = [(filename, content)]
+        for name, content in sources:
+            count += 1
+            if count > MAX_FILES:
+                raise ValueError(f'upload contains more than {MAX_FILES} files')
+            yield name, content
 
-    file.seek(0, 2)  # Move the cursor to the end of the file
-    file_size = file.tell()  # Get the current position of cursor, which is the size of the file
-    file.seek(0)  # Reset the cursor to the beginning of the file for further processing
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'error': 'File size exceeds 2MB limit'}), 400
-    
-    return "", 200
+def _signatures(content, llm_fallback):
+    return json.loads(get_function_signatures(content.decode('utf-8'), llm_fallback=llm_fallback))
+
+def submit_source(content, llm_fallback):
+    # identical sources are computed once, later uploads share the pending or finished result
+    key = (hashlib.sha256(content).hexdigest(), llm_fallback)
+    with _results_lock:
+        future = _results.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = executor.submit(_signatures, content, llm_fallback)
+            _results[key] = future
+            if len(_results) > MAX_CACHED_RESULTS:
+                _results.popitem(last=False)
+        else:
+            _results.move_to_end(key)
+    return key[0], future
+
+def _llm_fallback_enabled():
+    return request.args.get('llm_fallback', str(app.config['LLM_FALLBACK'])).lower() in ('1', 'true', 'yes')
 
 @app.route('/upload_file', methods=['POST'])
 def upload_file():
     try:
-        file = request.files['file']
-        json, code = validate_file(file)
-        if code == 400:
-            return json, code
-        json = ask_chatGPT_function_signature(file.read().decode('utf-8'))
-        return json, 200
+        parts = iter_file_parts(MAX_FILE_SIZE + MULTIPART_OVERHEAD)
+        filename, content = next(parts, (None, None))
+        if filename is None:
+            return jsonify({'error': 'No file part'}), 400
+        parts.close()
+        if filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+        print("uploadedfilename:" + filename)
+        if isinstance(content, Exception):
+            raise content
+        _, future = submit_source(content, _llm_fallback_enabled())
+        return jsonify(future.result()), 200
     except Exception as e:
         error_msg = str(e)
-        return jsonify({'error': error_msg}), 400 
+        return jsonify({'error': error_msg}), 400
+
+@app.route('/upload_files', methods=['POST'])
+def upload_files():
+    """
+    accept several `file` parts and/or zip/tar archives of .sol files, results are streamed back as
+    NDJSON, one line per source in completion order.
+    """
+    llm_fallback = _llm_fallback_enabled()
+
+    # the request body is consumed here, each source is submitted as soon as it is received and processing
+    # continues while results are streamed
+    pending = {}
+    errors = []
+    try:
+        for name, content in iter_uploaded_sources():
+            if isinstance(content, Exception):
+                errors.append({'filename': name, 'error': str(content)})
+                continue
+            content_hash, future = submit_source(content, llm_fallback)
+            pending.setdefault(future, []).append((name, content_hash))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    if not pending and not errors:
+        return jsonify({'error': 'No selected file'}), 400
+
+    def generate():
+        for line in errors:
+            yield json.dumps(line) + '\n'
+        for future in as_completed(pending):
+            for name, content_hash in pending[future]:
+                line = {'filename': name, 'sha256': content_hash}
+                try:
+                    line['signatures'] = future.result()
+                except Exception as e:
+                    line['error'] = str(e)
+                yield json.dumps(line) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 @app.route('/status', methods=['GET'])
-def hello():  
-    return jsonify({'status': 'ok'}), 200 
+def hello():
+    return jsonify({'status': 'ok'}), 200
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
-
+    app.run(debug=True, port=5000, threaded=True)
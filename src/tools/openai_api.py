@@ -1,15 +1,58 @@
 import os
+import threading
+import time
 import requests
 
-def ask_openai_common(prompt):
+# answers of the vul_check stage the cheap model isn't sure about, asked again to the strong model
+ESCALATE_ON = ("high possibility", "low possibility")
+
+
+def stage_model(stage=None):
+        # OPENAI_MODEL_ID_<STAGE> (e.g. OPENAI_MODEL_ID_VUL_CHECK) overrides OPENAI_MODEL_ID for one pipeline stage
+        strong_model = os.getenv('OPENAI_MODEL_ID')
+        if stage is None:
+                return strong_model
+        return os.getenv(f'OPENAI_MODEL_ID_{stage.upper()}', strong_model)
+
+
+class StageStats:
+        """
+        calls, latency and tokens per pipeline stage, to tune which model each stage uses.
+        """
+
+        def __init__(self):
+                self.stages = {}
+                self._lock = threading.Lock()
+
+        def record(self, stage, model, latency, usage):
+                with self._lock:
+                        stats = self.stages.setdefault(stage or 'default', {
+                                'model': model, 'calls': 0, 'latency': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0})
+                        stats['model'] = model
+                        stats['calls'] += 1
+                        stats['latency'] += latency
+                        stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                        stats['completion_tokens'] += usage.get('completion_tokens', 0)
+
+        def summary(self):
+                with self._lock:
+                        return {stage: {**stats, 'latency': round(stats['latency'], 3)} for stage, stats in self.stages.items()}
+
+
+# totals of the process, see StageStats for one request
+stage_stats = StageStats()
+
+
+def ask_openai_common(prompt, stage=None, stats=None, model=None):
         api_base = os.getenv('OPENAI_API_BASE', 'api.openai.com')  # Replace with your actual OpenAI API base URL
         api_key = os.getenv('OPENAI_API_KEY')  # Replace with your actual OpenAI API key
+        model = model or stage_model(stage)
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
         data = {
-            "model": os.getenv('OPENAI_MODEL_ID'),  # Replace with your actual OpenAI model
+            "model": model,  # Replace with your actual OpenAI model
             "messages": [
                 {
                     "role": "user",
@@ -17,11 +60,29 @@ def ask_openai_common(prompt):
                 }
             ]
         }
+        start = time.perf_counter()
         response = requests.post(f'https://{api_base}/v1/chat/completions', headers=headers, json=data)
         try:
             response_josn = response.json()
         except Exception as e:
-            return ''
+            response_josn = {}
+        latency = time.perf_counter() - start
+        usage = (response_josn.get('usage') if isinstance(response_josn, dict) else None) or {}
+        for s in (stage_stats, stats):
+            if s is not None:
+                s.record(stage, model, latency, usage)
         if 'choices' not in response_josn:
             return ''
-        return response_josn['choices'][0]['message']['content']
\ No newline at end of file
+        return response_josn['choices'][0]['message']['content']
+
+
+def ask_with_escalation(prompt, stage, stats=None, escalate_on=ESCALATE_ON):
+        """
+        ask the model of a filter stage, and the strong model when the answer is only a possibility.
+        only for stages whose prompt asks for one of the `escalate_on` markers (vul_check), other answers never escalate.
+        """
+        answer = ask_openai_common(prompt, stage=stage, stats=stats)
+        strong_model = stage_model()
+        if stage_model(stage) == strong_model or not any(marker in answer.lower() for marker in escalate_on):
+                return answer
+        return ask_openai_common(prompt, stage=f'{stage}_escalated', stats=stats, model=strong_model)
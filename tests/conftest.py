@@ -0,0 +1,34 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+# nothing listens there, tests must not reach a chain
+os.environ.setdefault("CHAIN_RPC", "http://127.0.0.1:1/")
+
+from eth_account import Account  # noqa: E402
+
+from pyagentlayer import LAgent, Model  # noqa: E402
+
+
+class EchoParam(Model):
+    value: int
+
+
+class EchoResponse(Model):
+    value: int
+
+
+@pytest.fixture
+def agent():
+    # a free agent as after `initialize`, without chain round trips
+    agent = LAgent(name="test", private_key=Account.create().key.hex(), http_endpoint="http://localhost:8000", agent_id=1)
+    agent.aa_wallet_address = Account.create().address
+
+    @agent.on_message("echo", EchoParam, EchoResponse)
+    def echo(ctx, param: EchoParam):
+        return EchoResponse(value=param.value)
+
+    return agent
@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from eth_account import Account
+
+from pyagentlayer.admission import AdmissionController
+from pyagentlayer.models import AgentMetadata
+from pyagentlayer.utils.exceptions import OverloadedException
+
+
+def test_caller_concurrency_limit():
+    controller = AdmissionController(max_concurrency=8, caller_concurrency=2)
+    slots = [controller.acquire("a"), controller.acquire("a")]
+    with pytest.raises(OverloadedException) as e:
+        controller.acquire("a")
+    assert e.value.reason == "caller_concurrency"
+    # other callers are not affected
+    controller.acquire("b").release()
+    slots[0].release()
+    controller.acquire("a").release()
+
+
+def test_caller_rate_limit():
+    controller = AdmissionController(caller_rate=1, caller_burst=2)
+    controller.acquire("a").release()
+    controller.acquire("a").release()
+    with pytest.raises(OverloadedException) as e:
+        controller.acquire("a")
+    assert e.value.reason == "caller_rate" and e.value.retry_after >= 1
+
+
+def test_queue_timeout_and_full_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    slot = controller.acquire("a")
+    with pytest.raises(OverloadedException) as e:
+        controller.acquire("b")
+    assert e.value.reason == "queue_timeout"
+    assert controller.queue_depth == 0
+    slot.release()
+    assert controller.stats()["active"] == 0
+
+
+def test_weighted_fair_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=64, caller_concurrency=64)
+    slot = controller.acquire("first")
+    order = []
+
+    def request(caller, weight):
+        with controller.acquire(caller, weight):
+            order.append(caller)
+
+    threads = []
+    for caller, weight in [("free", 1)] * 4 + [("paying", 4)] * 4:
+        threads.append(threading.Thread(target=request, args=(caller, weight)))
+        threads[-1].start()
+        # queued in this order
+        while controller.queue_depth < len(threads):
+            time.sleep(0.001)
+    slot.release()
+    for thread in threads:
+        thread.join()
+    # the paying caller's requests overtake the free ones queued before them
+    assert order[:4].count("paying") >= 3
+
+
+def test_acquire_async_waits_on_the_loop():
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    slot = controller.acquire("a")
+
+    async def main():
+        waiting = asyncio.ensure_future(controller.acquire_async("b"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and controller.queue_depth == 1
+        # released from another thread
+        threading.Thread(target=slot.release).start()
+        (await waiting).release()
+
+    asyncio.run(main())
+    assert controller.stats() == dict(controller.stats(), active=0, queue_depth=0, callers=0)
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    slot = controller.acquire("a")
+
+    async def main():
+        waiting = asyncio.ensure_future(controller.acquire_async("b"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    assert controller.queue_depth == 0
+    slot.release()
+    assert controller.stats()["active"] == 0 and controller.stats()["callers"] == 0
+
+
+def test_caller_key_ignores_replayable_signatures(agent):
+    wallet = Account.create().address
+    caller = AgentMetadata(key="", name="caller", description="", version="1.0.0", endpoint="", register_time=0, wallet=wallet)
+    # a signature verified by an earlier request, anyone can send it again
+    agent.signature_cache._entries[(wallet.lower(), "0xhash", "0xsig")] = True
+    headers = {"X-Agent-Meta": json.dumps(caller.to_json()), "X-Agent-Message-Hash": "0xhash", "X-Agent-Signature": "0xsig"}
+    controller = AdmissionController(caller_concurrency=4)
+    keys = []
+    acquire = controller.acquire
+    controller.acquire = lambda caller, weight=1.0: keys.append(caller) or acquire(caller, weight)
+    client = agent.create_app(log_onchain=False, admission_control=controller).test_client()
+    client.post("/echo", json={"value": 1}, headers=headers)
+    assert keys == ["ip:127.0.0.1"]
+
+    token, expires_at = agent.session_tokens.issue(agent.aa_wallet_address, wallet)
+    assert agent._caller_key("1.2.3.4", token) == wallet.lower()
+    assert agent._cached_tier(wallet.lower()) is None
+    agent._remember_tier(wallet, 60 * 24 * 3600, expires_at)
+    assert agent._cached_tier(wallet.lower()) == "yearly"
@@ -0,0 +1,41 @@
+# -*- coding:utf-8 -*-
+import pytest
+from eth_utils import to_checksum_address
+from web3.exceptions import ContractLogicError
+
+from pyagentlayer import agent_executor
+
+REVERT = {"code": 3, "message": "execution reverted: ERC721: invalid token ID", "data": "0x08c379a0"}
+RATE_LIMITED = {"code": -32005, "message": "limit exceeded"}
+
+
+def _answer(monkeypatch, executor, error):
+    monkeypatch.setattr(executor.w3.provider, "make_request", lambda method, params: {"jsonrpc": "2.0", "id": 1, "error": error})
+
+
+def test_revert_is_contract_logic_error(monkeypatch):
+    executor = agent_executor.new_agent_nft()
+    _answer(monkeypatch, executor, REVERT)
+    with pytest.raises(ContractLogicError) as e:
+        executor._eth_call(executor.precompiled["ownerOf"], (1,))
+    assert e.value.data == REVERT["data"]
+
+
+def test_node_error_is_not_a_revert(monkeypatch):
+    executor = agent_executor.new_agent_nft()
+    _answer(monkeypatch, executor, RATE_LIMITED)
+    with pytest.raises(ValueError) as e:
+        executor._eth_call(executor.precompiled["ownerOf"], (1,))
+    assert not isinstance(e.value, ContractLogicError)
+
+
+def test_batch_call_reverts_are_none(monkeypatch):
+    executor = agent_executor.new_agent_nft()
+    owner = "0x" + "00" * 12 + "ab" * 20
+    monkeypatch.setattr(agent_executor, "batch_request", lambda provider, calls, timeout=None: [
+        {"id": 0, "result": owner}, {"id": 1, "error": REVERT}])
+    assert executor.owners_of([1, 2]) == [to_checksum_address("0x" + "ab" * 20), None]
+
+    monkeypatch.setattr(agent_executor, "batch_request", lambda provider, calls, timeout=None: [{"id": 0, "error": RATE_LIMITED}])
+    with pytest.raises(ValueError):
+        executor.owners_of([1])
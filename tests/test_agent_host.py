@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+import json
+import queue
+import threading
+import time
+
+from eth_account import Account
+from werkzeug.test import Client
+
+from conftest import EchoParam, EchoResponse
+from pyagentlayer import LAgent, agent_logger, metrics
+from pyagentlayer.agent_host import AgentHost
+from pyagentlayer.utils.exceptions import CircuitOpenException
+
+
+def _echo_agent(agent_id):
+    agent = LAgent(name=f"echo-{agent_id}", private_key=Account.create().key.hex(), http_endpoint="http://localhost:8000",
+                   agent_id=agent_id)
+    agent.aa_wallet_address = Account.create().address
+
+    @agent.on_message("echo", EchoParam, EchoResponse)
+    def echo(ctx, param: EchoParam):
+        return EchoResponse(value=param.value)
+
+    return agent
+
+
+def test_logs_sent_by_their_own_agent(monkeypatch):
+    monkeypatch.setattr(agent_logger, "log_queue", queue.Queue())
+    sent = []
+    done = threading.Event()
+
+    def record_log_sync(agent, log):
+        sent.append((agent.agent_id, log.agent_id))
+        if len(sent) == 2:
+            done.set()
+
+    monkeypatch.setattr(agent_logger, "record_log_sync", record_log_sync)
+    first, second = _echo_agent(11), _echo_agent(12)
+    threading.Thread(target=agent_logger.monitor_new_onchain_log, args=[first], daemon=True).start()
+    for agent in (first, second):
+        agent_logger.record_log(agent_logger.OnChainLog(agent.agent_id, "task", "", "echo", 1), agent)
+    assert done.wait(5)
+    assert sorted(sent) == [(11, 11), (12, 12)]
+
+
+def test_route_metrics_labeled_per_agent():
+    host = AgentHost(log_onchain=False)
+    host.mount(_echo_agent(21), prefix="/a")
+    host.mount(_echo_agent(22), prefix="/b")
+    client = Client(host)
+    before = metrics.request_count.value("22", "echo")
+    assert client.post("/a/echo", data=json.dumps({"value": 1}), content_type="application/json").status_code == 200
+    assert client.post("/b/echo", data=json.dumps({"value": 2}), content_type="application/json").status_code == 200
+    assert client.post("/b/echo", data=json.dumps({"value": 3}), content_type="application/json").status_code == 200
+    assert metrics.request_count.value("22", "echo") - before == 2
+    assert metrics.request_count.value("21", "echo") >= 1
+
+
+
+def test_shipper_waits_for_open_breaker(monkeypatch):
+    monkeypatch.setattr(agent_logger, "log_queue", queue.Queue())
+    attempts = []
+
+    def record_log_sync(agent, log):
+        attempts.append(time.monotonic())
+        raise CircuitOpenException(agent.agent_id, retry_after=0.2)
+
+    monkeypatch.setattr(agent_logger, "record_log_sync", record_log_sync)
+    agent = _echo_agent(13)
+    agent_logger.record_log(agent_logger.OnChainLog(13, "task", "", "echo", 1), agent)
+    threading.Thread(target=agent_logger.monitor_new_onchain_log, args=[agent], daemon=True).start()
+    time.sleep(0.5)
+    # one attempt per retry_after instead of a busy loop
+    assert 2 <= len(attempts) <= 4
@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+import pytest
+from web3 import Web3
+
+from pyagentlayer import agent_executor
+from pyagentlayer.agent_index import AgentIndex, AgentIndexCrawler
+from pyagentlayer.bench import LocalChain, LocalIPFS
+from pyagentlayer.rpc_provider import batch_request
+from pyagentlayer.utils import ipfs as ipfs_module
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    chain = LocalChain().start()
+    monkeypatch.setattr(agent_executor, "rpc_endpoint", chain.url)
+    yield chain
+    chain.stop()
+
+
+@pytest.fixture
+def ipfs(monkeypatch):
+    ipfs = LocalIPFS().start()
+    monkeypatch.setattr(ipfs_module, "ipfs_gateway", ipfs.gateway_url)
+    yield ipfs
+    ipfs.stop()
+
+
+class _FlakyIPFSClient:
+    def __init__(self, client, failing: set):
+        self.client = client
+        self.failing = failing
+
+    def download_file(self, cid):
+        if cid in self.failing:
+            raise IOError("gateway timeout")
+        return self.client.download_file(cid)
+
+
+def _metadata(name):
+    return {"key": name, "name": name, "description": f"{name} agent", "version": "1", "endpoint": "http://x", "register_time": 1}
+
+
+def test_failed_downloads_are_retried(chain, ipfs):
+    owner = "0x" + "1" * 40
+    ok_cid, flaky_cid = ipfs.add_json(_metadata("auditor")), ipfs.add_json(_metadata("oracle"))
+    chain.mint(owner, ok_cid)
+    flaky_id = chain.mint(owner, flaky_cid)
+
+    index = AgentIndex()
+    ipfs_client = _FlakyIPFSClient(ipfs.client(), {flaky_cid})
+    crawler = AgentIndexCrawler(index, agent_nft=agent_executor.new_agent_nft(), ipfs_client=ipfs_client)
+    assert crawler.sync() == 1
+    assert index.get(flaky_id) is None
+    assert list(index.pending) == [flaky_id]
+
+    ipfs_client.failing.clear()
+    # no new block, the pending agent is retried anyway
+    assert crawler.sync() == 1
+    assert index.get(flaky_id).name == "oracle"
+    assert index.pending == {}
+    assert [agent_id for agent_id, _ in index.search("oracle")] == [flaky_id]
+
+
+def test_batch_call_through_provider(chain):
+    nft = agent_executor.new_agent_nft()
+    token_id = chain.mint("0x" + "2" * 40, "ipfs://a")
+    assert nft.token_uris([token_id, token_id + 100]) == ["ipfs://a", None]
+
+
+def test_batch_request_refused(chain, monkeypatch):
+    provider = Web3.HTTPProvider(chain.url)
+    monkeypatch.setattr("pyagentlayer.rpc_provider.make_post_request",
+                        lambda *args, **kwargs: b'{"jsonrpc": "2.0", "id": null, "error": {"code": -32005, "message": "limit exceeded"}}')
+    with pytest.raises(ValueError, match="limit exceeded"):
+        batch_request(provider, [("eth_blockNumber", [])])
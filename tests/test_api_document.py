@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+
+from conftest import EchoParam, EchoResponse
+
+
+def _asgi_get(app, path: str, headers: list = ()):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers), "client": ("127.0.0.1", 1)}
+    asyncio.run(app(scope, receive, send))
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return sent[0]["status"], dict(sent[0]["headers"]), body
+
+
+def test_flask_api_list_revalidated(agent):
+    client = agent.create_app(log_onchain=False).test_client()
+    response = client.get("/")
+    assert response.status_code == 200 and response.headers["Cache-Control"] == "no-cache"
+    assert "/echo" in response.get_json()["paths"]
+    etag = response.headers["ETag"]
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.data == b""
+
+    @agent.on_message("other", EchoParam, EchoResponse)
+    def other(ctx, param: EchoParam):
+        return param
+
+    # a new route is a new document
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+
+def test_asgi_api_list_revalidated(agent):
+    app = agent.create_asgi_app(log_onchain=False)
+    status, headers, body = _asgi_get(app, "/")
+    assert status == 200 and headers[b"cache-control"] == b"no-cache"
+    assert json.loads(body) == agent.api_list()
+    etag = headers[b"etag"]
+
+    status, _, body = _asgi_get(app, "/", [(b"if-none-match", b"W/" + etag)])
+    assert status == 304 and body == b""
+    # same etag from both servers
+    assert agent.create_app(log_onchain=False).test_client().get("/").headers["ETag"].encode() == etag
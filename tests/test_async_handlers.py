@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+import time
+
+from conftest import EchoParam, EchoResponse
+from pyagentlayer import agent as agent_module
+from pyagentlayer import asgi
+from pyagentlayer.utils.sse import iter_events
+
+
+async def _asgi_call(app, path: str, payload: dict, headers: list = ()):
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # the client stays connected until the response is over
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "client": ("127.0.0.1", 1),
+             "headers": [(b"content-type", b"application/json")] + list(headers)}
+    await app(scope, receive, send)
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return sent[0]["status"], body
+
+
+def test_task_id_per_request(agent, monkeypatch):
+    logged, outbound, seen = [], [], []
+    monkeypatch.setattr(agent_module, "record_log", lambda log, sender=None: logged.append(log.task_id))
+    monkeypatch.setattr(asgi, "start_log_shipper", lambda sender: None)
+    monkeypatch.setattr(agent.agent_link, "call", lambda agent_id, task_id, *args, **kwargs: outbound.append(task_id))
+
+    @agent.on_message("slow", EchoParam, EchoResponse)
+    async def slow(ctx, param: EchoParam):
+        await asyncio.sleep(0.05)
+        # requests overlap here, each must still see its own id
+        agent.send(2, "echo", {"value": param.value})
+        seen.append((ctx.task_id, agent.task_id))
+        return EchoResponse(value=param.value)
+
+    app = agent.create_asgi_app(log_onchain=True)
+
+    async def run():
+        return await asyncio.gather(*[_asgi_call(app, "/slow", {"value": i}) for i in range(5)])
+
+    assert [status for status, _ in asyncio.run(run())] == [200] * 5
+    task_ids = [ctx_task_id for ctx_task_id, _ in seen]
+    assert len(set(task_ids)) == 5
+    assert all(ctx_task_id == agent_task_id for ctx_task_id, agent_task_id in seen)
+    assert sorted(outbound) == sorted(task_ids)
+    assert sorted(logged) == sorted(task_ids)
+
+
+def _register(agent):
+    @agent.on_message("double", EchoParam, EchoResponse)
+    async def double(ctx, param: EchoParam):
+        await asyncio.sleep(0)
+        return EchoResponse(value=param.value * 2)
+
+    @agent.on_message("count", EchoParam, EchoResponse)
+    async def count(ctx, param: EchoParam):
+        for i in range(param.value):
+            await asyncio.sleep(0)
+            yield EchoResponse(value=i)
+
+    @agent.on_message("fail", EchoParam, EchoResponse)
+    async def fail(ctx, param: EchoParam):
+        raise RuntimeError("boom")
+
+
+def _values(body: bytes) -> list:
+    return [event.json()["value"] for event in iter_events(body.decode().split("\n")) if event.event == "message"]
+
+
+def test_async_handlers_under_wsgi(agent):
+    _register(agent)
+    client = agent.create_app(log_onchain=False).test_client()
+    assert client.post("/double", json={"value": 2}).get_json()["value"] == 4
+    response = client.post("/count", json={"value": 3}, headers={"Accept": "text/event-stream"})
+    assert response.mimetype == "text/event-stream" and _values(response.data) == [0, 1, 2]
+    assert client.post("/fail", json={"value": 1}).status_code == 500
+
+
+def test_async_handlers_under_asgi(agent):
+    _register(agent)
+    app = agent.create_asgi_app(log_onchain=False)
+
+    async def run():
+        return await asyncio.gather(_asgi_call(app, "/double", {"value": 2}),
+                                    _asgi_call(app, "/count", {"value": 3}, [(b"accept", b"text/event-stream")]),
+                                    _asgi_call(app, "/fail", {"value": 1}))
+
+    (status, body), (stream_status, stream), (fail_status, _) = asyncio.run(run())
+    assert status == 200 and json.loads(body)["value"] == 4
+    assert stream_status == 200 and _values(stream) == [0, 1, 2]
+    assert fail_status == 500
+
+
+def test_asgi_sync_handlers_leave_the_loop_free(agent):
+    @agent.on_message("sleep", EchoParam, EchoResponse)
+    def sleep(ctx, param: EchoParam):
+        time.sleep(0.2)
+        return EchoResponse(value=param.value)
+
+    app = agent.create_asgi_app(log_onchain=False)
+
+    async def run():
+        return await asyncio.gather(*[_asgi_call(app, "/sleep", {"value": i}) for i in range(4)])
+
+    start = time.perf_counter()
+    assert [status for status, _ in asyncio.run(run())] == [200] * 4
+    # run in threads, not one after the other on the event loop
+    assert time.perf_counter() - start < 0.6
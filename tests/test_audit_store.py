@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+from tools.audit_store import FILE_UNIT, FindingsStore, split_units, unit_keys
+
+SOURCE = """
+pragma solidity ^0.8.0;
+// token
+contract A is B {
+    uint x; // state
+    modifier only() { require(msg.sender == o); _; }
+    function f(uint a) public only { x = g(a); }
+    function g(uint a) internal returns (uint) { return a + 1; }
+    function h() external { emit E(); }
+    function h(uint y) external { }
+    event E();
+}
+"""
+
+
+def test_split_units():
+    assert set(split_units(SOURCE)) == {FILE_UNIT, "A", "A.only", "A.f", "A.g", "A.h", "A.h#2"}
+
+
+def test_unparsable_source_is_one_unit():
+    assert list(split_units("contract { broken")) == [FILE_UNIT]
+
+
+def test_keys_ignore_whitespace_and_comments():
+    reformatted = SOURCE.replace("// state", "/* other comment */").replace("    uint x;", "uint   x ;")
+    assert unit_keys(split_units(reformatted)) == unit_keys(split_units(SOURCE))
+
+
+def test_change_invalidates_unit_and_dependents():
+    before = unit_keys(split_units(SOURCE))
+    after = unit_keys(split_units(SOURCE.replace("return a + 1;", "return a + 2;")))
+    changed = {unit for unit in before if before[unit] != after[unit]}
+    # f calls g, h, h#2 and only don't
+    assert changed == {"A.g", "A.f"}
+
+
+def test_store_reuses_findings_of_unchanged_units(tmp_path):
+    path = str(tmp_path / "findings.json")
+    keys = unit_keys(split_units(SOURCE))
+    store = FindingsStore(path)
+    reused, recomputed = store.lookup(keys)
+    assert reused == [] and set(recomputed) == set(keys)
+    store.record(keys, recomputed, ["reentrancy in f", "h emits nothing", "general problem"])
+
+    store = FindingsStore(path)
+    reused, recomputed = store.lookup(keys)
+    assert set(reused) == {"reentrancy in f", "h emits nothing", "general problem"} and recomputed == []
+
+    changed = unit_keys(split_units(SOURCE.replace("return a + 1;", "return a + 2;")))
+    reused, recomputed = store.lookup(changed)
+    # findings naming no unit are filed under every unit audited, they are reused only when nothing changed
+    assert reused == ["h emits nothing"]
+    assert set(recomputed) == {"A.g", "A.f"}
+
+    reused, recomputed = store.lookup(unit_keys(split_units(SOURCE), "other model"))
+    # findings of another prompt or model are not reused
+    assert reused == [] and set(recomputed) == set(keys)
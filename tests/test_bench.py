@@ -0,0 +1,31 @@
+# -*- coding:utf-8 -*-
+from pyagentlayer import agent_executor
+from pyagentlayer.bench import LocalChain, LocalIPFS, run_bench, run_call_bench, use_local_network
+from pyagentlayer.utils import ipfs as ipfs_module
+
+
+def test_call_bench_restores_endpoint():
+    rpc_endpoint = agent_executor.rpc_endpoint
+    report = run_call_bench(iterations=2)
+    assert set(report.to_json()) == {"isSubscribed", "getSubscriptionPrice", "ownerOf"}
+    assert agent_executor.rpc_endpoint == rpc_endpoint
+
+
+def test_bench_restores_endpoints(agent):
+    rpc_endpoint, ipfs_gateway = agent_executor.rpc_endpoint, ipfs_module.ipfs_gateway
+    report = run_bench(agent, payload={"value": 1}, total_requests=5, concurrency=1)
+    assert report.errors == 0
+    assert (agent_executor.rpc_endpoint, ipfs_module.ipfs_gateway) == (rpc_endpoint, ipfs_gateway)
+
+
+def test_local_network_switched_until_restored(agent):
+    rpc_endpoint = agent_executor.rpc_endpoint
+    chain, ipfs = LocalChain().start(), LocalIPFS().start()
+    try:
+        endpoints = use_local_network(agent, chain, ipfs)
+        assert agent_executor.rpc_endpoint == chain.url and ipfs_module.ipfs_gateway == ipfs.gateway_url
+        endpoints.restore()
+        assert agent_executor.rpc_endpoint == rpc_endpoint
+    finally:
+        chain.stop()
+        ipfs.stop()
@@ -0,0 +1,33 @@
+# -*- coding:utf-8 -*-
+from pyagentlayer.utils.cid import CHUNK_SIZE, CIDBuilder, compute_cid
+
+# cids printed by `ipfs add` (v0) and `ipfs add --cid-version=1` (raw leaves) with their default chunker
+VECTORS = [
+    (b"", "QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH", "bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku"),
+    (b"hello world", None, "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e"),
+    (b"hello world\n", "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o", None),
+]
+
+
+def test_known_cids():
+    for data, v0, v1 in VECTORS:
+        if v0:
+            assert compute_cid(data) == v0
+        if v1:
+            assert compute_cid(data, version=1) == v1
+
+
+def test_pieces_cut_like_the_whole():
+    data = bytes(range(256)) * (CHUNK_SIZE // 128 + 3)
+    builder = CIDBuilder()
+    for start in range(0, len(data), 100003):
+        builder.update(data[start:start + 100003])
+    assert builder.cids() == (compute_cid(data), compute_cid(data, version=1))
+
+
+def test_multi_chunk_root_is_dag_pb():
+    data = b"\0" * (2 * CHUNK_SIZE + 1)
+    assert compute_cid(data).startswith("Qm")
+    # more than one chunk: the v1 root is a dag-pb node over raw leaves
+    assert compute_cid(data, version=1).startswith("bafybei")
+    assert compute_cid(data[:CHUNK_SIZE], version=1).startswith("bafkrei")
@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+import time
+
+import pytest
+import requests
+from requests.exceptions import ReadTimeout
+
+from pyagentlayer import InMemoryRegistryClient
+from pyagentlayer.agent_link import AgentLink
+from pyagentlayer.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from pyagentlayer.models import AgentMetadata
+from pyagentlayer.utils.exceptions import AgentCallException, CircuitOpenException
+
+
+def _open_breaker(**options) -> CircuitBreaker:
+    breaker = CircuitBreaker(min_calls=2, open_timeout=0.05, **options)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False, 0.0)
+    assert breaker.state == OPEN and not breaker.allow()
+    return breaker
+
+
+def test_opens_on_failure_rate():
+    breaker = CircuitBreaker(min_calls=4, failure_rate_threshold=0.5)
+    for success in (True, True, False):
+        breaker.allow()
+        breaker.record(success, 0.0)
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.record(False, 0.0)
+    assert breaker.state == OPEN
+
+
+def test_opens_on_slow_calls():
+    breaker = CircuitBreaker(min_calls=2, slow_call_threshold=0.1, slow_call_rate_threshold=1.0)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record(True, 1.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = _open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(True, 0.0)
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_failed_probe_opens_again():
+    breaker = _open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False, 0.0)
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_cancelled_probe_is_given_back():
+    breaker = _open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+class _Session:
+    # answers from a list instead of the network
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.sent = 0
+
+    def post(self, url, **kwargs):
+        self.sent += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def _metadata(name, endpoint=""):
+    return AgentMetadata(key="", name=name, description="", version="1.0.0", endpoint=endpoint, register_time=0)
+
+
+def _link(answers) -> AgentLink:
+    registry = InMemoryRegistryClient()
+    registry._put(1, "", _metadata("target", "http://target").to_json())
+    return AgentLink(registry, session=_Session(answers), breaker_options={"min_calls": 1, "open_timeout": 0.05})
+
+
+def _call(link, parameters=None, **kwargs):
+    return link.call(1, "task", "echo", parameters or {}, _metadata("caller"), **kwargs)
+
+
+def _half_open(link):
+    with pytest.raises(AgentCallException):
+        _call(link)
+    assert link.breakers[1].state == OPEN
+    time.sleep(0.06)
+
+
+def test_link_timeout_raises_call_exception():
+    link = _link([ReadTimeout()])
+    with pytest.raises(AgentCallException) as e:
+        _call(link)
+    assert e.value.status_code is None
+    assert isinstance(e.value.__cause__, ReadTimeout)
+    with pytest.raises(CircuitOpenException):
+        _call(link)
+    assert link.session.sent == 1
+
+
+def test_link_probe_kept_when_encoding_fails():
+    link = _link([ReadTimeout()])
+    _half_open(link)
+    with pytest.raises(TypeError):
+        # not encodable, fails before anything is sent
+        _call(link, {"value": object()})
+    assert link.session.sent == 1
+    assert link.breakers[1].allow()
+
+
+def test_link_probe_kept_by_stream_never_iterated():
+    link = _link([ReadTimeout()])
+    _half_open(link)
+    _call(link, sync=False)
+    assert link.breakers[1].allow()
+
+
+def test_link_stream_probe_failure_opens_again():
+    link = _link([ReadTimeout(), ReadTimeout()])
+    _half_open(link)
+    stream = _call(link, sync=False)
+    with pytest.raises(AgentCallException):
+        next(stream)
+    # the failed probe opened the circuit again
+    assert link.breakers[1].state == OPEN
+
+
+def _answer(status_code):
+    response = requests.Response()
+    response.status_code, response._content = status_code, b'{"value": 1}'
+    return response
+
+
+def test_hedge_only_after_transport_or_server_errors():
+    link = _link([_answer(400)])
+    with pytest.raises(AgentCallException) as e:
+        _call(link, hedge=True)
+    # a refused call is final, no second request
+    assert e.value.status_code == 400 and link.session.sent == 1
+
+    for failure in (ReadTimeout(), _answer(503)):
+        link = _link([failure, _answer(200)])
+        _call(link, hedge=True)
+        assert link.session.sent == 2
+
+
+def test_compact_fallback_only_when_form_refused():
+    link = _link([_answer(415), _answer(200)])
+    link.capabilities[1] = ([], [])
+    _call(link)
+    assert link.session.sent == 2 and 1 not in link.capabilities
+
+    link = _link([_answer(401)])
+    link.capabilities[1] = ([], [])
+    with pytest.raises(AgentCallException) as e:
+        _call(link)
+    assert e.value.status_code == 401 and link.session.sent == 1
@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from pyagentlayer.utils import codec
+
+
+def test_gzip_round_trip():
+    data = b"x" * 1_000_000
+    assert codec.decompress(codec.compress(data, codec.GZIP), codec.GZIP) == data
+
+
+def test_gzip_concatenated_members():
+    assert codec.decompress(gzip.compress(b"ab") + gzip.compress(b"cd"), codec.GZIP) == b"abcd"
+
+
+def test_gzip_bomb_is_rejected():
+    bomb = gzip.compress(b"\0" * (64 * 1024 * 1024))
+    with pytest.raises(codec.BodyTooLargeError):
+        codec.decompress(bomb, codec.GZIP, max_size=1024 * 1024)
+
+
+def test_identity_body_over_limit_is_rejected():
+    with pytest.raises(codec.BodyTooLargeError):
+        codec.decompress(b"x" * 11, None, max_size=10)
+
+
+def test_truncated_gzip_is_invalid():
+    with pytest.raises(ValueError):
+        codec.decompress(gzip.compress(b"x" * 100_000)[:-20], codec.GZIP)
+
+
+@pytest.mark.skipif(codec.zstandard is None, reason="zstandard not installed")
+def test_zstd_bomb_is_rejected():
+    bomb = codec.compress(b"\0" * (64 * 1024 * 1024), codec.ZSTD)
+    with pytest.raises(codec.BodyTooLargeError):
+        codec.decompress(bomb, codec.ZSTD, max_size=1024 * 1024)
+
+
+def test_flask_app_rejects_compressed_bomb(agent, monkeypatch):
+    monkeypatch.setattr(codec, "MAX_BODY_SIZE", 1024 * 1024)
+    client = agent.create_app(log_onchain=False).test_client()
+    body = gzip.compress(json.dumps({"value": 1, "padding": " " * (4 * 1024 * 1024)}).encode())
+    response = client.post("/echo", data=body, headers={"Content-Type": codec.JSON, "Content-Encoding": codec.GZIP})
+    assert response.status_code == 413
+
+    response = client.post("/echo", data=gzip.compress(b'{"value": 1}'), headers={"Content-Type": codec.JSON, "Content-Encoding": codec.GZIP})
+    assert response.status_code == 200
+    assert response.json == {"value": 1}
+
+
+def test_flask_app_rejects_large_body(agent, monkeypatch):
+    monkeypatch.setattr(codec, "MAX_BODY_SIZE", 1024)
+    client = agent.create_app(log_onchain=False).test_client()
+    response = client.post("/echo", data=b" " * 2048, headers={"Content-Type": codec.JSON})
+    assert response.status_code == 413
+
+
+def _asgi_post(app, body: bytes, chunk_size: int, headers: list):
+    messages = [{"type": "http.request", "body": body[i:i + chunk_size], "more_body": i + chunk_size < len(body)}
+                for i in range(0, len(body), chunk_size)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/echo", "headers": headers, "client": ("127.0.0.1", 1)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], messages
+
+
+def test_asgi_app_stops_reading_large_body(agent, monkeypatch):
+    monkeypatch.setattr(codec, "MAX_BODY_SIZE", 1024)
+    app = agent.create_asgi_app(log_onchain=False)
+    status, unread = _asgi_post(app, b" " * 8192, 512, [(b"content-type", b"application/json")])
+    assert status == 413
+    # the rest of the body was never read
+    assert unread
+
+    status, _ = _asgi_post(app, b" " * 2048, 2048, [(b"content-type", b"application/json"), (b"content-length", b"2048")])
+    assert status == 413
+
+
+def test_asgi_app_rejects_compressed_bomb(agent, monkeypatch):
+    monkeypatch.setattr(codec, "MAX_BODY_SIZE", 1024 * 1024)
+    app = agent.create_asgi_app(log_onchain=False)
+    body = gzip.compress(json.dumps({"value": 1, "padding": " " * (4 * 1024 * 1024)}).encode())
+    status, _ = _asgi_post(app, body, 65536, [(b"content-type", b"application/json"), (b"content-encoding", b"gzip")])
+    assert status == 413
@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+import requests
+from eth_account import Account
+
+from conftest import EchoParam, EchoResponse
+from pyagentlayer import InMemoryRegistryClient, LAgent
+from pyagentlayer.agent_link import AgentLink
+from pyagentlayer.models import AgentMetadata
+
+
+class _Session:
+    # answers GET / of the reachable agents, refuses the connection for the others
+    def __init__(self, reachable):
+        self.reachable = reachable
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        if url not in self.reachable:
+            raise requests.ConnectionError(f"connection to {url} refused")
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Accept-Post"] = "application/json, application/msgpack"
+        return response
+
+
+def _dependent_agent(session):
+    registry = InMemoryRegistryClient()
+    for agent_id in (7, 8, 9):
+        metadata = AgentMetadata(key="", name=f"agent-{agent_id}", description="", version="1.0.0",
+                                 endpoint=f"http://agent-{agent_id}", register_time=0)
+        registry._put(agent_id, "", metadata.to_json())
+    agent = LAgent(name="test", private_key=Account.create().key.hex(), http_endpoint="http://localhost:8000", agent_id=1,
+                   depends_on=["7", 8])
+    agent.agent_link = AgentLink(registry, session=session)
+
+    @agent.on_message("echo", EchoParam, EchoResponse, depends_on=[8, 9])
+    def echo(ctx, param: EchoParam):
+        return EchoResponse(value=param.value)
+
+    return agent
+
+
+def test_dependencies_of_agent_and_routes():
+    assert _dependent_agent(_Session([])).dependencies() == [7, 8, 9]
+
+
+def test_prefetch_warms_up_each_dependency():
+    session = _Session(["http://agent-7/", "http://agent-8/"])
+    agent = _dependent_agent(session)
+    errors = agent.prefetch_dependencies()
+    assert sorted(session.urls) == ["http://agent-7/", "http://agent-8/", "http://agent-9/"]
+    # a failed warm up is reported, not raised
+    assert errors[7] is None and errors[8] is None and isinstance(errors[9], requests.ConnectionError)
+    assert set(agent.agent_link.capabilities) == {7, 8}
+
+
+def test_prefetch_opens_sessions(monkeypatch):
+    agent = _dependent_agent(_Session(["http://agent-7/", "http://agent-8/", "http://agent-9/"]))
+    opened = []
+    monkeypatch.setattr(agent.agent_link, "session_token",
+                        lambda agent_id, *args, **kwargs: opened.append((agent_id, kwargs["force"])))
+    assert agent.prefetch_dependencies(open_sessions=True) == {7: None, 8: None, 9: None}
+    assert sorted(opened) == [(7, True), (8, True), (9, True)]
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+import pytest
+from eth_account import Account
+
+from pyagentlayer import agent_executor
+from pyagentlayer.bench import LocalChain
+from pyagentlayer.fee_oracle import FeeOracle, argument_shape
+from pyagentlayer.models import SubscriptionPeriodEnum
+from pyagentlayer.utils.exceptions import TransactionFailedException
+
+CONTRACT = "0x" + "ab" * 20
+
+
+class _Eth:
+    def __init__(self):
+        self.block_reads = 0
+
+    def get_block(self, block):
+        self.block_reads += 1
+        return {"baseFeePerGas": 100}
+
+    @property
+    def max_priority_fee(self):
+        return 10
+
+
+class _W3:
+    def __init__(self):
+        self.eth = _Eth()
+
+
+class _Tracker:
+    def __init__(self):
+        self.block = 1
+
+    def block_number(self):
+        return self.block
+
+
+class _Estimate:
+    def __init__(self, gas=1000):
+        self.gas = gas
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.gas
+
+
+def test_fees_read_once_per_block():
+    w3, tracker = _W3(), _Tracker()
+    oracle = FeeOracle(w3, tracker)
+    assert oracle.fees() == {"maxFeePerGas": 210, "maxPriorityFeePerGas": 10}
+    oracle.fees()
+    assert w3.eth.block_reads == 1
+    tracker.block = 2
+    oracle.fees()
+    assert w3.eth.block_reads == 2
+
+
+def test_gas_keyed_by_argument_shape():
+    oracle = FeeOracle(_W3(), _Tracker(), gas_margin=1.5)
+    estimate = _Estimate()
+    assert oracle.gas(CONTRACT, "safeMint", estimate, ("ipfs://a",)) == 1500
+    assert oracle.gas(CONTRACT, "safeMint", estimate, ("ipfs://b",)) == 1500
+    assert estimate.calls == 1
+    # a longer uri costs more gas, it is estimated on its own
+    oracle.gas(CONTRACT, "safeMint", estimate, ("ipfs://" + "a" * 100,))
+    assert estimate.calls == 2
+    assert argument_shape((1, "ab", [b"x", b"yz"])) == ("int", ("str", 2), ("array", 2, (("bytes", 1), ("bytes", 2))))
+
+
+def test_forget_drops_contract_estimates():
+    oracle = FeeOracle(_W3(), _Tracker())
+    estimate = _Estimate()
+    oracle.gas(CONTRACT, "safeMint", estimate, ("a",))
+    oracle.gas("0x" + "cd" * 20, "safeMint", estimate, ("a",))
+    oracle.forget(CONTRACT.upper())
+    oracle.gas(CONTRACT, "safeMint", estimate, ("a",))
+    oracle.gas("0x" + "cd" * 20, "safeMint", estimate, ("a",))
+    assert estimate.calls == 3
+
+
+def test_disabled_leaves_fields_to_web3():
+    oracle = FeeOracle(_W3(), _Tracker(), enabled=False)
+    assert oracle.transaction_fields(CONTRACT, "safeMint", _Estimate(), ("a",)) == {}
+
+
+def test_failed_transaction_raises_and_forgets(monkeypatch):
+    chain = LocalChain().start()
+    monkeypatch.setattr(agent_executor, "rpc_endpoint", chain.url)
+    try:
+        account = Account.create()
+        wallet = chain.smart_wallet_of(account.address, create=True)
+        target = chain.smart_wallet_of(Account.create().address, create=True)
+        chain.prices[(SubscriptionPeriodEnum.MONTHLY.value, target.lower())] = 10 ** 18
+        executor = agent_executor.new_smart_wallet(account=account, smart_wallet_address=wallet)
+        # the wallet holds no tokens, the subscription reverts
+        with pytest.raises(TransactionFailedException) as e:
+            executor.subscribe(target, SubscriptionPeriodEnum.MONTHLY)
+        assert e.value.receipt["status"] == 0
+        assert not [key for key in executor.fee_oracle._gas if key[0] == wallet.lower()]
+    finally:
+        chain.stop()
@@ -0,0 +1,34 @@
+# -*- coding:utf-8 -*-
+from tools.finding_clusters import cluster_findings, estimated_jaccard, minhash
+
+CODE = """
+contract Vault {
+    function withdraw(uint amount) external { msg.sender.call{value: amount}(""); balances[msg.sender] -= amount; }
+    function setOwner(address owner_) external { owner = owner_; }
+}
+"""
+
+FINDINGS = [
+    "Reentrancy in withdraw: the external call is made before the balance of the sender is updated.",
+    "Reentrancy in withdraw: the external call is made before the balance of the sender is updated, funds can be drained.",
+    "withdraw makes the external call first and updates the sender balance afterwards, an attacker re-enters to drain it.",
+    "setOwner has no access control, anyone can take ownership of the vault.",
+]
+
+
+def test_minhash_estimates_similarity():
+    assert estimated_jaccard(minhash(FINDINGS[0]), minhash(FINDINGS[0])) == 1.0
+    assert estimated_jaccard(minhash(FINDINGS[0]), minhash(FINDINGS[3])) < 0.2
+    assert minhash("") is None
+
+
+def test_near_duplicates_and_paraphrases_grouped():
+    clusters = cluster_findings(FINDINGS, CODE)
+    assert sorted(sorted(members) for members in clusters) == [[0, 1, 2], [3]]
+    # representatives come first and clusters are ordered by them
+    assert clusters == sorted(clusters, key=lambda members: members[0])
+
+
+def test_unrelated_findings_kept_apart():
+    clusters = cluster_findings(FINDINGS[2:], CODE)
+    assert sorted(sorted(members) for members in clusters) == [[0], [1]]
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+from pyagentlayer.agent_link import AgentLink
+from pyagentlayer.models import AgentMetadata
+
+CID = "bafkreiexample"
+METADATA = AgentMetadata(key="k", name="caller", description="", version="1.0.0", endpoint="", register_time=0).to_json()
+
+
+class _AgentNft:
+    def __init__(self):
+        self.reads = 0
+
+    def token_uri(self, agent_id):
+        self.reads += 1
+        return CID if agent_id == 7 else "bafkreiother"
+
+
+class _IPFSClient:
+    def __init__(self, fail=False):
+        self.downloads = 0
+        self.fail = fail
+
+    def download_file(self, cid, timeout=None):
+        self.downloads += 1
+        if self.fail:
+            raise IOError("gateway timeout")
+        return METADATA
+
+
+class _Registry:
+    def __init__(self, ipfs_client):
+        self.agent_nft = _AgentNft()
+        self.ipfs_client = ipfs_client
+
+
+def test_ref_resolved_once():
+    link = AgentLink(_Registry(_IPFSClient()))
+    assert link.resolve_metadata_ref(f"7:{CID}").name == "caller"
+    assert link.resolve_metadata_ref(f"7:{CID}").name == "caller"
+    assert link.agent_client.ipfs_client.downloads == 1
+
+
+def test_cid_must_be_token_uri_of_agent():
+    link = AgentLink(_Registry(_IPFSClient()))
+    # the cid of agent 7 claimed for agent 8
+    assert link.resolve_metadata_ref(f"8:{CID}") is None
+    assert link.agent_client.ipfs_client.downloads == 0
+
+
+def test_failed_ref_not_retried_right_away():
+    link = AgentLink(_Registry(_IPFSClient(fail=True)))
+    assert link.resolve_metadata_ref(f"7:{CID}") is None
+    assert link.resolve_metadata_ref(f"7:{CID}") is None
+    assert link.agent_client.ipfs_client.downloads == 1
+    assert link.agent_client.agent_nft.reads == 1
@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import threading
+import time
+
+from conftest import EchoParam, EchoResponse
+from pyagentlayer import metrics
+
+
+def test_shards_of_ended_threads_are_merged():
+    counter = metrics.Counter("test_total", "test", ["route"])
+    threads = [threading.Thread(target=counter.inc, args=("a",)) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    counter.inc("a")
+    assert counter.value("a") == 51
+    # only the shard of the current thread is left
+    assert len(counter._shards) == 1
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "test", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert histogram.samples() == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_stream_timed_until_exhausted():
+    histogram = metrics.Histogram("test_stream_seconds", "test", ["route"])
+
+    def chunks():
+        time.sleep(0.05)
+        yield 1
+        time.sleep(0.05)
+        yield 2
+
+    stream = histogram.time_stream(chunks(), time.perf_counter(), "r")
+    assert histogram._merged() == {}
+    assert list(stream) == [1, 2]
+    assert histogram._merged()[("r",)][-1] >= 0.1
+
+
+def test_async_stream_timed_until_closed():
+    histogram = metrics.Histogram("test_async_stream_seconds", "test", ["route"])
+    closed = []
+
+    async def chunks():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield 1
+        finally:
+            closed.append(True)
+
+    async def consume():
+        stream = histogram.time_stream(chunks(), time.perf_counter(), "r")
+        assert await stream.__anext__() == 1
+        await stream.aclose()
+
+    asyncio.run(consume())
+    assert closed == [True]
+    assert sum(histogram._merged()[("r",)][:-1]) == 1
+
+
+def test_streaming_handler_latency(agent):
+    @agent.on_message("stream", EchoParam, EchoResponse)
+    def stream(ctx, param: EchoParam):
+        time.sleep(0.05)
+        yield EchoResponse(value=param.value)
+
+    before = metrics.handler_latency._merged().get(("1", "stream"), [0])[-1]
+    res = agent.call_function(stream, EchoParam(value=1), log_onchain=False, route_name="stream")
+    # the generator hasn't run yet
+    assert metrics.handler_latency._merged().get(("1", "stream"), [0])[-1] == before
+    assert [chunk.value for chunk in res] == [1]
+    assert metrics.handler_latency._merged()[("1", "stream")][-1] - before >= 0.05
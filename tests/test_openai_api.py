@@ -0,0 +1,47 @@
+# -*- coding:utf-8 -*-
+from tools import openai_api
+
+
+def _ask(answers, asked):
+    def ask(prompt, stage=None, stats=None, model=None):
+        asked.append((stage, model or openai_api.stage_model(stage)))
+        return answers.pop(0)
+    return ask
+
+
+def test_stage_model(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL_ID", "strong")
+    monkeypatch.delenv("OPENAI_MODEL_ID_VUL_CHECK", raising=False)
+    assert openai_api.stage_model() == openai_api.stage_model("vul_check") == "strong"
+    monkeypatch.setenv("OPENAI_MODEL_ID_VUL_CHECK", "cheap")
+    assert openai_api.stage_model("vul_check") == "cheap" and openai_api.stage_model("detect") == "strong"
+
+
+def test_escalates_only_uncertain_answers(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL_ID", "strong")
+    monkeypatch.setenv("OPENAI_MODEL_ID_VUL_CHECK", "cheap")
+    asked = []
+    monkeypatch.setattr(openai_api, "ask_openai_common", _ask(['{"result":"no"}'], asked))
+    assert openai_api.ask_with_escalation("prompt", "vul_check") == '{"result":"no"}'
+    assert asked == [("vul_check", "cheap")]
+
+    asked.clear()
+    monkeypatch.setattr(openai_api, "ask_openai_common", _ask(['{"result":"High possibility"}', '{"result":"yes"}'], asked))
+    assert openai_api.ask_with_escalation("prompt", "vul_check") == '{"result":"yes"}'
+    assert asked == [("vul_check", "cheap"), ("vul_check_escalated", "strong")]
+
+
+def test_no_escalation_when_stage_uses_strong_model(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL_ID", "strong")
+    monkeypatch.delenv("OPENAI_MODEL_ID_VUL_CHECK", raising=False)
+    asked = []
+    monkeypatch.setattr(openai_api, "ask_openai_common", _ask(['{"result":"low possibility"}'], asked))
+    assert openai_api.ask_with_escalation("prompt", "vul_check") == '{"result":"low possibility"}'
+    assert asked == [("vul_check", "strong")]
+
+
+def test_stage_stats():
+    stats = openai_api.StageStats()
+    stats.record("detect", "cheap", 0.5, {"prompt_tokens": 10, "completion_tokens": 2})
+    stats.record("detect", "cheap", 0.25, {})
+    assert stats.summary() == {"detect": {"model": "cheap", "calls": 2, "latency": 0.75, "prompt_tokens": 10, "completion_tokens": 2}}
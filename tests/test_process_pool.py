@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+import os
+import time
+
+import pytest
+
+from pyagentlayer import Model
+from pyagentlayer.process_pool import SHARED_MEMORY_MIN_SIZE, ProcessPool
+
+
+class Payload(Model):
+    text: str
+    data: bytes
+    path: str = ""
+
+
+def describe(ctx, payload: Payload):
+    return {"text": payload.text[:3], "text_size": len(payload.text), "data_type": type(payload.data).__name__,
+            "data_size": len(payload.data), "readonly": getattr(payload.data, "readonly", None)}
+
+
+def slow(ctx, payload: Payload):
+    time.sleep(0.2)
+    if payload.path:
+        open(payload.path, "w").close()
+    return {}
+
+
+def _payload(path=""):
+    return Payload(text="é" * SHARED_MEMORY_MIN_SIZE, data=b"\x01" * SHARED_MEMORY_MIN_SIZE, path=path)
+
+
+def test_large_fields_through_shared_memory():
+    pool = ProcessPool("describe", max_workers=1)
+    try:
+        result = pool.call(describe, None, _payload(), timeout=10)
+    finally:
+        pool.shutdown()
+    assert result == {"text": "ééé", "text_size": SHARED_MEMORY_MIN_SIZE, "data_type": "bytes",
+                      "data_size": SHARED_MEMORY_MIN_SIZE, "readonly": None}
+
+
+def test_shared_buffers_passed_as_memoryview():
+    pool = ProcessPool("describe", max_workers=1, shared_buffers=True)
+    try:
+        result = pool.call(describe, None, _payload(), timeout=10)
+    finally:
+        pool.shutdown()
+    assert result["data_type"] == "memoryview" and result["readonly"] is True
+    assert result["data_size"] == SHARED_MEMORY_MIN_SIZE
+
+
+def test_call_cut_off_while_queued_is_cancelled(tmp_path):
+    pool = ProcessPool("slow", max_workers=1).start()
+    try:
+        # one call running, the next ones fill the queue handed to the worker (one more call than workers)
+        busy = [pool.submit(slow, None, _payload()) for _ in range(3)]
+        marker = str(tmp_path / "ran")
+        with pytest.raises(TimeoutError):
+            pool.call(slow, None, _payload(marker), timeout=0.05)
+        for future in busy:
+            future.result(timeout=10)
+        time.sleep(0.5)
+        assert not os.path.exists(marker)
+        assert pool.queue_depth == 0
+    finally:
+        pool.shutdown()
@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+import time
+
+from pyagentlayer.read_cache import CachePolicy, ReadCache
+
+CONTRACT = "0x" + "ab" * 20
+
+
+class _Tracker:
+    def __init__(self):
+        self.block = 1
+
+    def block_number(self):
+        return self.block
+
+
+class _Load:
+    def __init__(self):
+        self.blocks = []
+
+    def __call__(self, block_identifier):
+        self.blocks.append(block_identifier)
+        return len(self.blocks)
+
+
+def test_cached_for_the_block():
+    tracker, load = _Tracker(), _Load()
+    cache = ReadCache(tracker, {"ownerOf": CachePolicy()})
+    assert cache.call(CONTRACT, "ownerOf", (1,), load) == 1
+    assert cache.call(CONTRACT, "ownerOf", (1,), load) == 1
+    assert cache.call(CONTRACT, "ownerOf", (2,), load) == 2
+    tracker.block = 2
+    assert cache.call(CONTRACT, "ownerOf", (1,), load) == 3
+    # reads are pinned to the block they are cached for
+    assert load.blocks == [1, 1, 2]
+
+
+def test_uncached_functions_read_latest():
+    load = _Load()
+    cache = ReadCache(_Tracker(), {"ownerOf": CachePolicy()})
+    cache.call(CONTRACT, "isSubscribed", (1,), load)
+    cache.call(CONTRACT, "isSubscribed", (1,), load)
+    assert load.blocks == ["latest", "latest"]
+    cache.enabled = False
+    cache.call(CONTRACT, "ownerOf", (1,), load)
+    assert load.blocks[-1] == "latest"
+
+
+def test_stale_while_revalidate():
+    tracker, load = _Tracker(), _Load()
+    cache = ReadCache(tracker, {"getSubscriptionPrice": CachePolicy(stale_while_revalidate=60)})
+    assert cache.call(CONTRACT, "getSubscriptionPrice", (2,), load) == 1
+    tracker.block = 2
+    # the stale value is answered while it is read again in the background
+    assert cache.call(CONTRACT, "getSubscriptionPrice", (2,), load) == 1
+    deadline = time.monotonic() + 5
+    while cache.call(CONTRACT, "getSubscriptionPrice", (2,), load) != 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert load.blocks == [1, 2]
+
+
+def test_clear_after_own_write():
+    load = _Load()
+    cache = ReadCache(_Tracker(), {"ownerOf": CachePolicy()})
+    cache.call(CONTRACT, "ownerOf", (1,), load)
+    cache.clear()
+    assert cache.call(CONTRACT, "ownerOf", (1,), load) == 2
@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+import pytest
+from eth_account import Account
+
+from pyagentlayer import InMemoryRegistryClient, LAgent, SQLiteRegistryClient
+from pyagentlayer.models import AgentMetadata
+
+
+def _metadata(name):
+    return AgentMetadata(key="", name=name, description="", version="1.0.0", endpoint="", register_time=0)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def registry(request):
+    return InMemoryRegistryClient() if request.param == "memory" else SQLiteRegistryClient()
+
+
+def test_shared_registry_binds_each_agent_wallet(registry):
+    first = LAgent(name="first", private_key=Account.create().key.hex(), http_endpoint="", registry_client=registry)
+    second = LAgent(name="second", private_key=Account.create().key.hex(), http_endpoint="", registry_client=registry)
+
+    first_id = first.agent_client.register(_metadata("first"))
+    second_id = second.agent_client.register(_metadata("second"))
+    assert first.agent_client.is_owner(first_id) and not first.agent_client.is_owner(second_id)
+    assert second.agent_client.is_owner(second_id) and not second.agent_client.is_owner(first_id)
+    # both views read the same store
+    assert first.agent_client.get_agent_meta(second_id).name == "second"
+    assert registry.get_agent_meta(first_id).name == "first"
+
+
+def test_reserved_id_is_not_registered(registry):
+    agent_id = registry._next_agent_id()
+    with pytest.raises(ValueError):
+        registry.get_agent_meta(agent_id)
+    assert registry.export_snapshot() == {"agents": []}
+
+
+def test_snapshot_round_trip(registry):
+    owner = Account.create().address
+    registry.for_wallet(owner).register(_metadata("a"))
+    copy = InMemoryRegistryClient(wallet_address=owner, snapshot=registry.export_snapshot())
+    assert copy.is_owner(1)
+    assert copy.get_agent_meta(1).name == "a"
@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+from pyagentlayer.rpc_provider import BalancedHTTPProvider, is_endpoint_error, required_block
+
+
+class _Node:
+    def __init__(self, block=10, error=None):
+        self.block = block
+        self.error = error
+        self.methods = []
+
+    def make_request(self, method, params):
+        self.methods.append(method)
+        if self.error is not None:
+            return {"jsonrpc": "2.0", "id": 1, "error": self.error}
+        if method == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(self.block)}
+        return {"jsonrpc": "2.0", "id": 1, "result": "0x01"}
+
+
+def _provider(*nodes):
+    provider = BalancedHTTPProvider([f"http://node{i}" for i in range(len(nodes))], hedge_after=5, probe_interval=0)
+    for endpoint, node in zip(provider.endpoints, nodes):
+        endpoint.provider = node
+    return provider
+
+
+def test_required_block():
+    assert required_block("eth_call", [{}, "0x10"]) == 16
+    assert required_block("eth_call", [{}, "latest"]) is None
+    assert required_block("eth_getLogs", [{"fromBlock": "0x1", "toBlock": "0x5"}]) == 5
+    assert required_block("eth_chainId", []) is None
+
+
+def test_error_answers_count_against_health():
+    assert is_endpoint_error({"error": {"code": -32005, "message": "limit exceeded"}})
+    assert not is_endpoint_error({"error": {"code": 3, "message": "execution reverted", "data": "0x"}})
+    assert not is_endpoint_error({"error": {"code": -32000, "message": "execution reverted"}})
+
+    limited, healthy = _Node(error={"code": -32005, "message": "limit exceeded"}), _Node()
+    provider = _provider(limited, healthy)
+    provider.endpoints[1].latency = 1.0
+    for _ in range(2):
+        # the rate limited node is tried first, the answer comes from the other one
+        assert provider.make_request("eth_chainId", [])["result"] == "0x01"
+    assert not provider.endpoints[0].healthy
+    provider.make_request("eth_chainId", [])
+    assert limited.methods == ["eth_chainId", "eth_chainId"]
+
+
+def test_block_pinned_reads_go_to_synced_nodes():
+    behind, ahead = _Node(block=10), _Node(block=12)
+    provider = _provider(behind, ahead)
+    for endpoint in provider.endpoints:
+        provider._request(endpoint, "eth_blockNumber", [])
+    # the lagging node is faster, but doesn't have block 12 yet
+    provider.endpoints[0].latency, provider.endpoints[1].latency = 0.01, 1.0
+    provider.make_request("eth_call", [{}, hex(12)])
+    assert "eth_call" not in behind.methods and "eth_call" in ahead.methods
+    provider.make_request("eth_call", [{}, hex(10)])
+    assert "eth_call" in behind.methods
+    assert [e["block"] for e in provider.stats()] == [10, 12]
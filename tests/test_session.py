@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+import time
+
+from eth_account import Account
+
+from pyagentlayer.models import AgentMetadata
+from pyagentlayer.session import SessionTokens
+
+AGENT_A = Account.create().address
+AGENT_B = Account.create().address
+CALLER = Account.create().address
+
+
+def _metadata(wallet):
+    return AgentMetadata(key="", name="caller", description="", version="1.0.0", endpoint="", register_time=0, wallet=wallet)
+
+
+def test_round_trip():
+    tokens = SessionTokens(secret="secret", ttl=60)
+    token, expires_at = tokens.issue(AGENT_A, CALLER)
+    assert expires_at <= time.time() + 60
+    assert tokens.verify(AGENT_A, token) == CALLER.lower()
+
+
+def test_token_bound_to_issuing_agent():
+    # agents sharing AGENT_SESSION_SECRET must not accept each other's tokens
+    token, _ = SessionTokens(secret="shared").issue(AGENT_A, CALLER)
+    assert SessionTokens(secret="shared").verify(AGENT_A, token) == CALLER.lower()
+    assert SessionTokens(secret="shared").verify(AGENT_B, token) is None
+
+
+def test_expired_and_tampered_tokens():
+    tokens = SessionTokens(secret="secret")
+    token, _ = tokens.issue(AGENT_A, CALLER, subscription_expires_at=int(time.time()) - 1)
+    assert tokens.verify(AGENT_A, token) is None
+
+    token, _ = tokens.issue(AGENT_A, CALLER)
+    wallet, expires_at, signature = token.split(".")
+    other = Account.create().address.lower()
+    assert tokens.verify(AGENT_A, f"{other}.{expires_at}.{signature}") is None
+    assert tokens.verify(AGENT_A, f"{wallet}.{int(expires_at) + 1}.{signature}") is None
+    assert tokens.verify(AGENT_A, "garbage") is None
+    assert tokens.verify(AGENT_A, None) is None
+
+
+def test_agent_rejects_token_of_another_agent(agent):
+    caller = _metadata(CALLER)
+    token, _ = agent.session_tokens.issue(agent.aa_wallet_address, CALLER)
+    assert agent._valid_session(caller, token)
+
+    foreign, _ = agent.session_tokens.issue(AGENT_B, CALLER)
+    assert not agent._valid_session(caller, foreign)
+    # a token issued to another wallet is not valid for the claimed one
+    assert not agent._valid_session(_metadata(AGENT_B), token)
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+from tools.function_signatures.solidity_parser import SolidityParseError, extract_signatures
+
+SOURCE = """
+pragma solidity ^0.8.0;
+
+function add(uint a, uint b) pure returns (uint) { return a + b; }
+
+contract Token {
+    function transfer(address to, uint amount) external returns (bool) { return true; }
+}
+"""
+
+
+def test_free_functions_are_internal():
+    free = extract_signatures(SOURCE)[""]["functions"]
+    assert [(f["signature"], f["visibility"], f["state_mutability"]) for f in free] == [("add(uint256,uint256)", "internal", "pure")]
+
+
+def test_contract_declarations():
+    contract = extract_signatures("""
+    // function ignored(uint) in a comment
+    contract Vault is Ownable(msg.sender), IVault {
+        event Deposit(address indexed from, uint value);
+        error Insufficient(uint needed);
+        modifier onlyAdmin { _; }
+        function (uint) external callback;
+        constructor(address owner_) payable {}
+        function deposit(uint[] calldata amounts, IERC20.Permit memory permit) public payable override(IVault) onlyAdmin {}
+        function balance(address payable who) external view returns (uint, bytes32) { return (0, "}"); }
+        receive() external payable {}
+    }
+    """)["Vault"]
+    assert contract["kind"] == "contract"
+    assert contract["events"] == ["Deposit(address,uint256)"] and contract["errors"] == ["Insufficient(uint256)"]
+    assert contract["modifiers"] == ["onlyAdmin()"]
+    assert [(f["signature"], f["visibility"], f["state_mutability"], f["returns"]) for f in contract["functions"]] == [
+        ("constructor(address)", "public", "payable", []),
+        ("deposit(uint256[],IERC20.Permit)", "public", "payable", []),
+        ("balance(address)", "external", "view", ["uint256", "bytes32"]),
+        ("receive()", "external", "payable", []),
+    ]
+
+
+def test_interface_functions_default_to_external():
+    interface = extract_signatures("interface IVault { function total() returns (uint); }")["IVault"]
+    assert interface["kind"] == "interface" and interface["functions"][0]["visibility"] == "external"
+
+
+def test_unparsable_source():
+    for source in ("pragma solidity ^0.8.0;", "contract A { function f( }", 'contract A { string s = "unterminated; }'):
+        with pytest.raises(SolidityParseError):
+            extract_signatures(source)
@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from conftest import EchoParam, EchoResponse
+from pyagentlayer.utils.base_request import BaseRequestClient
+from pyagentlayer.utils.sse import (EVENT_DONE, EVENT_ERROR, HEARTBEAT, format_event, iter_events, stream_events,
+                                    stream_events_async)
+
+
+class _Client(BaseRequestClient):
+    pass
+
+
+class _StreamedResponse:
+    # what requests hands over for a streamed body
+    status_code = 200
+
+    def __init__(self, body: str):
+        self.body = body
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        return iter(self.body.split("\n"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class _Session:
+    def __init__(self, body: str):
+        self.body = body
+
+    def post(self, url, **kwargs):
+        return _StreamedResponse(self.body)
+
+
+def test_framing_round_trip():
+    body = HEARTBEAT + format_event("first\nsecond", id="1") + format_event('{"a": 1}') + format_event("", event=EVENT_DONE)
+    events = list(iter_events(body.split("\n")))
+    assert [(e.event, e.data, e.id) for e in events] == [("message", "first\nsecond", "1"), ("message", '{"a": 1}', "1"),
+                                                         (EVENT_DONE, "", "1")]
+    assert events[1].json() == {"a": 1}
+
+
+def test_stream_sends_keepalive_while_handler_is_busy():
+    def chunks():
+        time.sleep(0.15)
+        yield "slow"
+
+    body = list(stream_events(chunks(), lambda chunk: chunk, heartbeat_interval=0.05))
+    assert body[0] == body[1] == HEARTBEAT
+    assert body[-2:] == ["data: slow\n\n", format_event("", event=EVENT_DONE)]
+
+
+def test_async_stream_ends_with_error_event():
+    async def chunks():
+        yield "one"
+        raise RuntimeError("boom")
+
+    async def collect():
+        return [event async for event in stream_events_async(chunks(), lambda chunk: chunk, heartbeat_interval=5)]
+
+    events = list(iter_events("".join(asyncio.run(collect())).split("\n")))
+    assert [event.event for event in events] == ["message", EVENT_ERROR]
+    assert events[1].json() == {"success": False, "message": "Internal Server Error"}
+
+
+def test_flask_stream_decoded_by_client(agent):
+    @agent.on_message("count", EchoParam, EchoResponse)
+    def count(ctx, param: EchoParam):
+        for i in range(param.value):
+            yield EchoResponse(value=i)
+
+    response = agent.create_app(log_onchain=False).test_client().post("/count", json={"value": 3},
+                                                                       headers={"Accept": "text/event-stream"})
+    assert response.mimetype == "text/event-stream" and response.headers["Cache-Control"] == "no-cache"
+    client = _Client(_Session(response.get_data(as_text=True)))
+    assert [chunk.value for chunk in client.send_async("http://agent/count", {}, {}, EchoResponse)] == [0, 1, 2]
+
+
+def test_client_raises_error_event():
+    body = format_event('{"a": 1}') + format_event("failed", event=EVENT_ERROR)
+    stream = _Client(_Session(body)).send_async("http://agent/count", {}, {})
+    assert next(stream) == '{"a": 1}'
+    with pytest.raises(ValueError):
+        next(stream)
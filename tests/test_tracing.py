@@ -0,0 +1,41 @@
+# -*- coding:utf-8 -*-
+import json
+
+from pyagentlayer import tracing
+from pyagentlayer.utils.sse import stream_events
+
+
+def test_spans_written_by_background_thread(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    exporter = tracing.JsonLinesFileExporter(str(path), flush_interval=60)
+    tracing.set_exporter(exporter)
+    try:
+        with tracing.start_span("outer"):
+            with tracing.start_span("inner"):
+                pass
+    finally:
+        tracing.set_exporter(tracing.NoopSpanExporter())
+    # nothing is written on the request path
+    assert not path.exists()
+    exporter.flush()
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["inner", "outer"]
+    assert spans[0]["parent_id"] == spans[1]["span_id"]
+
+
+def test_buffer_bounded(tmp_path):
+    exporter = tracing.JsonLinesFileExporter(str(tmp_path / "spans.jsonl"), flush_interval=60, max_buffered=1)
+    exporter.export(tracing.Span("a", "0" * 32))
+    exporter.export(tracing.Span("b", "0" * 32))
+    assert exporter.dropped == 1
+
+
+def test_stream_keeps_context_of_response():
+    def handler():
+        yield tracing.current_span().name
+
+    with tracing.start_span("agent.request"):
+        body = stream_events(handler(), lambda chunk: chunk, heartbeat_interval=5)
+    # the server iterates the body once the request span is over
+    assert tracing.current_span() is None
+    assert "data: agent.request\n\n" in list(body)
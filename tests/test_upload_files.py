@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+import io
+import json
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "tools", "function_signatures"))
+
+import upload_file  # noqa: E402
+
+SOURCE = b"contract A { function f(uint a) external {} }"
+
+
+def _zip(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _upload(files: list, query=""):
+    client = upload_file.app.test_client()
+    response = client.post(f"/upload_files{query}", data={"file": [(io.BytesIO(content), name) for name, content in files]},
+                           content_type="multipart/form-data")
+    return response.status_code, response.mimetype, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_upload_files_streams_one_line_per_source():
+    status, mimetype, lines = _upload([("a.sol", SOURCE), ("sources.zip", _zip({"b.sol": SOURCE, "readme.md": b"no"})),
+                                       ("broken.sol", b"contract B { function f( }")])
+    assert status == 200 and mimetype == "application/x-ndjson"
+    by_name = {line["filename"]: line for line in lines}
+    assert set(by_name) == {"a.sol", "b.sol", "broken.sol"}
+    # identical sources share one result
+    assert by_name["a.sol"]["sha256"] == by_name["b.sol"]["sha256"]
+    assert by_name["a.sol"]["signatures"]["A"]["functions"][0]["signature"] == "f(uint256)"
+    assert "error" in by_name["broken.sol"] and "signatures" not in by_name["broken.sol"]
+
+
+def test_upload_files_limits(monkeypatch):
+    monkeypatch.setattr(upload_file, "MAX_FILE_SIZE", 16)
+    status, _, lines = _upload([("large.sol", SOURCE)])
+    assert status == 200 and lines == [{"filename": "large.sol", "error": "File size exceeds 0MB limit"}]
+
+    monkeypatch.setattr(upload_file, "MAX_FILES", 1)
+    status, _, lines = _upload([("a.sol", b"contract A {}"), ("b.sol", b"contract B {}")])
+    assert status == 400 and "more than 1 files" in lines[0]["error"]
+
+    status, _, lines = _upload([])
+    assert status == 400